@@ -0,0 +1,188 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from app import app
+from autoresponse_service import normalize_text
+
+def normalize_question(text: str) -> str:
+    """Chave do texto: sem acentos, minúsculas, sem pontuação e espaços repetidos"""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', normalize_text(text)).split())
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256((prompt or '').encode('utf-8')).hexdigest()[:16]
+
+class AIResponseCache:
+    """Cache de respostas da IA para perguntas repetidas (FAQ)
+
+    Chave = texto normalizado + hash do prompt ativo. Eviction LRU com TTL;
+    opcionalmente persistido num SQLite local para sobreviver a reinícios.
+    Quando o prompt muda, as entradas do prompt anterior são descartadas.
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None, path: str = None):
+        self.MAX_ENTRIES = max_entries or int(os.environ.get('AI_CACHE_SIZE', '1000'))
+        self.TTL = ttl or float(os.environ.get('AI_CACHE_TTL', str(6 * 3600)))
+        self.MAX_QUESTION_LENGTH = 300  # Mensagens longas quase nunca se repetem
+        self.IDLE_MINUTES = int(os.environ.get('AI_CACHE_IDLE_MINUTES', '30'))
+        self.path = path if path is not None else os.environ.get(
+            'AI_CACHE_DB_PATH', os.path.join(app.instance_path, 'ai_cache.db'))
+
+        self._entries = OrderedDict()  # (prompt_hash, pergunta) -> (resposta, expira_em)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._prompt_hash = None
+        self._stats = {'hits': 0, 'misses': 0, 'bypassed': 0, 'evictions': 0, 'invalidations': 0}
+
+        if self.path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._init_db()
+                self._load()
+            except sqlite3.Error as e:
+                logging.error(f"Cache de IA sem persistência: {e}")
+                self.path = None
+
+    # Persistência ---------------------------------------------------------
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS ai_response_cache (
+                prompt_hash TEXT NOT NULL,
+                question TEXT NOT NULL,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (prompt_hash, question)
+            )
+        """)
+
+    def _load(self):
+        """Carregar as entradas válidas mais recentes"""
+        conn = self._connection()
+        conn.execute("DELETE FROM ai_response_cache WHERE expires_at < ?", (time.time(),))
+        rows = conn.execute(
+            "SELECT prompt_hash, question, response, expires_at FROM ai_response_cache "
+            "ORDER BY expires_at DESC LIMIT ?", (self.MAX_ENTRIES,)
+        ).fetchall()
+        wall_now, now = time.time(), time.monotonic()
+        for prompt_key, question, response, expires_at in reversed(rows):
+            self._entries[(prompt_key, question)] = (response, now + (expires_at - wall_now))
+        if rows:
+            logging.info(f"🗃️ Cache de IA carregado com {len(rows)} respostas")
+
+    def _persist(self, sql: str, params: tuple):
+        if not self.path:
+            return
+        try:
+            self._connection().execute(sql, params)
+        except sqlite3.Error as e:
+            logging.warning(f"Erro ao persistir cache de IA: {e}")
+
+    # API ------------------------------------------------------------------
+
+    def is_cacheable(self, question: str, history=None, summary: str = None) -> bool:
+        """Decidir se o histórico (ou o resumo da conversa) pode mudar a resposta
+
+        Só usa o cache quando a pergunta abre a conversa ou chega depois de
+        IDLE_MINUTES sem conversa; as mensagens do usuário no fim do histórico
+        são a própria pergunta e não contam. Com resumo e sem nenhuma troca
+        recente no histórico não há como saber se a conversa esfriou, então
+        a resposta depende do resumo e não vai para o cache.
+        """
+        if not question or len(question) > self.MAX_QUESTION_LENGTH:
+            return False
+
+        previous = list(history or [])
+        while previous and previous[-1].is_from_user:
+            previous.pop()
+        if not previous:
+            return not summary
+
+        last_exchange = previous[-1].timestamp
+        return bool(last_exchange) and datetime.utcnow() - last_exchange > timedelta(minutes=self.IDLE_MINUTES)
+
+    def get(self, question: str, prompt: str) -> Optional[str]:
+        key = self._key(question, prompt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[0]
+            if entry:
+                del self._entries[key]
+            self._stats['misses'] += 1
+        return None
+
+    def put(self, question: str, prompt: str, response: str):
+        key = self._key(question, prompt)
+        with self._lock:
+            self._entries[key] = (response, time.monotonic() + self.TTL)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.MAX_ENTRIES:
+                evicted.append(self._entries.popitem(last=False)[0])
+                self._stats['evictions'] += 1
+
+        self._persist(
+            "INSERT OR REPLACE INTO ai_response_cache (prompt_hash, question, response, expires_at) VALUES (?, ?, ?, ?)",
+            (key[0], key[1], response, time.time() + self.TTL)
+        )
+        for prompt_key, evicted_question in evicted:
+            self._persist("DELETE FROM ai_response_cache WHERE prompt_hash = ? AND question = ?",
+                          (prompt_key, evicted_question))
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats['bypassed'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self._persist("DELETE FROM ai_response_cache", ())
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _key(self, question: str, prompt: str) -> tuple:
+        current = prompt_hash(prompt)
+        if current != self._prompt_hash:
+            self._invalidate_other_prompts(current)
+        return current, normalize_question(question)
+
+    def _invalidate_other_prompts(self, current: str):
+        """Prompt mudou: respostas geradas com o prompt anterior não valem mais"""
+        with self._lock:
+            if current == self._prompt_hash:
+                return
+            stale = [key for key in self._entries if key[0] != current]
+            for key in stale:
+                del self._entries[key]
+            if self._prompt_hash is not None or stale:
+                self._stats['invalidations'] += 1
+            self._prompt_hash = current
+        self._persist("DELETE FROM ai_response_cache WHERE prompt_hash != ?", (current,))
+        if stale:
+            logging.info(f"🗃️ Prompt alterado - {len(stale)} respostas em cache descartadas")
+
+# Instância global
+ai_response_cache = AIResponseCache()
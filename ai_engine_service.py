@@ -0,0 +1,222 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional
+from rate_limit_service import rate_limiter, is_quota_error, retry_delay
+
+class Dispatch:
+    """Quando a geração saiu da fila do motor (limitador de taxa e semáforo) e foi à API
+
+    Quem mede latência (o hedging do ModelRouter) coloca um Dispatch em
+    current_dispatch antes de chamar o motor; espera por cota, pausa de
+    backoff ou vaga no semáforo não conta. Chamadas que não passam pelo
+    motor contam desde a criação.
+    """
+
+    def __init__(self):
+        self.sent_at = time.monotonic()
+        self.sent = asyncio.Event()
+        self.sent.set()
+
+    def queued(self):
+        """Geração entrou (ou voltou, num retry de cota) na fila do motor"""
+        self.sent_at = None
+        self.sent.clear()
+
+    def dispatched(self):
+        """Geração liberada pelo limitador e com vaga: a requisição vai sair agora"""
+        self.sent_at = time.monotonic()
+        self.sent.set()
+
+current_dispatch: ContextVar[Optional[Dispatch]] = ContextVar('current_dispatch', default=None)
+
+class AsyncAIEngine:
+    """Motor assíncrono das chamadas ao Gemini
+
+    Um único event loop numa thread dedicada executa as gerações pelo
+    cliente assíncrono do SDK (client.aio), limitado por um semáforo. Quem
+    está em código síncrono envia a corrotina com submit() e recebe um
+    Future; centenas de gerações ficam em andamento sem prender uma thread
+    cada.
+
+    Antes de cada chamada a geração espera sua vez no rate_limiter (RPM/TPM);
+    erros de cota pausam o limitador e a chamada é refeita em vez de falhar,
+    até AI_QUOTA_RETRIES vezes.
+    """
+
+    def __init__(self, max_concurrency: int = None):
+        self.MAX_CONCURRENCY = max_concurrency or int(os.environ.get('AI_MAX_CONCURRENCY', '64'))
+        self.DEFAULT_TIMEOUT = float(os.environ.get('AI_TIMEOUT', '60'))
+        self.QUOTA_RETRIES = int(os.environ.get('AI_QUOTA_RETRIES', '5'))
+        self._loop = None
+        self._semaphore = None
+        self._thread = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'in_flight': 0, 'waiting': 0, 'completed': 0, 'failed': 0}
+        self._tokens = {'prompt': 0, 'cached': 0, 'output': 0}
+
+    def start(self):
+        """Iniciar o event loop dedicado (idempotente)"""
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run_loop, name='ai-engine-loop', daemon=True)
+            self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self.MAX_CONCURRENCY)
+        self._started.set()
+        logging.info(f"🧠 Motor de IA assíncrono iniciado (até {self.MAX_CONCURRENCY} gerações simultâneas)")
+        self._loop.run_forever()
+
+    def submit(self, coroutine: Awaitable) -> Future:
+        """Agendar corrotina no loop do motor; retorna concurrent.futures.Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def run(self, coroutine: Awaitable, timeout: float = None) -> Any:
+        """Executar corrotina no motor e esperar o resultado (para chamadores síncronos)"""
+        return self.submit(coroutine).result(timeout or self.DEFAULT_TIMEOUT)
+
+    async def generate_content(self, client, model: str, contents, config=None):
+        """Gerar conteúdo respeitando o limite de taxa e de concorrência
+
+        Usa client.aio quando o SDK oferece; senão roda a chamada síncrona
+        num executor para não bloquear o loop.
+        """
+        kwargs = self._kwargs(model, contents, config)
+        estimate = self._estimate_tokens(contents, config)
+        dispatch = current_dispatch.get()
+        attempt = 0
+        while True:
+            if dispatch:
+                dispatch.queued()
+            await rate_limiter.acquire(estimate)
+            try:
+                async with self._slot():
+                    if dispatch:
+                        dispatch.dispatched()
+                    response = await self._generate(client, kwargs)
+            except Exception as e:
+                if not await self._retry_after_quota(e, attempt):
+                    raise
+                attempt += 1
+                continue
+            await self._record_usage(response, estimate)
+            return response
+
+    async def stream_content(self, client, model: str, contents, config=None) -> AsyncIterator[str]:
+        """Gerar em streaming, produzindo os trechos de texto conforme chegam
+
+        A vaga do semáforo fica ocupada até o fim do stream. Sem suporte a
+        streaming assíncrono no cliente, produz a resposta inteira de uma vez.
+        Erro de cota só é refeito se nenhum trecho foi entregue ainda.
+        """
+        kwargs = self._kwargs(model, contents, config)
+        estimate = self._estimate_tokens(contents, config)
+        dispatch = current_dispatch.get()
+        attempt = 0
+        while True:
+            if dispatch:
+                dispatch.queued()
+            await rate_limiter.acquire(estimate)
+            started = False
+            try:
+                async with self._slot():
+                    if dispatch:
+                        dispatch.dispatched()
+                    aio = getattr(client, 'aio', None)
+                    if aio is not None and hasattr(aio.models, 'generate_content_stream'):
+                        last_chunk = None
+                        async for chunk in await aio.models.generate_content_stream(**kwargs):
+                            last_chunk = chunk
+                            if chunk.text:
+                                started = True
+                                yield chunk.text
+                        # O uso acumulado vem no último pedaço
+                        await self._record_usage(last_chunk, estimate)
+                    else:
+                        response = await self._generate(client, kwargs)
+                        await self._record_usage(response, estimate)
+                        if response.text:
+                            started = True
+                            yield response.text
+                return
+            except Exception as e:
+                if started or not await self._retry_after_quota(e, attempt):
+                    raise
+                attempt += 1
+
+    async def _retry_after_quota(self, error: Exception, attempt: int) -> bool:
+        """Erro de cota: pausar o limitador e dizer se a chamada deve ser refeita"""
+        if not is_quota_error(error):
+            return False
+        await rate_limiter.record_quota_error(retry_delay(error))
+        return attempt < self.QUOTA_RETRIES
+
+    @staticmethod
+    def _estimate_tokens(contents, config) -> int:
+        """Tokens de entrada estimados (~4 caracteres cada); o uso real acerta o limitador depois"""
+        instruction = config.get('system_instruction') if isinstance(config, dict) \
+            else getattr(config, 'system_instruction', None)
+        return (len(str(contents)) + len(str(instruction or ''))) // 4 + 1
+
+    @staticmethod
+    def _kwargs(model: str, contents, config) -> Dict:
+        kwargs = {'model': model, 'contents': contents}
+        if config is not None:
+            kwargs['config'] = config
+        return kwargs
+
+    async def _generate(self, client, kwargs: Dict):
+        aio = getattr(client, 'aio', None)
+        if aio is not None:
+            return await aio.models.generate_content(**kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(client.models.generate_content, **kwargs))
+
+    @asynccontextmanager
+    async def _slot(self):
+        """Vaga no semáforo de concorrência, com contadores para get_stats()"""
+        self._stats['waiting'] += 1
+        async with self._semaphore:
+            self._stats['waiting'] -= 1
+            self._stats['in_flight'] += 1
+            try:
+                yield
+                self._stats['completed'] += 1
+            except BaseException:
+                self._stats['failed'] += 1
+                raise
+            finally:
+                self._stats['in_flight'] -= 1
+
+    async def _record_usage(self, response, estimate: int):
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', None) or 0
+        await rate_limiter.record_success(estimate, prompt_tokens)
+        if usage is None:
+            return
+        self._tokens['prompt'] += prompt_tokens
+        self._tokens['cached'] += getattr(usage, 'cached_content_token_count', None) or 0
+        self._tokens['output'] += getattr(usage, 'candidates_token_count', None) or 0
+
+    def get_stats(self) -> Dict:
+        # Contadores só mudam dentro do loop; cópia é suficiente para leitura
+        stats = dict(self._stats)
+        stats['max_concurrency'] = self.MAX_CONCURRENCY
+        stats['tokens'] = dict(self._tokens)
+        return stats
+
+# Instância global
+ai_engine = AsyncAIEngine()
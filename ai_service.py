@@ -1,5 +1,12 @@
 import os
+import re
+import asyncio
 import logging
+from concurrent.futures import Future
+from ai_engine_service import ai_engine
+from context_cache_service import context_cache
+from rate_limit_service import is_quota_error
+from model_router_service import model_router
 
 # Global variables for AI client
 client = None
@@ -7,10 +14,19 @@ genai = None
 types = None
 types_available = False
 
+MODEL_NAME = model_router.model('full')
+
 def initialize_ai_client():
     """Initialize or reinitialize the AI client with current API key"""
     global client, genai, types, types_available
     
+    if os.environ.get("AI_BACKEND") == "fake":
+        # Offline backend for development and cache/token experiments
+        from fake_gemini import FakeGeminiClient
+        client = FakeGeminiClient()
+        logging.info("🧪 Usando backend Gemini falso (AI_BACKEND=fake)")
+        return True
+    
     try:
         from google import genai as google_genai
         from google.genai import types as genai_types
@@ -41,77 +57,164 @@ def initialize_ai_client():
 # Initialize on module load
 initialize_ai_client()
 
+def ai_configured() -> bool:
+    """Whether an AI backend is configured (API key or the fake backend)"""
+    return bool(os.environ.get("GEMINI_API_KEY")) or os.environ.get("AI_BACKEND") == "fake"
+
 def get_custom_prompt():
-    """Get custom AI prompt from database"""
-    try:
-        from app import app, db
-        from models import SystemSettings
+    """Get custom AI prompt (cached in memory, refreshed when settings change)"""
+    from settings_service import settings_cache
+    
+    return settings_cache.get('ai_prompt')
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token for Portuguese text)"""
+    return len(text) // 4 + 1
+
+def build_conversation_context(conversation_history=None, summary: str = None, token_budget: int = None) -> str:
+    """
+    Combine the rolling summary with the most recent messages under a token budget
+    
+    The summary always goes in; recent messages are added newest first until
+    the budget runs out (at least the latest one), then put back in order.
+    """
+    token_budget = token_budget or int(os.environ.get('AI_CONTEXT_TOKENS', '1200'))
+    context = ""
+    used = 0
+    if summary:
+        context = f"Resumo da conversa até aqui:\n{summary}\n\n"
+        used = estimate_tokens(context)
+    
+    lines = []
+    for msg in reversed(list(conversation_history or [])):
+        sender = "Usuário" if msg.is_from_user else "AsA"
+        line = f"{sender}: {msg.content}\n"
+        cost = estimate_tokens(line)
+        if lines and used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+    
+    if lines:
+        context += "Histórico da conversa:\n" + "".join(reversed(lines)) + "\n"
+    return context
+
+def _prepare_request(user_message: str, conversation_history=None, summary: str = None):
+    """
+    Resolve prompt, history context and cache lookup on the calling thread
+    
+    Returns:
+        None when AI is unavailable, otherwise (cached_text, (system_instruction, contents), cache_key);
+        cached_text is set on a cache hit and cache_key only when the reply may be cached
+    """
+    # Try to reinitialize if client is not available
+    if not client:
+        initialize_ai_client()
+    
+    if not client:
+        return None
         
-        with app.app_context():
-            setting = SystemSettings.query.filter_by(setting_key='ai_prompt').first()
-            if setting and setting.setting_value:
-                return setting.setting_value
-    except Exception as e:
-        logging.error(f"Erro ao obter prompt personalizado: {e}")
+    # Get custom prompt
+    custom_prompt = get_custom_prompt()
+    
+    # Repeated questions (FAQ) are served from the cache when history doesn't matter
+    from ai_cache_service import ai_response_cache
+    
+    cacheable = ai_response_cache.is_cacheable(user_message, conversation_history, summary)
+    if cacheable:
+        cached = ai_response_cache.get(user_message, custom_prompt)
+        if cached:
+            logging.info("🗃️ Resposta de IA servida do cache")
+            return cached, None, None
+    else:
+        ai_response_cache.record_bypass()
     
-    # Default prompt if none configured
-    return """Você é um assistente virtual inteligente para WhatsApp.
-Você deve responder de forma útil, amigável e profissional.
-
-Instruções:
-- Responda em português brasileiro
-- Seja conciso mas informativo
-- Mantenha um tom amigável e profissional
-- Se não souber algo, seja honesto sobre isso
-- Evite respostas muito longas para WhatsApp"""
-
-def generate_ai_response(user_message: str, conversation_history=None) -> str:
+    # Build context from summary + recent history (bounded token budget)
+    context = build_conversation_context(conversation_history, summary)
+    
+    # Stable business prompt goes in the system instruction (cacheable across
+    # requests); only the per-turn context and message change between calls
+    contents = f"{context}Mensagem atual do usuário: {user_message}"
+    
+    return None, (custom_prompt, contents), (user_message, custom_prompt) if cacheable else None
+
+async def _generate_content(ai_client, system_instruction: str, contents, model: str = MODEL_NAME):
+    """Generate with the system instruction, referencing the context cache when there is one"""
+    config = await context_cache.config_for(ai_client, model, system_instruction)
+    try:
+        return await ai_engine.generate_content(ai_client, model, contents, config)
+    except Exception:
+        if 'cached_content' not in config:
+            raise
+        # Cache expired or was deleted on the server: retry once without it
+        context_cache.invalidate(model)
+        return await ai_engine.generate_content(ai_client, model, contents, {'system_instruction': system_instruction})
+
+async def _stream_content(ai_client, system_instruction: str, contents, model: str = MODEL_NAME):
+    """Streaming counterpart of _generate_content"""
+    config = await context_cache.config_for(ai_client, model, system_instruction)
+    started = False
+    try:
+        async for text in ai_engine.stream_content(ai_client, model, contents, config):
+            started = True
+            yield text
+    except Exception:
+        if started or 'cached_content' not in config:
+            raise
+        context_cache.invalidate(model)
+        async for text in ai_engine.stream_content(ai_client, model, contents,
+                                                   {'system_instruction': system_instruction}):
+            yield text
+
+async def _cache_response(cache_key, response_text: str):
+    """Store a finished reply; the cache write touches SQLite, so keep it off the event loop"""
+    if cache_key:
+        from ai_cache_service import ai_response_cache
+        await asyncio.get_running_loop().run_in_executor(
+            None, ai_response_cache.put, cache_key[0], cache_key[1], response_text
+        )
+
+def generate_ai_response_future(user_message: str, conversation_history=None, summary: str = None,
+                                message_count: int = 1, intent: dict = None) -> Future:
     """
-    Generate AI response using Gemini API
+    Start an AI response on the async engine without blocking the caller
     
-    Args:
-        user_message: The user's message
-        conversation_history: List of previous messages for context
+    Prompt, history and cache lookup are resolved on the calling thread (they
+    may touch the database); only the Gemini round trip runs on the engine.
+    The model tier is picked by model_router (message_count > 1 means a
+    queued burst, which always gets the full model), using `intent` from
+    analyze_message_intent when the caller already classified the message.
     
     Returns:
-        AI generated response
+        concurrent.futures.Future resolving to the AI response text
     """
     try:
-        # Try to reinitialize if client is not available
-        if not client:
-            initialize_ai_client()
+        request = _prepare_request(user_message, conversation_history, summary)
+        if request is None:
+            return _resolved("Desculpe, o serviço de IA não está disponível no momento.")
         
-        if not client:
-            return "Desculpe, o serviço de IA não está disponível no momento."
-            
-        # Get custom prompt
-        custom_prompt = get_custom_prompt()
-        
-        # Build context from conversation history
-        context = ""
-        if conversation_history:
-            context = "Histórico da conversa:\n"
-            for msg in conversation_history[-5:]:  # Last 5 messages for context
-                sender = "Usuário" if msg.is_from_user else "AsA"
-                context += f"{sender}: {msg.content}\n"
-            context += "\n"
+        cached, prompt, cache_key = request
+        if cached:
+            return _resolved(cached)
         
-        # Create prompt for AI
-        prompt = f"""
-        {custom_prompt}
-        
-        {context}
-        
-        Mensagem atual do usuário: {user_message}
-        """
-        
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
+        tier = model_router.route(user_message, message_count, intent)
+        return ai_engine.submit(_generate_response(client, *prompt, cache_key, tier))
+            
+    except Exception as e:
+        logging.error(f"Erro ao gerar resposta AI: {e}")
+        return _resolved("Desculpe, estou com problemas técnicos. Tente novamente em alguns minutos.")
+
+async def _generate_response(ai_client, system_instruction: str, contents, cache_key=None, tier: str = 'full') -> str:
+    """Gemini round trip on the engine loop (hedged across tiers); stores the reply in the cache when allowed"""
+    try:
+        response = await model_router.generate(
+            tier, lambda model: _generate_content(ai_client, system_instruction, contents, model)
         )
         
         if response.text:
-            return response.text.strip()
+            response_text = response.text.strip()
+            await _cache_response(cache_key, response_text)
+            return response_text
         else:
             return "Desculpe, não consegui processar sua mensagem no momento. Tente novamente."
             
@@ -119,6 +222,152 @@ def generate_ai_response(user_message: str, conversation_history=None) -> str:
         logging.error(f"Erro ao gerar resposta AI: {e}")
         return "Desculpe, estou com problemas técnicos. Tente novamente em alguns minutos."
 
+class ReplyChunker:
+    """Corta o texto em streaming em mensagens de WhatsApp
+
+    A primeira mensagem sai no primeiro fim de frase depois de FIRST_MIN
+    caracteres (o que mais importa é o tempo até a primeira mensagem); as
+    seguintes esperam um fim de parágrafo depois de MIN_CHARS, e nenhuma
+    passa de MAX_CHARS (corte no último fim de frase ou espaço).
+    """
+
+    SENTENCE_END = re.compile(r'[.!?…]+(?=\s)|\n')
+    PARAGRAPH_END = re.compile(r'\n\s*\n')
+
+    def __init__(self, first_min: int = None, min_chars: int = None, max_chars: int = None):
+        self.FIRST_MIN = first_min or int(os.environ.get('AI_STREAM_FIRST_CHARS', '40'))
+        self.MIN_CHARS = min_chars or int(os.environ.get('AI_STREAM_MIN_CHARS', '300'))
+        self.MAX_CHARS = max_chars or int(os.environ.get('AI_STREAM_MAX_CHARS', '1000'))
+        self._buffer = ""
+        self.emitted = 0
+
+    def feed(self, text: str) -> list:
+        """Adicionar texto recebido; retorna as mensagens já prontas"""
+        self._buffer += text
+        return self._drain()
+
+    def flush(self) -> list:
+        """Fim da geração: retorna tudo que sobrou"""
+        chunks = self._drain()
+        rest = self._buffer.strip()
+        self._buffer = ""
+        if rest:
+            self.emitted += 1
+            chunks.append(rest)
+        return chunks
+
+    def _drain(self) -> list:
+        chunks = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                return chunks
+            piece, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:].lstrip()
+            if piece:
+                self.emitted += 1
+                chunks.append(piece)
+
+    def _find_cut(self):
+        buffer = self._buffer
+        if self.emitted == 0:
+            match = self.SENTENCE_END.search(buffer, self.FIRST_MIN)
+            if match and match.end() <= self.MAX_CHARS:
+                return match.end()
+        else:
+            match = self.PARAGRAPH_END.search(buffer, self.MIN_CHARS)
+            if match and match.start() <= self.MAX_CHARS:
+                return match.start()
+
+        if len(buffer) <= self.MAX_CHARS:
+            return None
+
+        # Longo demais sem fronteira natural: último fim de frase, senão último espaço
+        window = buffer[:self.MAX_CHARS]
+        ends = [match.end() for match in self.SENTENCE_END.finditer(window)]
+        if ends and ends[-1] > self.MAX_CHARS // 2:
+            return ends[-1]
+        space = window.rfind(' ')
+        return space if space > 0 else self.MAX_CHARS
+
+def stream_ai_response(user_message: str, conversation_history=None, on_chunk=None, summary: str = None,
+                       message_count: int = 1, intent: dict = None) -> Future:
+    """
+    Stream an AI response, handing WhatsApp-sized pieces to on_chunk as they are ready
+    
+    on_chunk(text) runs on the engine loop and must not block.
+    
+    Returns:
+        concurrent.futures.Future resolving to the full response text,
+        or None when nothing could be generated (caller picks a fallback)
+    """
+    try:
+        request = _prepare_request(user_message, conversation_history, summary)
+        if request is None:
+            return _resolved(None)
+        
+        cached, prompt, cache_key = request
+        if cached:
+            # Mesmo corte de uma resposta gerada (mensagens de WhatsApp de até MAX_CHARS)
+            chunker = ReplyChunker()
+            for chunk in chunker.feed(cached) + chunker.flush():
+                on_chunk(chunk)
+            return _resolved(cached)
+        
+        tier = model_router.route(user_message, message_count, intent)
+        return ai_engine.submit(_stream_response(client, *prompt, cache_key, on_chunk, tier))
+        
+    except Exception as e:
+        logging.error(f"Erro ao iniciar resposta AI em streaming: {e}")
+        return _resolved(None)
+
+async def _stream_response(ai_client, system_instruction: str, contents, cache_key, on_chunk, tier: str = 'full'):
+    chunker = ReplyChunker()
+    full_text = ""
+    try:
+        async for text in model_router.stream(
+            tier, lambda model: _stream_content(ai_client, system_instruction, contents, model)
+        ):
+            full_text += text
+            for chunk in chunker.feed(text):
+                on_chunk(chunk)
+        for chunk in chunker.flush():
+            on_chunk(chunk)
+        
+        full_text = full_text.strip()
+        if full_text:
+            await _cache_response(cache_key, full_text)
+        return full_text or None
+        
+    except Exception as e:
+        logging.error(f"Erro na resposta AI em streaming: {e}")
+        if not chunker.emitted:
+            return None
+        # Parte já enviada: não mandar fallback por cima (o trecho incompleto é descartado)
+        return full_text.strip()
+
+def generate_ai_response(user_message: str, conversation_history=None, summary: str = None) -> str:
+    """
+    Generate AI response using Gemini API (blocks until the engine answers)
+    
+    Args:
+        user_message: The user's message
+        conversation_history: List of previous messages for context
+        summary: Rolling summary of older messages (Conversation.summary)
+    
+    Returns:
+        AI generated response
+    """
+    try:
+        return generate_ai_response_future(user_message, conversation_history, summary).result(ai_engine.DEFAULT_TIMEOUT)
+    except Exception as e:
+        logging.error(f"Erro ao gerar resposta AI: {e}")
+        return "Desculpe, estou com problemas técnicos. Tente novamente em alguns minutos."
+
+def _resolved(value) -> Future:
+    future = Future()
+    future.set_result(value)
+    return future
+
 def test_prompt_response(user_message: str, custom_prompt: str) -> str:
     """Test a prompt with a message without saving to database"""
     try:
@@ -129,16 +378,10 @@ def test_prompt_response(user_message: str, custom_prompt: str) -> str:
         if not client:
             return "Serviço de IA não disponível"
             
-        prompt = f"""
-        {custom_prompt}
-        
-        Mensagem atual do usuário: {user_message}
-        """
-        
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
-        )
+        response = ai_engine.run(ai_engine.generate_content(
+            client, MODEL_NAME, f"Mensagem atual do usuário: {user_message}",
+            {'system_instruction': custom_prompt}
+        ))
         
         if response.text:
             return response.text.strip()
@@ -163,10 +406,7 @@ def test_gemini_connection():
         # Test with a simple message
         test_prompt = "Responda apenas 'OK' para confirmar que você está funcionando."
         
-        response = test_client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=test_prompt
-        )
+        response = ai_engine.run(ai_engine.generate_content(test_client, MODEL_NAME, test_prompt))
         
         if response.text:
             return {"success": True, "response": response.text.strip()}
@@ -177,21 +417,35 @@ def test_gemini_connection():
         error_msg = str(e)
         if "API_KEY_INVALID" in error_msg or "invalid" in error_msg.lower():
             return {"success": False, "error": "Chave API inválida"}
-        elif "quota" in error_msg.lower():
+        elif is_quota_error(e):
             return {"success": False, "error": "Cota da API excedida"}
         else:
             return {"success": False, "error": f"Erro de conexão: {error_msg}"}
 
-def analyze_message_intent(message: str) -> dict:
+def analyze_message_intent(message: str, escalate: bool = True) -> dict:
     """
     Analyze message intent to determine best response strategy
     
+    The local classifier (keyword rules + model trained on message history)
+    answers when confident; only uncertain messages go to Gemini, and the
+    label Gemini returns is stored as training data. With escalate=False
+    (the reply path, which must not wait on an extra round trip) uncertain
+    messages get the local guess, with its lower 'confianca'.
+    
     Returns:
         Dict with intent analysis results
     """
+    from intent_service import intent_classifier, clean_intent
+    
+    local_intent, confident = intent_classifier.classify(message)
+    if confident:
+        intent_classifier.record('rules' if local_intent['origem'] == 'regras' else 'model')
+        return local_intent
+    
     try:
-        if not client or not types_available:
-            return {"tipo": "outro", "urgencia": "baixo", "requer_humano": False}
+        if not client or not escalate:
+            intent_classifier.record('fallback')
+            return local_intent
             
         prompt = f"""
         Analise a seguinte mensagem do WhatsApp e determine:
@@ -205,29 +459,26 @@ def analyze_message_intent(message: str) -> dict:
         {{"tipo": "pergunta|saudacao|pedido|reclamacao|outro", "urgencia": "baixo|medio|alto", "requer_humano": true|false}}
         """
         
-        if types:
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json"
-                )
-            )
-        else:
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=prompt
-            )
+        config = types.GenerateContentConfig(response_mime_type="application/json") if types \
+            else {'response_mime_type': 'application/json'}
+        # Classification is a small task: the lite tier is enough
+        response = ai_engine.run(ai_engine.generate_content(client, model_router.model('lite'), prompt, config))
         
         if response.text:
             import json
-            return json.loads(response.text)
-        else:
-            return {"tipo": "outro", "urgencia": "baixo", "requer_humano": False}
+            intent = clean_intent(json.loads(response.text))
+            if intent:
+                intent_classifier.record('gemini')
+                intent_classifier.record_label(message, intent)
+                return dict(intent, origem='gemini', confianca=1.0)
+        
+        intent_classifier.record('fallback')
+        return local_intent
             
     except Exception as e:
         logging.error(f"Erro ao analisar intenção da mensagem: {e}")
-        return {"tipo": "outro", "urgencia": "baixo", "requer_humano": False}
+        intent_classifier.record('fallback')
+        return local_intent
 
 def test_gemini_connection():
     """Test Gemini API connection with a simple message"""
@@ -242,10 +493,9 @@ def test_gemini_connection():
         # Test with a simple message
         test_message = "Olá, teste de conexão"
         
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=f"Responda de forma simples e amigável em português: {test_message}"
-        )
+        response = ai_engine.run(ai_engine.generate_content(
+            client, MODEL_NAME, f"Responda de forma simples e amigável em português: {test_message}"
+        ))
         
         if response.text:
             return {
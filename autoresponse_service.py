@@ -0,0 +1,164 @@
+import logging
+import threading
+import unicodedata
+from collections import deque
+from typing import Dict, List, Optional
+from app import app
+from models import AutoResponse
+from settings_service import VersionToken
+
+def normalize_text(text: str) -> str:
+    """Minúsculas e sem acentos, para casar 'Horário' com 'horario'"""
+    decomposed = unicodedata.normalize('NFKD', (text or '').lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+class CompiledRule:
+    """Resposta automática ativa já pronta para envio"""
+
+    __slots__ = ('id', 'keyword', 'trigger_type', 'pause_ai', 'text')
+
+    def __init__(self, response: AutoResponse):
+        self.id = response.id
+        self.keyword = normalize_text(response.trigger_keyword).strip()
+        self.trigger_type = response.trigger_type or 'first_message'
+        self.pause_ai = bool(response.pause_ai)
+        self.text = self._render(response)
+
+    @staticmethod
+    def _render(response: AutoResponse) -> str:
+        if response.response_type == 'multiple' and response.main_question:
+            # Resposta com múltipla escolha
+            text = response.main_question + "\n\n"
+            for letter, option in zip('abcd', (response.option_a, response.option_b,
+                                               response.option_c, response.option_d)):
+                if option:
+                    text += f"{letter}) {option}\n"
+            if response.pause_ai:
+                text += "\n_Aguardando sua escolha..._"
+            return text
+        return response.response_text
+
+class KeywordAutomaton:
+    """Aho-Corasick: encontra todas as palavras-chave numa única passada pelo texto"""
+
+    def __init__(self, rules: List[CompiledRule]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[CompiledRule]] = [[]]
+
+        for rule in rules:
+            if rule.keyword:
+                self._add(rule)
+        self._build_failure_links()
+
+    def _add(self, rule: CompiledRule):
+        state = 0
+        for char in rule.keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].append(rule)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def search(self, text: str) -> List[CompiledRule]:
+        """Regras cuja palavra-chave aparece como palavra inteira no texto (já normalizado)"""
+        matches = []
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for rule in self._output[state]:
+                start = position - len(rule.keyword) + 1
+                end = position + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    matches.append(rule)
+        return matches
+
+class AutoResponseMatcher:
+    """Respostas automáticas compiladas em memória
+
+    As regras ativas são separadas por gatilho (primeira mensagem /
+    continuidade) e compiladas num autômato de palavras-chave. Casar uma
+    mensagem não consulta o banco: a recompilação só acontece quando a versão
+    publicada por notify_changed() muda (um VersionToken próprio, conferido
+    por todos os workers do gunicorn a cada CHECK_INTERVAL).
+
+    Prioridade: a palavra-chave mais longa (mais específica) vence; empate vai
+    para a regra mais antiga. Sem nenhuma palavra-chave presente, vale a regra
+    ativa mais antiga do gatilho, como no comportamento anterior.
+    """
+
+    VERSION_SETTING = 'auto_responses_version'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._partitions = {}
+        self._version = None
+        self._built = False
+        self._version_token = VersionToken(self.VERSION_SETTING)
+
+    def notify_changed(self):
+        """Publicar nova versão das regras (chamar após salvar/excluir AutoResponse)"""
+        self._version_token.bump()
+
+    def match(self, message: str, is_first_message: bool) -> Optional[CompiledRule]:
+        """Melhor regra para a mensagem, ou None se não houver regra ativa"""
+        partitions = self._current_partitions()
+        trigger_type = 'first_message' if is_first_message else 'follow_up'
+        partition = partitions.get(trigger_type)
+        if not partition:
+            return None
+
+        automaton, default_rule = partition
+        matches = automaton.search(normalize_text(message))
+        if matches:
+            return min(matches, key=lambda rule: (-len(rule.keyword), rule.id))
+        return default_rule
+
+    def _current_partitions(self) -> Dict:
+        version = self._version_token.get()
+        if self._built and version == self._version:
+            return self._partitions
+
+        with self._lock:
+            if not self._built or version != self._version:
+                self._partitions = self._compile()
+                self._version = version
+                self._built = True
+            return self._partitions
+
+    def _compile(self) -> Dict:
+        with app.app_context():
+            rules = [
+                CompiledRule(response)
+                for response in AutoResponse.query.filter_by(is_active=True).order_by(AutoResponse.id).all()
+            ]
+
+        partitions = {}
+        for trigger_type in ('first_message', 'follow_up'):
+            partition_rules = [rule for rule in rules if rule.trigger_type == trigger_type]
+            if partition_rules:
+                partitions[trigger_type] = (KeywordAutomaton(partition_rules), partition_rules[0])
+
+        logging.info(f"🧩 {len(rules)} respostas automáticas compiladas")
+        return partitions
+
+# Instância global
+auto_response_matcher = AutoResponseMatcher()
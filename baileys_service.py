@@ -1,127 +1,355 @@
 import os
+import shutil
 import requests
 import logging
 import subprocess
 import threading
 import time
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional
+from requests.adapters import HTTPAdapter
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos, cada processo supervisiona o seu
+    fcntl = None
+
+class CircuitBreaker:
+    """Circuit breaker simples: abre após falhas seguidas e falha rápido até o reset
+    
+    Passado o reset_timeout o circuito fica meio-aberto: só uma requisição
+    de teste passa e as demais continuam falhando rápido até ela terminar.
+    Sucesso fecha o circuito; falha reabre por mais reset_timeout. Um teste
+    que não reporta resultado em reset_timeout libera a vaga para outro.
+    """
+    
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 10):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+    
+    def _state(self, now: float) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if now - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+    
+    def allow_request(self) -> bool:
+        """Fechado deixa passar; aberto falha rápido; meio-aberto deixa passar só o teste"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == 'closed':
+                return True
+            if state == 'open':
+                return False
+            if self.probe_started_at is not None and now - self.probe_started_at < self.reset_timeout:
+                return False  # Teste em andamento
+            self.probe_started_at = now
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started_at = None
+    
+    def record_failure(self) -> bool:
+        """Registrar falha; retorna True se o circuito acabou de abrir"""
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                just_opened = self.opened_at is None
+                # Em half-open uma nova falha reinicia a janela e libera a vaga de teste
+                self.opened_at = time.monotonic()
+                self.probe_started_at = None
+                return just_opened
+            return False
+
+class SidecarSupervisor:
+    """Ciclo de vida do sidecar Node.js, fora do caminho de importação
+
+    Uma thread em background verifica o sidecar a cada HEALTH_INTERVAL
+    segundos. Se ele não responde, só o processo que segura o lock file
+    (um entre todos os workers do gunicorn) sobe o Node; os demais apenas
+    esperam ficar pronto. Se o sidecar morre, é reiniciado com backoff
+    exponencial; se o worker dono morre, o sistema libera o lock e outro
+    worker assume. A prontidão fica em `ready` (threading.Event).
+    """
+    
+    def __init__(self, command: List[str], probe: Callable[[], bool], lock_path: str = None):
+        self.command = command
+        self.probe = probe
+        self.lock_path = lock_path or os.environ.get(
+            'BAILEYS_LOCK_PATH',
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'baileys_sidecar.lock')
+        )
+        self.HEALTH_INTERVAL = float(os.environ.get('BAILEYS_HEALTH_INTERVAL', '5'))
+        self.STARTUP_TIMEOUT = float(os.environ.get('BAILEYS_STARTUP_TIMEOUT', '20'))
+        self.BACKOFF_BASE = 1.0   # Segundos, dobra a cada falha seguida
+        self.BACKOFF_MAX = float(os.environ.get('BAILEYS_RESTART_BACKOFF_MAX', '60'))
+        
+        self.ready = threading.Event()
+        self.process = None
+        self._spawned_at = 0.0
+        self._lock_file = None
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._failures = 0
+        self._state = 'stopped'
+        self._stats = {'starts': 0, 'failures': 0, 'outages': 0}
+    
+    def start(self):
+        """Iniciar a supervisão em background (não bloqueia)"""
+        if self._thread:
+            return
+        self._stopping = False
+        self._state = 'starting'
+        self._thread = threading.Thread(target=self._supervise, name='baileys-supervisor', daemon=True)
+        self._thread.start()
+    
+    def wake(self):
+        """Verificar o sidecar agora (ex.: circuito acabou de abrir)"""
+        self._wakeup.set()
+    
+    def stop(self):
+        """Parar a supervisão e o sidecar iniciado por este processo"""
+        self._stopping = True
+        self._wakeup.set()
+        thread, self._thread = self._thread, None
+        if thread:
+            thread.join(timeout=5)
+        self._terminate()
+        self.ready.clear()
+        self._state = 'stopped'
+    
+    def _supervise(self):
+        while not self._stopping:
+            wait = self.HEALTH_INTERVAL
+            try:
+                if self.probe():
+                    if not self.ready.is_set():
+                        logging.info("✅ Serviço Baileys pronto")
+                    self.ready.set()
+                    self._state = 'ready'
+                    self._failures = 0
+                else:
+                    if self.ready.is_set():
+                        logging.warning("⚠️ Serviço Baileys não responde")
+                        self._stats['outages'] += 1
+                    self.ready.clear()
+                    wait = self._recover()
+            except Exception as e:
+                logging.error(f"Erro na supervisão do Baileys: {e}")
+            
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+    
+    def _recover(self) -> float:
+        """Sidecar fora do ar: subir (se este processo é o dono) e retornar a espera até a próxima verificação"""
+        if not self._acquire_lock():
+            self._state = 'waiting'  # Outro worker cuida do sidecar
+            return self.HEALTH_INTERVAL
+        
+        if self.process is not None and self.process.poll() is None:
+            # Ainda subindo (ou travado): dar o prazo de inicialização antes de matar
+            if time.monotonic() - self._spawned_at < self.STARTUP_TIMEOUT:
+                return min(self.HEALTH_INTERVAL, 0.5)
+            logging.error("❌ Serviço Baileys não respondeu a tempo - reiniciando")
+            self._terminate()
+            return self._backoff()
+        
+        if self.process is not None:
+            logging.error(f"❌ Serviço Baileys saiu (código {self.process.returncode})")
+            self.process = None
+            return self._backoff()
+        
+        if not shutil.which(self.command[0]):
+            logging.error("Node.js não encontrado!")
+            self._state = 'unavailable'
+            return self.BACKOFF_MAX
+        
+        logging.info("🚀 Iniciando serviço Baileys...")
+        self.process = subprocess.Popen(
+            self.command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            preexec_fn=os.setsid if os.name != 'nt' else None
+        )
+        self._spawned_at = time.monotonic()
+        self._stats['starts'] += 1
+        self._state = 'starting'
+        return 0.5
+    
+    def _backoff(self) -> float:
+        self._failures += 1
+        self._stats['failures'] += 1
+        self._state = 'backoff'
+        delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** (self._failures - 1))
+        logging.info(f"🔁 Nova tentativa de iniciar o Baileys em {delay:.0f}s")
+        return delay
+    
+    def _acquire_lock(self) -> bool:
+        """Lock file exclusivo: só um processo sobe o sidecar; liberado pelo sistema se o processo morre"""
+        if self._lock_file is not None or fcntl is None:
+            return True
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+            lock_file = open(self.lock_path, 'a+')
+        except OSError as e:
+            logging.error(f"Lock do Baileys indisponível ({e}) - supervisionando sem lock")
+            return True
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._lock_file = lock_file
+        return True
+    
+    def _terminate(self):
+        process, self.process = self.process, None
+        if process is None or process.poll() is not None:
+            return
+        try:
+            logging.info("🛑 Parando serviço Baileys...")
+            process.terminate()
+            process.wait(timeout=5)
+            logging.info("✅ Serviço Baileys parado")
+        except Exception as e:
+            logging.error(f"Erro ao parar Baileys: {e}")
+    
+    def get_stats(self) -> Dict:
+        process = self.process
+        return dict(
+            self._stats,
+            state=self._state,
+            ready=self.ready.is_set(),
+            owner=self._lock_file is not None,
+            pid=process.pid if process is not None and process.poll() is None else None
+        )
 
 class BaileysService:
     """Serviço para gerenciar o WhatsApp via Baileys local"""
     
+    # Timeouts (connect, read) por endpoint
+    ENDPOINT_TIMEOUTS = {
+        '/status': (1, 2),
+        '/qr': (1, 5),
+        '/send-message': (1, 8),
+        '/set-typing': (1, 3),
+        '/send-bulk': (1, 120),
+    }
+    DEFAULT_TIMEOUT = (1, 8)
+    
     def __init__(self):
-        self.base_url = 'http://localhost:3001'
-        self.process = None
+        self.base_url = os.environ.get('BAILEYS_URL', 'http://localhost:3001')
         self.is_running = False
         
-        # Iniciar o serviço Node.js automaticamente
-        self.start_baileys_service()
+        # Sessão com pool de conexões keep-alive para o sidecar
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=int(os.environ.get('BAILEYS_POOL_SIZE', '16')),
+            max_retries=0
+        )
+        self.session.mount('http://', adapter)
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.environ.get('BAILEYS_BREAKER_THRESHOLD', '3')),
+            reset_timeout=float(os.environ.get('BAILEYS_BREAKER_RESET', '10'))
+        )
+        # Sidecar iniciado e vigiado em background por start(), nunca na importação
+        self.supervisor = SidecarSupervisor(['node', 'whatsapp_baileys_simple.js'], self._probe)
     
-    def start_baileys_service(self):
-        """Iniciar o serviço Baileys em background"""
-        try:
-            if not self.is_running:
-                logging.info("🚀 Iniciando serviço Baileys...")
-                
-                # Verificar se Node.js está disponível
-                result = subprocess.run(['node', '--version'], capture_output=True, text=True)
-                if result.returncode != 0:
-                    logging.error("Node.js não encontrado!")
-                    return
-                
-                # Verificar se já existe um processo rodando na porta 3001
-                try:
-                    response = requests.get('http://localhost:3001/status', timeout=2)
-                    if response.status_code == 200:
-                        logging.info("✅ Serviço Baileys já está rodando!")
-                        self.is_running = True
-                        return
-                except:
-                    pass  # Continuar para iniciar o serviço
-                
-                # Iniciar o processo Node.js
-                self.process = subprocess.Popen(
-                    ['node', 'whatsapp_baileys_simple.js'],
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                    text=True,
-                    preexec_fn=os.setsid if os.name != 'nt' else None
-                )
-                
-                # Aguardar o serviço iniciar
-                for _ in range(10):  # Tentar por 10 segundos
-                    time.sleep(1)
-                    try:
-                        response = requests.get('http://localhost:3001/status', timeout=2)
-                        if response.status_code == 200:
-                            self.is_running = True
-                            logging.info("✅ Serviço Baileys iniciado com sucesso!")
-                            return
-                    except:
-                        continue
-                
-                # Se chegou aqui, o serviço não iniciou
-                logging.error("❌ Falha ao iniciar serviço Baileys - timeout")
-                self.is_running = False
-                if self.process:
-                    self.process.terminate()
-                
-        except Exception as e:
-            logging.error(f"Erro ao iniciar Baileys: {e}")
-            self.is_running = False
+    def start(self):
+        """Iniciar a supervisão do sidecar em background (não bloqueia a importação)"""
+        self.supervisor.start()
     
     def stop_baileys_service(self):
         """Parar o serviço Baileys"""
+        self.supervisor.stop()
+    
+    def _probe(self) -> bool:
+        """Sidecar responde em /status?"""
         try:
-            if self.process and self.process.poll() is None:
-                logging.info("🛑 Parando serviço Baileys...")
-                self.process.terminate()
-                self.process.wait(timeout=5)
-                self.is_running = False
-                logging.info("✅ Serviço Baileys parado")
-        except Exception as e:
-            logging.error(f"Erro ao parar Baileys: {e}")
+            response = self.session.get(f"{self.base_url}/status", timeout=self.ENDPOINT_TIMEOUTS['/status'])
+        except requests.exceptions.RequestException:
+            self.is_running = False
+            return False
+        self.is_running = response.status_code == 200
+        if self.is_running:
+            self.breaker.record_success()
+        return self.is_running
     
-    def _make_request(self, method: str, endpoint: str, data: Dict = None, retries: int = 2) -> Dict:
-        """Fazer requisição para o serviço Baileys com retry"""
+    def _make_request(self, method: str, endpoint: str, data: Dict = None, retries: int = 1) -> Dict:
+        """Fazer requisição para o serviço Baileys pela sessão com pool
+        
+        Só erros de conexão são repetidos (a requisição não chegou ao sidecar);
+        com o circuito aberto a chamada falha na hora, sem subprocessos.
+        """
+        if method.upper() not in ('GET', 'POST'):
+            return {"success": False, "error": "Método não suportado"}
+        
+        url = f"{self.base_url}{endpoint}"
+        timeout = self.ENDPOINT_TIMEOUTS.get(endpoint, self.DEFAULT_TIMEOUT)
         last_error = None
         
         for attempt in range(retries + 1):
+            if not self.breaker.allow_request():
+                return {"success": False, "error": "Serviço WhatsApp indisponível (circuito aberto)"}
+            
             try:
-                # Verificar se o serviço está rodando
-                if not self.is_running or attempt > 0:
-                    self.start_baileys_service()
-                
-                url = f"{self.base_url}{endpoint}"
-                
                 if method.upper() == 'GET':
-                    response = requests.get(url, timeout=8)
-                elif method.upper() == 'POST':
-                    response = requests.post(url, json=data or {}, timeout=8)
+                    response = self.session.get(url, timeout=timeout)
                 else:
-                    return {"success": False, "error": "Método não suportado"}
+                    response = self.session.post(url, json=data or {}, timeout=timeout)
+                
+                self.breaker.record_success()
+                self.is_running = True  # Confirmar que está rodando
                 
                 if response.status_code == 200:
-                    result = response.json()
-                    self.is_running = True  # Confirmar que está rodando
-                    return result
+                    return response.json()
                 else:
                     return {"success": False, "error": f"Status {response.status_code}: {response.text}"}
                     
-            except requests.exceptions.ConnectionError as e:
+            except requests.exceptions.ConnectionError:
                 last_error = "Serviço WhatsApp não está rodando"
                 self.is_running = False
-            except requests.exceptions.Timeout as e:
-                last_error = "Timeout na conexão"
+                if self.breaker.record_failure():
+                    logging.warning("⚡ Circuito do Baileys aberto - sidecar indisponível")
+                    self.supervisor.wake()
+                continue
+            except requests.exceptions.Timeout:
+                # Não repetir: a requisição pode ter sido processada (ex.: mensagem enviada)
+                self.breaker.record_failure()
+                return {"success": False, "error": "Timeout na conexão"}
             except Exception as e:
-                last_error = str(e)
-                
-            # Se não é a última tentativa, aguardar um pouco
-            if attempt < retries:
-                time.sleep(2)
+                return {"success": False, "error": str(e)}
         
         return {"success": False, "error": last_error or "Erro desconhecido"}
     
+    def get_transport_stats(self) -> Dict:
+        """Estado do circuit breaker do transporte"""
+        return {
+            'breaker_state': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'is_running': self.is_running,
+            'sidecar': self.supervisor.get_stats()
+        }
+    
     def get_connection_status(self) -> Dict:
         """Obter status da conexão"""
         return self._make_request('GET', '/status')
@@ -137,6 +365,14 @@ class BaileysService:
             'message': message
         })
     
+    def send_bulk(self, messages: list, concurrency: int = 3, rate_per_second: float = 0) -> Dict:
+        """Enviar lote de mensagens [{'id', 'phone', 'message'}] com ritmo e concorrência"""
+        return self._make_request('POST', '/send-bulk', {
+            'messages': messages,
+            'concurrency': concurrency,
+            'rate_per_second': rate_per_second
+        })
+    
     def set_typing(self, phone: str, typing: bool = True) -> Dict:
         """Definir status de digitação"""
         return self._make_request('POST', '/set-typing', {
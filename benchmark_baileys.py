@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark da latência de send_message contra um servidor local que
+imita o sidecar Baileys (/status e /send-message)
+
+Compara requisições sem pool (requests.post, uma conexão TCP por chamada)
+com o transporte com pool keep-alive do BaileysService.
+
+Uso: python benchmark_baileys.py [iterações]
+"""
+import os
+import sys
+import json
+import time
+import statistics
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Responde como o whatsapp_baileys_simple.js, sem tocar no WhatsApp"""
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True  # Como o Node, que usa TCP_NODELAY por padrão
+
+    def _reply(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply({'connected': True, 'status': 'connected', 'qr_available': False, 'user': None})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self._reply({'success': True, 'message': 'Mensagem enviada'})
+
+    def log_message(self, format, *args):
+        pass
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"  {label:<28} média {statistics.mean(samples):7.3f} ms | p50 {p50:7.3f} ms | p99 {p99:7.3f} ms")
+
+def run(iterations: int):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    os.environ['BAILEYS_URL'] = base_url
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from baileys_service import BaileysService
+    service = BaileysService()
+
+    payload = {'phone': '5511999999999', 'message': 'Olá! Mensagem de benchmark.'}
+
+    # Aquecimento
+    for _ in range(20):
+        requests.post(f"{base_url}/send-message", json=payload, timeout=8)
+        service.send_message(payload['phone'], payload['message'])
+
+    bare = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        requests.post(f"{base_url}/send-message", json=payload, timeout=8)
+        bare.append((time.perf_counter() - start) * 1000)
+
+    pooled = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        service.send_message(payload['phone'], payload['message'])
+        pooled.append((time.perf_counter() - start) * 1000)
+
+    # Circuito aberto: sidecar fora do ar deve falhar rápido
+    server.shutdown()
+    server.server_close()
+    service.session.close()
+    down = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        service.send_message(payload['phone'], payload['message'])
+        down.append((time.perf_counter() - start) * 1000)
+
+    print(f"📊 send_message ({iterations} iterações)")
+    summarize('requests.post sem pool', bare)
+    summarize('BaileysService com pool', pooled)
+    summarize('sidecar fora (circuito)', down)
+    print(f"  estado do circuito: {service.get_transport_stats()['breaker_state']}")
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,310 @@
+import os
+import math
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import func, or_
+from app import app, db
+from models import BroadcastJob, BroadcastItem, Conversation, Message, canonical_phone
+from baileys_service import baileys_service
+
+def job_to_dict(job: BroadcastJob, counts: Dict = None, include_items: bool = True) -> Dict:
+    """Status de um job (contagens por status e, opcionalmente, cada mensagem)"""
+    if counts is None:
+        counts = job_counts([job.id]).get(job.id, {})
+    counts = {status: counts.get(status, 0) for status in ('pending', 'sending', 'sent', 'failed')}
+
+    result = {
+        'id': job.id,
+        'status': job.status,
+        'total': sum(counts.values()),
+        'counts': counts,
+        'rate_per_second': job.rate_per_second,
+        'concurrency': job.concurrency,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+    if include_items:
+        result['messages'] = [
+            {
+                'id': item.position,
+                'phone': item.phone,
+                'message': item.message,
+                'status': item.status,
+                'attempts': item.attempts,
+                'error': item.error,
+                'sent_at': item.sent_at.isoformat() if item.sent_at else None
+            }
+            for item in job.items
+        ]
+    return result
+
+def job_counts(job_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    """Contagem de mensagens por status de vários jobs numa consulta"""
+    counts = {}
+    rows = db.session.query(BroadcastItem.job_id, BroadcastItem.status, func.count()) \
+        .filter(BroadcastItem.job_id.in_(job_ids)) \
+        .group_by(BroadcastItem.job_id, BroadcastItem.status).all()
+    for job_id, status, count in rows:
+        counts.setdefault(job_id, {})[status] = count
+    return counts
+
+class BroadcastDispatcher:
+    """Despachante de envios em massa, único entre todos os workers
+
+    Jobs e o status de cada mensagem ficam no banco, então qualquer worker
+    responde /api/broadcast/<id> e os jobs sobrevivem a reinícios. Cada
+    worker roda uma thread que tenta assumir o lease do job mais antigo em
+    andamento; como só esse job pode ser enviado e só um dono por vez detém
+    o lease, o ritmo e a concorrência valem para todos os jobs e workers
+    somados. O dono envia lotes de ~1 segundo de mensagens para o
+    /send-bulk do sidecar e renova o lease a cada lote; se ele morrer, outro
+    worker assume quando o lease vence. Jobs concluídos há mais de
+    BROADCAST_RETENTION_HOURS são apagados.
+    """
+
+    def __init__(self):
+        self.MAX_RATE = float(os.environ.get('BROADCAST_RATE', '5'))              # Mensagens por segundo
+        self.MAX_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', '3'))  # Envios simultâneos
+        self.RETENTION = timedelta(hours=float(os.environ.get('BROADCAST_RETENTION_HOURS', '24')))
+        self.MAX_ATTEMPTS = 3
+        self.RETRY_DELAY = 5      # Segundos de espera quando o sidecar está fora
+        self.POLL_INTERVAL = 2    # Espera por jobs novos (inclusive de outros workers)
+        self.LEASE_SECONDS = 180  # Maior que o timeout do /send-bulk
+        self.PRUNE_INTERVAL = 3600
+
+        self.owner = uuid.uuid4().hex
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pruned_at = 0.0
+
+    def limits(self, rate_per_second=None, concurrency=None):
+        """Validar ritmo e concorrência pedidos, limitando ao máximo global
+
+        Levanta ValueError se não forem números, se o ritmo não for maior que
+        zero ou se a concorrência for menor que 1.
+        """
+        rate = self.MAX_RATE
+        if rate_per_second not in (None, ''):
+            try:
+                rate = float(rate_per_second)
+            except (TypeError, ValueError):
+                raise ValueError('rate_per_second deve ser um número')
+            if not math.isfinite(rate) or rate <= 0:
+                raise ValueError('rate_per_second deve ser maior que zero')
+
+        workers = self.MAX_CONCURRENCY
+        if concurrency not in (None, ''):
+            try:
+                workers = int(concurrency)
+            except (TypeError, ValueError):
+                raise ValueError('concurrency deve ser um número inteiro')
+            if isinstance(concurrency, float) and workers != concurrency:
+                raise ValueError('concurrency deve ser um número inteiro')
+            if workers < 1:
+                raise ValueError('concurrency deve ser pelo menos 1')
+
+        return min(rate, self.MAX_RATE), max(1, min(workers, self.MAX_CONCURRENCY))
+
+    def submit(self, messages: List[Dict], rate_per_second: float = None, concurrency: int = None) -> Dict:
+        """Criar job de envio em massa; ritmo e concorrência são limitados ao máximo global"""
+        rate, workers = self.limits(rate_per_second, concurrency)
+
+        job = BroadcastJob(id=uuid.uuid4().hex[:12], rate_per_second=rate, concurrency=workers)
+        db.session.add(job)
+        db.session.flush()
+        db.session.bulk_insert_mappings(BroadcastItem, [
+            {'job_id': job.id, 'position': index, 'phone': item['phone'], 'message': item['message']}
+            for index, item in enumerate(messages)
+        ])
+        db.session.commit()
+
+        self.start()
+        self._wakeup.set()
+        logging.info(f"📢 Envio em massa {job.id} criado: {len(messages)} mensagens a {rate}/s")
+        return job_to_dict(job, {'pending': len(messages)}, include_items=False)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        job = db.session.get(BroadcastJob, job_id)
+        return job_to_dict(job) if job else None
+
+    def list_jobs(self) -> List[Dict]:
+        jobs = BroadcastJob.query.order_by(BroadcastJob.created_at).all()
+        counts = job_counts([job.id for job in jobs])
+        return [job_to_dict(job, counts.get(job.id, {}), include_items=False) for job in jobs]
+
+    def start(self):
+        """Iniciar a thread do despachante (retoma jobs pendentes após reinício)"""
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name='broadcast-dispatcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with app.app_context():
+                    sent = self._dispatch_once()
+                    if not sent and time.monotonic() - self._pruned_at >= self.PRUNE_INTERVAL:
+                        self._prune()
+            except Exception as e:
+                logging.error(f"Erro no despachante de envios em massa: {e}")
+                sent = False
+            if not sent:
+                self._wakeup.wait(self.POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _claim_job(self) -> Optional[BroadcastJob]:
+        """Assumir (ou renovar) o lease do job mais antigo em andamento
+
+        Retorna None se não há job ou se outro worker detém o lease.
+        """
+        job = BroadcastJob.query.filter_by(status='running').order_by(BroadcastJob.created_at).first()
+        if not job:
+            return None
+
+        now = datetime.utcnow()
+        taken = BroadcastJob.query.filter(
+            BroadcastJob.id == job.id,
+            BroadcastJob.status == 'running',
+            or_(BroadcastJob.lease_owner.is_(None), BroadcastJob.lease_owner == self.owner,
+                BroadcastJob.lease_until < now)
+        ).update({'lease_owner': self.owner, 'lease_until': now + timedelta(seconds=self.LEASE_SECONDS)},
+                 synchronize_session=False)
+        if not taken:
+            db.session.rollback()
+            return None
+
+        if job.lease_owner not in (None, self.owner):
+            # Dono anterior morreu no meio de um lote: as mensagens podem ter saído, não repetir
+            interrupted = BroadcastItem.query.filter_by(job_id=job.id, status='sending') \
+                .update({'status': 'failed', 'error': 'Envio interrompido'}, synchronize_session=False)
+            logging.warning(f"📢 Job {job.id} assumido de outro worker ({interrupted} mensagens interrompidas)")
+        db.session.commit()
+        db.session.refresh(job)
+        return job
+
+    def _dispatch_once(self) -> bool:
+        """Enviar o próximo lote (~1s de mensagens) do job mais antigo; False se não havia o que enviar"""
+        job = self._claim_job()
+        if not job:
+            return False
+
+        chunk = BroadcastItem.query.filter_by(job_id=job.id, status='pending') \
+            .order_by(BroadcastItem.position).limit(max(1, int(job.rate_per_second))).all()
+        if not chunk:
+            job.status = 'finished'
+            job.finished_at = datetime.utcnow()
+            job.lease_owner = None
+            job.lease_until = None
+            db.session.commit()
+            logging.info(f"📢 Envio em massa {job.id} concluído: {job_to_dict(job, include_items=False)['counts']}")
+            return True
+
+        for item in chunk:
+            item.status = 'sending'
+            item.attempts += 1
+        db.session.commit()
+
+        self._send_chunk(job, chunk)
+        return True
+
+    def _send_chunk(self, job: BroadcastJob, chunk: List[BroadcastItem]):
+        started = time.monotonic()
+        result = baileys_service.send_bulk(
+            [{'id': item.position, 'phone': item.phone, 'message': item.message} for item in chunk],
+            concurrency=job.concurrency,
+            rate_per_second=job.rate_per_second
+        )
+
+        if not result.get('success'):
+            self._retry_chunk(job, chunk, result.get('error', 'Erro desconhecido'))
+            return
+
+        by_position = {entry.get('id'): entry for entry in result.get('results', []) if entry}
+        delivered = []
+        for item in chunk:
+            entry = by_position.get(item.position)
+            if entry and entry.get('success'):
+                item.status = 'sent'
+                item.sent_at = datetime.utcnow()
+                delivered.append(item)
+            else:
+                item.status = 'failed'
+                item.error = (entry or {}).get('error', 'Sem resultado do sidecar')
+
+        db.session.commit()
+        if delivered:
+            self._save_messages(delivered)
+
+        # Garantir o ritmo entre lotes mesmo se o sidecar responder rápido demais
+        remaining = len(chunk) / job.rate_per_second - (time.monotonic() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def _retry_chunk(self, job: BroadcastJob, chunk: List[BroadcastItem], error: str):
+        """Devolver o lote ao job (ou marcar falha) quando o sidecar não respondeu"""
+        logging.warning(f"📢 Falha ao enviar lote do job {job.id}: {error}")
+        # Timeout não é repetido: as mensagens podem ter sido entregues
+        retryable = 'Timeout' not in error
+        for item in chunk:
+            if retryable and item.attempts < self.MAX_ATTEMPTS:
+                item.status = 'pending'
+            else:
+                item.status = 'failed'
+                item.error = error
+        db.session.commit()
+
+        if retryable:
+            time.sleep(self.RETRY_DELAY)
+
+    def _prune(self):
+        """Apagar jobs concluídos há mais de RETENTION"""
+        self._pruned_at = time.monotonic()
+        expired = [job_id for (job_id,) in db.session.query(BroadcastJob.id).filter(
+            BroadcastJob.status == 'finished', BroadcastJob.finished_at < datetime.utcnow() - self.RETENTION)]
+        if not expired:
+            return
+        BroadcastItem.query.filter(BroadcastItem.job_id.in_(expired)).delete(synchronize_session=False)
+        BroadcastJob.query.filter(BroadcastJob.id.in_(expired)).delete(synchronize_session=False)
+        db.session.commit()
+        logging.info(f"📢 {len(expired)} envios em massa antigos removidos")
+
+    def _save_messages(self, items: List[BroadcastItem]):
+        """Salvar mensagens entregues no histórico, criando conversas se preciso"""
+        try:
+            phones = {canonical_phone(item.phone): item.phone for item in items}
+            conversations = {
+                conversation.phone_key: conversation
+                for conversation in Conversation.query.filter(Conversation.phone_key.in_(phones.keys())).all()
+            }
+            for key in phones.keys() - conversations.keys():
+                conversation = Conversation()
+                conversation.phone_number = phones[key]
+                conversation.contact_name = phones[key]
+                db.session.add(conversation)
+                conversations[key] = conversation
+            db.session.flush()
+
+            for item in items:
+                conversation = conversations[canonical_phone(item.phone)]
+                broadcast_message = Message()
+                broadcast_message.conversation_id = conversation.id
+                broadcast_message.content = item.message
+                broadcast_message.is_from_user = False
+                broadcast_message.message_type = 'text'
+                broadcast_message.response_type = 'broadcast'
+                db.session.add(broadcast_message)
+                conversation.record_message(broadcast_message)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Erro ao salvar mensagens do envio em massa: {e}")
+
+# Instância global
+broadcast_dispatcher = BroadcastDispatcher()
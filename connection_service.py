@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+from app import app, db
+from models import WhatsAppConnection
+from baileys_service import baileys_service
+
+class ConnectionStatusCache:
+    """Snapshot em memória do status da conexão WhatsApp, compartilhado pelo banco
+
+    Cada mudança (webhooks do sidecar /api/connected, /api/disconnected,
+    /api/qr-updated, ou a reconciliação periódica com o Baileys) é gravada
+    primeiro na linha de WhatsAppConnection junto com um novo token de
+    versão. Ler o status é uma cópia do dicionário; no máximo a cada
+    CHECK_INTERVAL segundos o worker compara o token (uma consulta pela
+    chave primária) e recarrega o snapshot se outro worker o mudou.
+    """
+
+    PERSISTED = ('is_connected', 'qr_code', 'last_connected')
+
+    def __init__(self, reconcile_interval: float = None, check_interval: float = None):
+        self.RECONCILE_INTERVAL = reconcile_interval or float(os.environ.get('CONNECTION_RECONCILE_INTERVAL', '60'))
+        self.CHECK_INTERVAL = check_interval if check_interval is not None else float(
+            os.environ.get('CONNECTION_CHECK_INTERVAL', '2'))
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._snapshot = {
+            'is_connected': False,
+            'qr_code': None,
+            'last_connected': None,
+            'baileys_status': 'unknown',
+            'qr_available': False,
+            'user_info': None,
+            'service_running': False,
+            'error': None
+        }
+        self._version = None
+        self._checked_at = 0.0
+        self._loaded = False
+        self._listeners = []
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def get_status(self) -> Dict:
+        """Ler o status atual (memória, conferindo a versão compartilhada de tempos em tempos)"""
+        self._ensure_fresh()
+        with self._lock:
+            return dict(self._snapshot)
+
+    def add_listener(self, callback):
+        """Registrar callback chamado com o snapshot sempre que o status mudar"""
+        self._listeners.append(callback)
+
+    def _ensure_fresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and self._loaded and now - self._checked_at < self.CHECK_INTERVAL:
+            return
+        try:
+            with app.app_context():
+                version = db.session.query(WhatsAppConnection.version).order_by(WhatsAppConnection.id).limit(1).scalar()
+                if not self._loaded or version != self._version:
+                    self._load(WhatsAppConnection.query.order_by(WhatsAppConnection.id).first())
+        except Exception as e:
+            # Mantém o snapshot anterior; tenta de novo no próximo intervalo
+            logging.error(f"Erro ao carregar status da conexão: {e}")
+        self._checked_at = now
+        self._loaded = True
+
+    def _load(self, connection: Optional[WhatsAppConnection]):
+        if connection is None:
+            return
+        if connection.status_json:
+            stored = json.loads(connection.status_json)
+            if stored.get('last_connected'):
+                stored['last_connected'] = datetime.fromisoformat(stored['last_connected'])
+        else:
+            # Linha gravada antes do snapshot completo existir
+            stored = {key: getattr(connection, key) for key in self.PERSISTED}
+            stored['is_connected'] = bool(stored['is_connected'])
+        with self._lock:
+            self._snapshot.update(stored)
+            self._version = connection.version
+
+    def _update(self, **changes):
+        """Aplicar mudanças: grava no banco primeiro, depois atualiza a memória e notifica
+
+        Só há escrita (e notificação) se algo mudou em relação ao estado
+        compartilhado mais recente.
+        """
+        with self._write_lock:
+            self._ensure_fresh(force=True)
+            with self._lock:
+                changed = {key: value for key, value in changes.items() if self._snapshot.get(key) != value}
+                snapshot = dict(self._snapshot, **changed)
+
+            if not changed:
+                return
+
+            version = self._persist(snapshot)
+            with self._lock:
+                self._snapshot.update(changed)
+                if version:
+                    self._version = version
+
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logging.error(f"Erro ao notificar mudança de conexão: {e}")
+
+    def _persist(self, snapshot: Dict) -> Optional[str]:
+        """Gravar o snapshot com um novo token de versão; retorna o token (None se falhou)"""
+        version = uuid.uuid4().hex
+        try:
+            with app.app_context():
+                connection = WhatsAppConnection.query.order_by(WhatsAppConnection.id).first()
+                if not connection:
+                    connection = WhatsAppConnection()
+                    db.session.add(connection)
+
+                for key in self.PERSISTED:
+                    setattr(connection, key, snapshot[key])
+                connection.status_json = json.dumps(snapshot, default=lambda value: value.isoformat()
+                                                    if isinstance(value, datetime) else str(value))
+                connection.version = version
+                db.session.commit()
+            return version
+        except Exception as e:
+            logging.error(f"Erro ao salvar status da conexão: {e}")
+            return None
+
+    def mark_connected(self, user_info: Optional[Dict] = None):
+        """Webhook /api/connected"""
+        self._update(
+            is_connected=True,
+            last_connected=datetime.utcnow(),
+            qr_code=None,
+            qr_available=False,
+            baileys_status='connected',
+            user_info=user_info,
+            service_running=True,
+            error=None
+        )
+
+    def mark_disconnected(self):
+        """Webhook /api/disconnected"""
+        self._update(
+            is_connected=False,
+            qr_available=False,
+            baileys_status='disconnected',
+            user_info=None,
+            service_running=True
+        )
+
+    def qr_updated(self, qr_code: str):
+        """Webhook /api/qr-updated (ou QR gerado sob demanda)"""
+        self._update(
+            is_connected=False,
+            qr_code=qr_code,
+            qr_available=True,
+            baileys_status='qr_ready',
+            service_running=True,
+            error=None
+        )
+
+    def reconcile(self):
+        """Conferir o status real no sidecar e corrigir o snapshot se divergir"""
+        baileys_status = baileys_service.get_connection_status()
+
+        if baileys_status.get('success') == False:
+            self._update(
+                is_connected=False,
+                baileys_status='service_error',
+                service_running=False,
+                error=baileys_status.get('error', 'Serviço não está rodando')
+            )
+            return
+
+        is_connected = bool(baileys_status.get('connected', False))
+        changes = {
+            'is_connected': is_connected,
+            'baileys_status': baileys_status.get('status', 'unknown'),
+            'qr_available': baileys_status.get('qr_available', False),
+            'user_info': baileys_status.get('user'),
+            'service_running': True,
+            'error': None
+        }
+        with self._lock:
+            was_connected = self._snapshot['is_connected']
+        if is_connected:
+            changes['qr_code'] = None
+            if not was_connected:
+                changes['last_connected'] = datetime.utcnow()
+        self._update(**changes)
+
+    def _reconcile_loop(self):
+        while True:
+            try:
+                self.reconcile()
+            except Exception as e:
+                logging.error(f"Erro ao reconciliar status da conexão: {e}")
+            self._wakeup.wait(self.RECONCILE_INTERVAL)
+            self._wakeup.clear()
+
+    def request_reconcile(self):
+        """Antecipar a próxima reconciliação"""
+        self._wakeup.set()
+
+    def start(self):
+        """Iniciar a reconciliação periódica em background"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._reconcile_loop, name='connection-reconcile', daemon=True)
+        self._thread.start()
+
+# Instância global
+connection_state = ConnectionStatusCache()
@@ -0,0 +1,99 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+from ai_cache_service import prompt_hash
+from rate_limit_service import is_quota_error
+
+class ContextCacheManager:
+    """Cache explícito de contexto do Gemini para o prompt do negócio
+
+    O prompt personalizado (system instruction) é grande e quase não muda;
+    com cache explícito ele é enviado uma vez e as gerações só referenciam
+    o cache, pagando menos tokens de entrada. Um cache por modelo (caches
+    do Gemini são ligados ao modelo) e hash de prompt: quando o ai_prompt
+    muda, um novo é criado e o antigo apagado. Prompts
+    pequenos demais para o mínimo da API ficam sem cache (system instruction
+    normal), e a falha é lembrada para não repetir a tentativa a cada pedido.
+
+    Todos os métodos async rodam no loop do motor de IA.
+    """
+
+    def __init__(self):
+        self.ENABLED = os.environ.get('AI_CONTEXT_CACHE', 'false').lower() in ('1', 'true', 'yes')
+        self.TTL = int(os.environ.get('AI_CONTEXT_CACHE_TTL', '3600'))  # Segundos
+        self.MIN_TOKENS = int(os.environ.get('AI_CONTEXT_CACHE_MIN_TOKENS', '1024'))
+        self.REFRESH_MARGIN = 60  # Recriar um pouco antes de expirar
+
+        self._entries = {}          # modelo -> (hash, nome, expira_em)
+        self._failed = set()        # (modelo, hash) que a API recusou cachear
+        self._lock = None
+        self._stats = {'created': 0, 'reused': 0, 'skipped': 0, 'errors': 0}
+
+    async def config_for(self, client, model: str, system_instruction: str) -> Dict:
+        """Config de geração: cached_content quando há cache, senão system_instruction"""
+        name = await self._cache_name(client, model, system_instruction)
+        if name:
+            return {'cached_content': name}
+        return {'system_instruction': system_instruction}
+
+    async def _cache_name(self, client, model: str, system_instruction: str) -> Optional[str]:
+        caches = getattr(getattr(client, 'aio', None), 'caches', None)
+        if not self.ENABLED or caches is None:
+            return None
+
+        from ai_service import estimate_tokens
+        key = prompt_hash(system_instruction)
+        if (model, key) in self._failed or estimate_tokens(system_instruction) < self.MIN_TOKENS:
+            self._stats['skipped'] += 1
+            return None
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            entry = self._entries.get(model)
+            if entry and entry[0] == key and entry[2] - self.REFRESH_MARGIN > time.monotonic():
+                self._stats['reused'] += 1
+                return entry[1]
+
+            try:
+                cache = await caches.create(model=model, config={
+                    'system_instruction': system_instruction,
+                    'ttl': f"{self.TTL}s",
+                    'display_name': f"asa-prompt-{key}",
+                })
+            except Exception as e:
+                logging.warning(f"Cache de contexto indisponível para este prompt: {e}")
+                if not is_quota_error(e):
+                    self._failed.add((model, key))
+                self._stats['errors'] += 1
+                return None
+
+            self._entries[model] = (key, cache.name, time.monotonic() + self.TTL)
+            self._stats['created'] += 1
+            logging.info(f"🧊 Cache de contexto criado para o prompt {key} ({model}): {cache.name}")
+
+            if entry and entry[0] != key:
+                # Prompt mudou: o cache anterior não serve mais
+                try:
+                    await caches.delete(name=entry[1])
+                except Exception as e:
+                    logging.debug(f"Erro ao apagar cache de contexto antigo: {e}")
+            return cache.name
+
+    def invalidate(self, model: str = None):
+        """Esquecer o cache do modelo, ou de todos (ex.: expirou ou foi apagado no servidor)"""
+        if model is None:
+            self._entries = {}
+        else:
+            self._entries.pop(model, None)
+
+    def get_stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats['enabled'] = self.ENABLED
+        stats['active'] = {model: entry[1] for model, entry in self._entries.items()}
+        return stats
+
+# Instância global
+context_cache = ContextCacheManager()
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Tuple
+from app import app
+
+class EventBroker:
+    """Distribui eventos ao vivo (SSE) para os dashboards conectados
+
+    Cada navegador inscrito tem uma fila limitada; se um cliente lento encher
+    a fila, os eventos excedentes dele são descartados em vez de travar quem
+    publica.
+
+    Com vários workers, os eventos também passam por um log SQLite
+    compartilhado (EVENTS_DB_PATH): quem publica entrega aos seus inscritos
+    na hora e uma thread grava o evento no log em lotes; a mesma thread lê
+    os eventos dos outros processos enquanto houver inscritos neste. Com
+    EVENTS_DB_PATH vazio o broker fica restrito ao processo (um só worker).
+    """
+
+    def __init__(self, max_queue: int = 100, heartbeat: float = None, path: str = None):
+        self.max_queue = max_queue
+        self.HEARTBEAT_INTERVAL = heartbeat or float(os.environ.get('SSE_HEARTBEAT', '15'))
+        self.POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', '0.5'))
+        self.RETENTION_SECONDS = 300   # Eventos mais antigos são apagados do log
+        self.path = path if path is not None else os.environ.get(
+            'EVENTS_DB_PATH', os.path.join(app.instance_path, 'events.db'))
+        self.origin = uuid.uuid4().hex  # Identifica os eventos publicados por este processo
+        self._subscribers = {}  # fila -> tipos de evento aceitos (None = todos)
+        self._lock = threading.Lock()
+        self._outbox = queue.Queue()
+        self._wakeup = threading.Event()
+        self._local = threading.local()
+        self._thread = None
+        self._last_id = None
+        self._pruned_at = 0.0
+        self.published = 0
+        self.relayed = 0
+
+    def publish(self, event_type: str, data: Dict):
+        """Enviar evento para todos os inscritos (deste e dos outros workers)"""
+        message = self._format(event_type, data)
+        self._deliver(event_type, message)
+        self.published += 1
+
+        if self.path:
+            self._outbox.put((event_type, message))
+            self._start()
+            self._wakeup.set()
+
+    def subscribe(self, event_types: Optional[Tuple[str, ...]] = None) -> Iterator[str]:
+        """Gerador de mensagens SSE para um cliente (encerra quando o cliente sai)
+
+        event_types limita os tipos entregues (ex.: só 'connection' para as
+        páginas públicas).
+        """
+        subscriber = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers[subscriber] = frozenset(event_types) if event_types else None
+        if self.path:
+            self._start()
+
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield subscriber.get(timeout=self.HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    # Comentário SSE mantém a conexão viva através de proxies
+                    yield ": heartbeat\n\n"
+        finally:
+            with self._lock:
+                self._subscribers.pop(subscriber, None)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def get_stats(self) -> Dict:
+        return {
+            'subscribers': self.subscriber_count(),
+            'published': self.published,
+            'relayed': self.relayed,
+            'shared': bool(self.path)
+        }
+
+    def _deliver(self, event_type: str, message: str):
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+
+        for subscriber, event_types in subscribers:
+            if event_types is not None and event_type not in event_types:
+                continue
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                logging.debug(f"Cliente SSE lento - evento {event_type} descartado")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Conexão SQLite própria de cada thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS live_event (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    origin TEXT NOT NULL,
+                    event_type TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._local.conn = conn
+        return conn
+
+    def _start(self):
+        if self._thread:
+            return
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._relay_loop, name='events-relay', daemon=True)
+            self._thread.start()
+
+    def _relay_loop(self):
+        while True:
+            self._wakeup.wait(self.POLL_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self._relay_once()
+            except Exception as e:
+                logging.error(f"Erro ao sincronizar eventos entre workers: {e}")
+
+    def _relay_once(self):
+        """Gravar os eventos publicados aqui e entregar os dos outros processos"""
+        conn = self._connection()
+        now = time.time()
+
+        pending = []
+        while True:
+            try:
+                pending.append(self._outbox.get_nowait())
+            except queue.Empty:
+                break
+
+        if pending or now - self._pruned_at >= self.RETENTION_SECONDS:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO live_event (origin, event_type, message, created_at) VALUES (?, ?, ?, ?)",
+                    [(self.origin, event_type, message, now) for event_type, message in pending]
+                )
+                if now - self._pruned_at >= self.RETENTION_SECONDS:
+                    conn.execute("DELETE FROM live_event WHERE created_at < ?", (now - self.RETENTION_SECONDS,))
+                    self._pruned_at = now
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        if not self.subscriber_count():
+            # Ninguém ouvindo: ao surgir um inscrito começa do evento mais novo
+            self._last_id = None
+            return
+
+        if self._last_id is None:
+            self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM live_event").fetchone()[0]
+            return
+
+        rows = conn.execute(
+            "SELECT id, origin, event_type, message FROM live_event WHERE id > ? ORDER BY id", (self._last_id,)
+        ).fetchall()
+        for event_id, origin, event_type, message in rows:
+            self._last_id = event_id
+            if origin != self.origin:  # Os daqui já foram entregues ao publicar
+                self._deliver(event_type, message)
+                self.relayed += 1
+
+    @staticmethod
+    def _format(event_type: str, data: Dict) -> str:
+        payload = json.dumps(data, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+        return f"event: {event_type}\ndata: {payload}\n\n"
+def conversation_event(conversation) -> Dict:
+    """Payload do evento 'conversation' a partir de um Conversation"""
+    return {
+        'id': conversation.id,
+        'phone_number': conversation.phone_number,
+        'contact_name': conversation.contact_name,
+        'updated_at': conversation.updated_at,
+        'ai_paused': conversation.ai_paused or False
+    }
+
+def message_event(conversation, message) -> Dict:
+    """Payload do evento 'message' a partir de um Message recém-salvo"""
+    return {
+        'id': message.id,
+        'conversation': conversation_event(conversation),
+        'content': message.content,
+        'is_from_user': message.is_from_user,
+        'response_type': message.response_type,
+        'timestamp': message.timestamp
+    }
+
+# Instância global
+event_broker = EventBroker()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Backend Gemini falso para desenvolvimento e testes offline
+
+Imita a parte do SDK google-genai que o ai_service usa (client.aio.models
+e client.aio.caches), contando tokens como ~4 caracteres cada, para medir
+o efeito do cache de contexto sem chamar a API. Com FAKE_GEMINI_RPM,
+simula também a cota de requisições por minuto respondendo 429. Ativado
+no app com AI_BACKEND=fake.
+
+Uso: python fake_gemini.py [gerações]
+"""
+import os
+import sys
+import time
+import uuid
+import asyncio
+from collections import deque
+
+def count_tokens(text) -> int:
+    return len(str(text or '')) // 4 + 1
+
+class FakeQuotaError(Exception):
+    """Mesmo formato do erro 429 do SDK (code + retryDelay na mensagem)"""
+
+    def __init__(self, retry_delay: float):
+        self.code = 429
+        super().__init__(f"429 RESOURCE_EXHAUSTED. Quota exceeded. {{'retryDelay': '{retry_delay:.0f}s'}}")
+
+class FakeUsage:
+    def __init__(self, prompt_tokens: int, cached_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.cached_content_token_count = cached_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+class FakeResponse:
+    def __init__(self, text: str, usage: FakeUsage = None):
+        self.text = text
+        self.usage_metadata = usage
+
+class FakeCachedContent:
+    def __init__(self, name: str, system_instruction: str, ttl: str):
+        self.name = name
+        self.system_instruction = system_instruction
+        self.ttl = ttl
+        self.token_count = count_tokens(system_instruction)
+
+class FakeAsyncCaches:
+    def __init__(self, backend: 'FakeGeminiClient'):
+        self._backend = backend
+
+    async def create(self, model: str, config: dict):
+        await asyncio.sleep(self._backend.latency)
+        instruction = config.get('system_instruction', '')
+        if count_tokens(instruction) < self._backend.min_cache_tokens:
+            # A API real recusa caches abaixo do mínimo de tokens do modelo
+            raise ValueError(f"Cached content is too small: min_total_token_count={self._backend.min_cache_tokens}")
+        cache = FakeCachedContent(f"cachedContents/{uuid.uuid4().hex[:12]}", instruction, config.get('ttl'))
+        self._backend.caches[cache.name] = cache
+        self._backend.calls.append(('caches.create', cache.name))
+        return cache
+
+    async def delete(self, name: str):
+        self._backend.calls.append(('caches.delete', name))
+        if self._backend.caches.pop(name, None) is None:
+            raise ValueError(f"Cached content {name} not found")
+
+class FakeAsyncModels:
+    def __init__(self, backend: 'FakeGeminiClient'):
+        self._backend = backend
+
+    def _prompt_tokens(self, contents, config: dict):
+        config = config or {}
+        cached = 0
+        instruction_tokens = count_tokens(config.get('system_instruction')) if config.get('system_instruction') else 0
+        if config.get('cached_content'):
+            cache = self._backend.caches.get(config['cached_content'])
+            if cache is None:
+                raise ValueError(f"Cached content {config['cached_content']} not found")
+            cached = cache.token_count
+        return instruction_tokens + cached + count_tokens(contents), cached
+
+    def _reply(self, contents, config) -> str:
+        if self._backend.reply:
+            return self._backend.reply
+        mime_type = config.get('response_mime_type') if isinstance(config, dict) \
+            else getattr(config, 'response_mime_type', None)
+        if mime_type == 'application/json':
+            # Pedido estruturado (análise de intenção): JSON válido no formato pedido
+            return '{"tipo": "outro", "urgencia": "baixo", "requer_humano": false}'
+        return f"Resposta simulada para: {str(contents)[-60:].strip()}"
+
+    async def generate_content(self, model: str, contents, config=None):
+        self._backend.check_quota()
+        prompt_tokens, cached = self._prompt_tokens(contents, config)
+        self._backend.calls.append(('generate_content', model, config))
+        await asyncio.sleep(self._backend.latency)
+        text = self._reply(contents, config)
+        return FakeResponse(text, FakeUsage(prompt_tokens, cached, count_tokens(text)))
+
+    async def generate_content_stream(self, model: str, contents, config=None):
+        self._backend.check_quota()
+        prompt_tokens, cached = self._prompt_tokens(contents, config)
+        self._backend.calls.append(('generate_content_stream', model, config))
+        text = self._reply(contents, config)
+        step = self._backend.stream_chunk_chars
+
+        async def stream():
+            for start in range(0, len(text), step):
+                await asyncio.sleep(self._backend.latency / 4)
+                last = start + step >= len(text)
+                usage = FakeUsage(prompt_tokens, cached, count_tokens(text)) if last else None
+                yield FakeResponse(text[start:start + step], usage)
+
+        return stream()
+
+class FakeAioNamespace:
+    def __init__(self, backend: 'FakeGeminiClient'):
+        self.models = FakeAsyncModels(backend)
+        self.caches = FakeAsyncCaches(backend)
+
+class FakeGeminiClient:
+    """Cliente falso com a mesma forma do genai.Client (apenas a API assíncrona)"""
+
+    def __init__(self, latency: float = None, min_cache_tokens: int = 1024, reply: str = None,
+                 stream_chunk_chars: int = 24, quota: int = None, quota_window: float = 60.0):
+        self.latency = latency if latency is not None else float(os.environ.get('FAKE_GEMINI_LATENCY', '0.05'))
+        self.min_cache_tokens = min_cache_tokens
+        self.reply = reply
+        self.stream_chunk_chars = stream_chunk_chars
+        self.caches = {}
+        self.calls = []
+        self.aio = FakeAioNamespace(self)
+        # Cota de requisições por janela (RPM com a janela padrão); None = sem limite
+        self.quota = quota if quota is not None else int(os.environ.get('FAKE_GEMINI_RPM', '0')) or None
+        self.quota_window = quota_window
+        self.quota_errors = 0
+        self._recent = deque()
+
+    def check_quota(self):
+        """Recusar com 429 quando a janela já tem `quota` requisições"""
+        if not self.quota:
+            return
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= self.quota_window:
+            self._recent.popleft()
+        if len(self._recent) >= self.quota:
+            self.quota_errors += 1
+            raise FakeQuotaError(max(1.0, self.quota_window - (now - self._recent[0])))
+        self._recent.append(now)
+
+def run(generations: int):
+    """Comparar tokens de entrada com e sem cache de contexto para um prompt grande"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import ai_service
+    from ai_engine_service import ai_engine
+    from context_cache_service import context_cache
+
+    business_prompt = "Você é o assistente da Loja Exemplo.\n" + "\n".join(
+        f"- Produto {i}: descrição, preço e condições de entrega detalhadas para o cliente." for i in range(120)
+    )
+    results = {}
+    for enabled in (False, True):
+        backend = FakeGeminiClient(latency=0.01)
+        context_cache.ENABLED = enabled
+        context_cache.invalidate()
+        before = dict(ai_engine.get_stats()['tokens'])
+        for i in range(generations):
+            ai_engine.run(ai_service._generate_content(backend, business_prompt, f"Mensagem atual do usuário: pergunta {i}"))
+        after = ai_engine.get_stats()['tokens']
+        prompt = after['prompt'] - before['prompt']
+        cached = after['cached'] - before['cached']
+        results[enabled] = (prompt, cached, sum(1 for call in backend.calls if call[0] == 'caches.create'))
+
+    print(f"📊 Prompt de ~{count_tokens(business_prompt)} tokens, {generations} gerações")
+    for enabled, (prompt, cached, created) in results.items():
+        label = 'com cache de contexto' if enabled else 'sem cache de contexto'
+        print(f"  {label:24s} entrada={prompt:7d}  em cache={cached:7d}  cobrados integralmente={prompt - cached:7d}  caches criados={created}")
+    saved = results[False][0] - (results[True][0] - results[True][1])
+    print(f"  tokens de entrada economizados: {saved} ({saved / results[False][0]:.1%})")
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
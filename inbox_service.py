@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from app import app
+
+class MessageInbox:
+    """Caixa de entrada durável para mensagens recebidas via webhook
+
+    O webhook apenas grava o evento bruto num SQLite local e responde na hora;
+    um pool de workers drena a caixa e chama o handler configurado.
+    """
+
+    def __init__(self, path: str = None, workers: int = None):
+        self.path = path or os.environ.get('INBOX_DB_PATH', os.path.join(app.instance_path, 'inbox.db'))
+        self.worker_count = workers or int(os.environ.get('INBOX_WORKERS', '4'))
+        self.LEASE_SECONDS = 120   # Eventos em processamento há mais tempo voltam para a fila
+        self.MAX_ATTEMPTS = 3      # Tentativas antes de marcar o evento como falho
+        self.POLL_INTERVAL = 1.0   # Espera máxima por novos eventos (inclui outros processos)
+
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._handler = None
+        self._threads = []
+        self._stopping = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._init_db()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Conexão SQLite própria de cada thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        """Criar a tabela da caixa de entrada se não existir"""
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS inbound_event (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                phone TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                received_at REAL NOT NULL,
+                claimed_at REAL,
+                last_error TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_inbound_event_status_id ON inbound_event (status, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_inbound_event_phone_status ON inbound_event (phone, status)")
+
+    def enqueue(self, phone: str, payload: Dict) -> int:
+        """Gravar evento na caixa de entrada e acordar os workers"""
+        conn = self._connection()
+        cursor = conn.execute(
+            "INSERT INTO inbound_event (phone, payload, received_at) VALUES (?, ?, ?)",
+            (phone, json.dumps(payload), time.time())
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return cursor.lastrowid
+
+    def enqueue_many(self, events: List[Tuple[str, Dict]]) -> List[int]:
+        """Gravar vários eventos (telefone, payload) numa única transação"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [
+                conn.execute(
+                    "INSERT INTO inbound_event (phone, payload, received_at) VALUES (?, ?, ?)",
+                    (phone, json.dumps(payload), now)
+                ).lastrowid
+                for phone, payload in events
+            ]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._wakeup:
+            self._wakeup.notify(len(ids))
+        return ids
+
+    def _claim_next(self) -> Optional[sqlite3.Row]:
+        """Reservar o próximo evento pendente
+
+        Telefones com evento em processamento são pulados para manter a ordem
+        das mensagens de cada contato, inclusive entre processos diferentes.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Devolver à fila eventos cujo lease expirou (worker morreu no meio)
+            conn.execute(
+                "UPDATE inbound_event SET status = 'pending' WHERE status = 'processing' AND claimed_at < ?",
+                (now - self.LEASE_SECONDS,)
+            )
+            row = conn.execute("""
+                SELECT * FROM inbound_event
+                WHERE status = 'pending'
+                  AND phone NOT IN (SELECT phone FROM inbound_event WHERE status = 'processing')
+                ORDER BY id LIMIT 1
+            """).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE inbound_event SET status = 'processing', claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (now, row['id'])
+                )
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _complete(self, event_id: int):
+        self._connection().execute("DELETE FROM inbound_event WHERE id = ?", (event_id,))
+
+    def _fail(self, event_id: int, attempts: int, error: str):
+        status = 'failed' if attempts >= self.MAX_ATTEMPTS else 'pending'
+        self._connection().execute(
+            "UPDATE inbound_event SET status = ?, claimed_at = NULL, last_error = ? WHERE id = ?",
+            (status, error, event_id)
+        )
+
+    def process_next(self, handler: Callable[[Dict], None] = None) -> bool:
+        """Processar o próximo evento pendente; retorna False se não havia nenhum
+
+        Um evento que falha volta para a fila e é entregue de novo ao handler,
+        que por isso precisa ser idempotente (mensagens são deduplicadas pelo
+        id do WhatsApp).
+        """
+        try:
+            row = self._claim_next()
+        except sqlite3.OperationalError as e:
+            logging.warning(f"Caixa de entrada ocupada: {e}")
+            return False
+        if row is None:
+            return False
+
+        attempts = row['attempts'] + 1
+        try:
+            (handler or self._handler)(json.loads(row['payload']))
+            self._complete(row['id'])
+        except Exception as e:
+            logging.error(f"Erro ao processar evento {row['id']} da caixa de entrada: {e}")
+            self._fail(row['id'], attempts, str(e))
+        return True
+
+    def _worker_loop(self):
+        while not self._stopping:
+            if not self.process_next():
+                with self._wakeup:
+                    self._wakeup.wait(self.POLL_INTERVAL)
+
+    def start(self, handler: Callable[[Dict], None]):
+        """Iniciar o pool de workers que drena a caixa de entrada"""
+        self._handler = handler
+        if self._threads:
+            return
+
+        self._stopping = False
+        for i in range(self.worker_count):
+            thread = threading.Thread(target=self._worker_loop, name=f"inbox-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        logging.info(f"📬 Caixa de entrada iniciada com {self.worker_count} workers ({self.path})")
+
+    def stop(self):
+        """Sinalizar parada dos workers"""
+        self._stopping = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+        self._threads = []
+
+    def get_stats(self) -> Dict:
+        """Contagem de eventos por status"""
+        rows = self._connection().execute(
+            "SELECT status, COUNT(*) AS total FROM inbound_event GROUP BY status"
+        ).fetchall()
+        stats = {'pending': 0, 'processing': 0, 'failed': 0}
+        stats.update({row['status']: row['total'] for row in rows})
+        return stats
+
+# Instância global
+message_inbox = MessageInbox()
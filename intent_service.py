@@ -0,0 +1,415 @@
+import os
+import json
+import math
+import time
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from app import app, db
+from models import IntentLabel, Message
+from ai_cache_service import normalize_question, prompt_hash
+from autoresponse_service import KeywordAutomaton, normalize_text
+from settings_service import VersionToken
+
+FIELDS = ('tipo', 'urgencia', 'requer_humano')
+VALID_LABELS = {
+    'tipo': ('pergunta', 'saudacao', 'pedido', 'reclamacao', 'outro'),
+    'urgencia': ('baixo', 'medio', 'alto'),
+    'requer_humano': ('true', 'false'),
+}
+DEFAULT_INTENT = {"tipo": "outro", "urgencia": "baixo", "requer_humano": False}
+
+# Palavras-chave já normalizadas (sem acentos, minúsculas)
+INTENT_KEYWORDS = {
+    'saudacao': ('oi', 'ola', 'opa', 'bom dia', 'boa tarde', 'boa noite', 'e ai', 'tudo bem', 'tudo bom'),
+    'reclamacao': ('reclamacao', 'reclamar', 'problema', 'pessimo', 'horrivel', 'absurdo', 'nao funciona',
+                   'nao chegou', 'defeito', 'quebrado', 'quebrou', 'atrasado', 'atraso', 'errado', 'insatisfeito',
+                   'reembolso', 'devolucao', 'devolver', 'cancelar', 'descaso', 'ninguem responde'),
+    'pedido': ('quero', 'queria', 'gostaria', 'preciso', 'fazer um pedido', 'comprar', 'encomendar', 'reservar',
+               'agendar', 'orcamento', 'me manda', 'me envia', 'pode enviar', 'pode mandar'),
+    'pergunta': ('qual', 'quais', 'quando', 'onde', 'como', 'quanto', 'quantos', 'quanta', 'quem', 'por que',
+                 'porque', 'sera que', 'voces tem', 'vcs tem', 'tem como', 'aceita', 'aceitam'),
+}
+URGENT_KEYWORDS = ('urgente', 'urgencia', 'emergencia', 'socorro', 'imediatamente', 'agora mesmo',
+                   'ainda hoje', 'o quanto antes', 'pra ja')
+HUMAN_KEYWORDS = ('atendente', 'humano', 'pessoa', 'falar com alguem', 'gerente', 'responsavel', 'dono')
+
+def tokenize(text: str) -> List[str]:
+    """Palavras e bigramas normalizados, mais marcadores de pontuação relevantes"""
+    words = normalize_question(text).split()
+    features = words + [f"{first}_{second}" for first, second in zip(words, words[1:])]
+    if '?' in (text or ''):
+        features.append('<?>')
+    if '!' in (text or ''):
+        features.append('<!>')
+    return features
+
+def clean_intent(result) -> Optional[Dict]:
+    """Validar e normalizar um rótulo (ex.: resposta do Gemini); None se inválido"""
+    if not isinstance(result, dict):
+        return None
+    tipo = normalize_text(str(result.get('tipo', ''))).strip()
+    urgencia = normalize_text(str(result.get('urgencia', ''))).strip()
+    if tipo not in VALID_LABELS['tipo'] or urgencia not in VALID_LABELS['urgencia']:
+        return None
+    requer_humano = result.get('requer_humano')
+    if isinstance(requer_humano, str):
+        requer_humano = requer_humano.strip().lower() in ('true', 'sim', '1')
+    return {'tipo': tipo, 'urgencia': urgencia, 'requer_humano': bool(requer_humano)}
+
+class IntentKeyword:
+    """Palavra-chave de intenção no formato esperado pelo KeywordAutomaton"""
+
+    __slots__ = ('keyword', 'group')
+
+    def __init__(self, keyword: str, group: str):
+        self.keyword = keyword
+        self.group = group
+
+class NaiveBayes:
+    """Naive Bayes multinomial com suavização de Laplace (serializável em JSON)"""
+
+    def __init__(self, class_counts: Dict = None, feature_counts: Dict = None, alpha: float = 1.0):
+        self.class_counts = class_counts or {}
+        self.feature_counts = feature_counts or {}
+        self.alpha = alpha
+        self._prepare()
+
+    @classmethod
+    def fit(cls, samples: List[Tuple[List[str], str]], alpha: float = 1.0) -> 'NaiveBayes':
+        class_counts = Counter()
+        feature_counts = {}
+        for features, label in samples:
+            class_counts[label] += 1
+            feature_counts.setdefault(label, Counter()).update(features)
+        return cls(dict(class_counts), {label: dict(counts) for label, counts in feature_counts.items()}, alpha)
+
+    def _prepare(self):
+        self.vocabulary = set()
+        for counts in self.feature_counts.values():
+            self.vocabulary.update(counts)
+        total_samples = sum(self.class_counts.values())
+        vocabulary_size = len(self.vocabulary) or 1
+        self._log_prior = {
+            label: math.log(count / total_samples) for label, count in self.class_counts.items()
+        }
+        self._denominator = {
+            label: math.log(sum(self.feature_counts.get(label, {}).values()) + self.alpha * vocabulary_size)
+            for label in self.class_counts
+        }
+
+    def predict(self, features: List[str]) -> Tuple[Optional[str], float]:
+        """Classe mais provável e sua probabilidade; (None, 0) sem nenhuma feature conhecida"""
+        known = [feature for feature in features if feature in self.vocabulary]
+        if not known or not self.class_counts:
+            return None, 0.0
+
+        scores = {}
+        for label, log_prior in self._log_prior.items():
+            counts = self.feature_counts.get(label, {})
+            denominator = self._denominator[label]
+            scores[label] = log_prior + sum(
+                math.log(counts.get(feature, 0) + self.alpha) - denominator for feature in known
+            )
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / total
+
+    def to_dict(self) -> Dict:
+        return {'class_counts': self.class_counts, 'feature_counts': self.feature_counts, 'alpha': self.alpha}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'NaiveBayes':
+        return cls(data['class_counts'], data['feature_counts'], data.get('alpha', 1.0))
+
+class IntentClassifier:
+    """Classificador local de intenção na frente do analyze_message_intent
+
+    Primeiro regras de palavras-chave (um autômato, uma passada pelo texto);
+    quando elas não decidem, um Naive Bayes treinado com o histórico de
+    mensagens. Só quando nenhum dos dois tem confiança suficiente
+    (INTENT_CONFIDENCE) a mensagem vai para o Gemini, e o rótulo devolvido
+    é guardado em IntentLabel para o próximo treino.
+
+    No caminho da resposta a classificação é só local (escalate=False);
+    os rótulos do Gemini vêm de `python train_intent.py --label N`, que
+    manda as mensagens incertas mais recentes para o analyze_message_intent.
+
+    O modelo fica em instance/intent_model.json; train() publica uma nova
+    versão (VersionToken próprio) para os outros workers recarregarem.
+    """
+
+    VERSION_SETTING = 'intent_model_version'
+
+    def __init__(self, path: str = None):
+        self.CONFIDENCE = float(os.environ.get('INTENT_CONFIDENCE', '0.9'))
+        self.MAX_TRAINING_MESSAGES = int(os.environ.get('INTENT_MAX_TRAINING_MESSAGES', '20000'))
+        self.MAX_GREETING_WORDS = 5  # "oi, tudo bem?" é saudação; "oi, o pedido 123 ..." não
+        self.LABEL_WEIGHT = 3  # Rótulos do Gemini valem mais que os inferidos pelas regras
+        self.path = path or os.environ.get('INTENT_MODEL_PATH', os.path.join(app.instance_path, 'intent_model.json'))
+
+        keywords = [IntentKeyword(keyword, tipo) for tipo, words in INTENT_KEYWORDS.items() for keyword in words]
+        keywords += [IntentKeyword(keyword, 'urgente') for keyword in URGENT_KEYWORDS]
+        keywords += [IntentKeyword(keyword, 'humano') for keyword in HUMAN_KEYWORDS]
+        self._automaton = KeywordAutomaton(keywords)
+
+        self._lock = threading.Lock()
+        self._models = None
+        self._model_info = {}
+        self._version = None
+        self._version_token = VersionToken(self.VERSION_SETTING)
+        self._loaded = False
+        self._stats = {'rules': 0, 'model': 0, 'gemini': 0, 'fallback': 0}
+
+    # Classificação ----------------------------------------------------------
+
+    def classify(self, message: str) -> Tuple[Dict, bool]:
+        """Intenção estimada localmente e se ela é confiável o bastante para dispensar o Gemini"""
+        intent = self.rules(message)
+        if intent:
+            return dict(intent, origem='regras', confianca=1.0), True
+
+        models = self._current_models()
+        if models:
+            prediction = {}
+            confidence = 1.0
+            features = tokenize(message)
+            for field in FIELDS:
+                label, probability = models[field].predict(features)
+                if label is None:
+                    confidence = 0.0
+                    break
+                prediction[field] = label == 'true' if field == 'requer_humano' else label
+                confidence = min(confidence, probability)
+            if len(prediction) == len(FIELDS):
+                return dict(prediction, origem='modelo', confianca=round(confidence, 3)), confidence >= self.CONFIDENCE
+
+        return dict(DEFAULT_INTENT, origem='padrao', confianca=0.0), False
+
+    def rules(self, message: str) -> Optional[Dict]:
+        """Intenção pelas palavras-chave, ou None quando as regras não decidem o tipo"""
+        text = normalize_question(message)
+        groups = {keyword.group for keyword in self._automaton.search(text)}
+        tipos = groups & set(INTENT_KEYWORDS)
+
+        if 'reclamacao' in tipos:
+            tipo = 'reclamacao'
+        else:
+            if len(tipos) > 1:
+                tipos.discard('saudacao')  # "oi, quero ..." é pedido
+            if not tipos and '?' in (message or ''):
+                tipos = {'pergunta'}
+            if len(tipos) != 1:
+                return None
+            tipo = tipos.pop()
+            if tipo == 'saudacao' and len(text.split()) > self.MAX_GREETING_WORDS:
+                return None
+
+        if 'urgente' in groups:
+            urgencia = 'alto'
+        elif tipo == 'reclamacao':
+            urgencia = 'medio'
+        else:
+            urgencia = 'baixo'
+        requer_humano = 'humano' in groups or tipo == 'reclamacao' or urgencia == 'alto'
+        return {'tipo': tipo, 'urgencia': urgencia, 'requer_humano': requer_humano}
+
+    def record(self, origem: str):
+        """Contar por onde a intenção foi resolvida (regras, modelo, gemini, fallback)"""
+        with self._lock:
+            self._stats[origem] = self._stats.get(origem, 0) + 1
+
+    def record_label(self, message: str, intent: Dict, source: str = 'gemini'):
+        """Guardar rótulo (normalmente do Gemini) como exemplo de treino"""
+        intent = clean_intent(intent)
+        if not intent or not (message or '').strip():
+            return
+        text_key = prompt_hash(normalize_question(message))
+        with app.app_context():
+            try:
+                label = IntentLabel.query.filter_by(text_key=text_key).first()
+                if not label:
+                    label = IntentLabel(text_key=text_key, text=message)
+                    db.session.add(label)
+                label.tipo = intent['tipo']
+                label.urgencia = intent['urgencia']
+                label.requer_humano = intent['requer_humano']
+                label.source = source
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logging.debug(f"Erro ao salvar rótulo de intenção: {e}")
+
+    # Modelo -----------------------------------------------------------------
+
+    def _current_models(self) -> Optional[Dict]:
+        version = self._version_token.get()
+        if self._loaded and version == self._version:
+            return self._models
+
+        with self._lock:
+            if not self._loaded or version != self._version:
+                self._models, self._model_info = self._load()
+                self._version = version
+                self._loaded = True
+            return self._models
+
+    def _load(self) -> Tuple[Optional[Dict], Dict]:
+        try:
+            with open(self.path, encoding='utf-8') as model_file:
+                data = json.load(model_file)
+        except FileNotFoundError:
+            return None, {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Modelo de intenção inválido ({self.path}): {e}")
+            return None, {}
+
+        models = {field: NaiveBayes.from_dict(data['fields'][field]) for field in FIELDS}
+        info = {key: data.get(key) for key in ('trained_at', 'examples')}
+        logging.info(f"🏷️ Modelo de intenção carregado ({info['examples']} exemplos, {info['trained_at']})")
+        return models, info
+
+    def training_samples(self) -> List[Tuple[str, str, Dict, str]]:
+        """(chave, texto, rótulo, origem): rótulos salvos + histórico rotulado pelas regras"""
+        samples = {}
+        with app.app_context():
+            for label in IntentLabel.query.all():
+                samples[label.text_key] = (label.text, {
+                    'tipo': label.tipo, 'urgencia': label.urgencia, 'requer_humano': bool(label.requer_humano)
+                }, label.source or 'gemini')
+
+            rows = db.session.query(Message.content).filter(Message.is_from_user.is_(True)) \
+                .order_by(Message.id.desc()).limit(self.MAX_TRAINING_MESSAGES).all()
+            for (content,) in rows:
+                text_key = prompt_hash(normalize_question(content))
+                if text_key in samples:
+                    continue
+                intent = self.rules(content)
+                if intent:
+                    samples[text_key] = (content, intent, 'rules')
+
+        return [(text_key, text, intent, source) for text_key, (text, intent, source) in samples.items()]
+
+    def uncertain_messages(self, limit: int) -> List[str]:
+        """Mensagens recentes de usuários que o classificador local não decide e ainda sem rótulo"""
+        with app.app_context():
+            labeled = {text_key for (text_key,) in db.session.query(IntentLabel.text_key)}
+            rows = db.session.query(Message.content).filter(Message.is_from_user.is_(True)) \
+                .order_by(Message.id.desc()).limit(self.MAX_TRAINING_MESSAGES).all()
+
+        messages = []
+        for (content,) in rows:
+            text_key = prompt_hash(normalize_question(content))
+            if text_key in labeled or not content.strip():
+                continue
+            labeled.add(text_key)
+            if not self.classify(content)[1]:
+                messages.append(content)
+                if len(messages) >= limit:
+                    break
+        return messages
+
+    def _fit(self, samples: List[Tuple[str, str, Dict, str]]) -> Dict:
+        weighted = []
+        for _, text, intent, source in samples:
+            features = tokenize(text)
+            weight = 1 if source == 'rules' else self.LABEL_WEIGHT
+            weighted.extend([(features, intent)] * weight)
+        return {
+            field: NaiveBayes.fit([
+                (features, str(intent[field]).lower() if field == 'requer_humano' else intent[field])
+                for features, intent in weighted
+            ])
+            for field in FIELDS
+        }
+
+    def train(self, save: bool = True) -> Dict:
+        """Treinar com o histórico, avaliar num conjunto separado e (opcionalmente) salvar
+
+        Retorna o relatório de acurácia, cobertura e latência.
+        """
+        samples = self.training_samples()
+        # Separação determinística: ~20% dos textos ficam para avaliação
+        test = [sample for sample in samples if int(sample[0], 16) % 5 == 0]
+        train = [sample for sample in samples if int(sample[0], 16) % 5 != 0]
+
+        candidate = IntentClassifier(path=os.devnull)
+        candidate._models = candidate._fit(train) if train else None
+        candidate._loaded = True
+        candidate._version = candidate._version_token.get()
+        report = candidate.evaluate(test)
+        report['train_examples'] = len(train)
+
+        if save and samples:
+            models = self._fit(samples)
+            data = {
+                'trained_at': datetime.utcnow().isoformat(),
+                'examples': len(samples),
+                'fields': {field: model.to_dict() for field, model in models.items()},
+            }
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temporary = f"{self.path}.tmp"
+            with open(temporary, 'w', encoding='utf-8') as model_file:
+                json.dump(data, model_file, ensure_ascii=False)
+            os.replace(temporary, self.path)
+            self._version_token.bump()
+            logging.info(f"🏷️ Modelo de intenção treinado com {len(samples)} exemplos")
+            report['saved'] = self.path
+        return report
+
+    def evaluate(self, samples: List[Tuple[str, str, Dict, str]]) -> Dict:
+        """Acurácia, cobertura local e latência do classificador sobre exemplos rotulados
+
+        A acurácia usa só os rótulos do Gemini quando existem (os inferidos
+        pelas regras concordariam com as próprias regras por construção).
+        """
+        labeled = [sample for sample in samples if sample[3] != 'rules']
+        reference = 'gemini' if labeled else 'rules'
+        if not labeled:
+            labeled = samples
+
+        correct = Counter()
+        local = Counter()
+        latencies = []
+        for _, text, intent, _ in labeled:
+            started = time.perf_counter()
+            prediction, confident = self.classify(text)
+            latencies.append(time.perf_counter() - started)
+
+            hits = [prediction[field] == intent[field] for field in FIELDS]
+            for field, hit in zip(FIELDS, hits):
+                correct[field] += hit
+            correct['all'] += all(hits)
+            if confident:
+                local['count'] += 1
+                local['correct'] += all(hits)
+                local[prediction['origem']] += 1
+
+        total = len(labeled)
+        latencies.sort()
+        return {
+            'reference': reference,
+            'test_examples': total,
+            'accuracy': {field: round(correct[field] / total, 3) if total else None
+                         for field in FIELDS + ('all',)},
+            'local_coverage': round(local['count'] / total, 3) if total else None,
+            'local_accuracy': round(local['correct'] / local['count'], 3) if local['count'] else None,
+            'resolved_by': {'regras': local['regras'], 'modelo': local['modelo']},
+            'latency_ms': {
+                'mean': round(1000 * sum(latencies) / total, 3) if total else None,
+                'p95': round(1000 * latencies[int(0.95 * (total - 1))], 3) if total else None,
+            },
+        }
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        decided = sum(stats.values())
+        stats['local_rate'] = round((stats['rules'] + stats['model']) / decided, 3) if decided else 0.0
+        stats['model_info'] = dict(self._model_info, loaded=self._models is not None) if self._loaded else None
+        return stats
+
+# Instância global
+intent_classifier = IntentClassifier()
@@ -1,52 +1,50 @@
 #!/usr/bin/env python3
 """
-Migration script to add new columns to AutoResponse table
+Aplicar migrações versionadas e verificar os planos das consultas quentes
+
+Uso:
+    python migrate_db.py                # aplica migrações pendentes
+    python migrate_db.py --check-plans  # também falha se alguma consulta quente
+                                        # voltar a varrer a tabela inteira
+    python migrate_db.py --backfill-counters  # recalcula message_count e
+                                              # last_message_* de todas as conversas
 """
 import os
 import sys
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import app, db
-from models import AutoResponse
-from sqlalchemy import text
+from migrations import run_migrations, check_query_plans, backfill_conversation_counters
 
-def migrate_database():
-    """Add new columns to AutoResponse table"""
+def migrate_database(check_plans: bool = False, backfill_counters: bool = False):
+    """Aplicar migrações pendentes (e opcionalmente recalcular contadores e checar os planos)"""
     with app.app_context():
         print("🔄 Iniciando migração do banco de dados...")
-        
+
         try:
-            # Check if columns already exist
-            inspector = db.inspect(db.engine)
-            columns = [col['name'] for col in inspector.get_columns('auto_responses')]
-            
-            # Add response_type column if it doesn't exist
-            if 'response_type' not in columns:
-                print("  ➕ Adicionando coluna 'response_type'...")
-                db.session.execute(text("ALTER TABLE auto_responses ADD COLUMN response_type VARCHAR(20) DEFAULT 'simple'"))
-                db.session.commit()
-                print("  ✅ Coluna 'response_type' adicionada com sucesso")
-            else:
-                print("  ℹ️  Coluna 'response_type' já existe")
-            
-            # Add pause_ai column if it doesn't exist
-            if 'pause_ai' not in columns:
-                print("  ➕ Adicionando coluna 'pause_ai'...")
-                db.session.execute(text("ALTER TABLE auto_responses ADD COLUMN pause_ai BOOLEAN DEFAULT FALSE"))
-                db.session.commit()
-                print("  ✅ Coluna 'pause_ai' adicionada com sucesso")
-            else:
-                print("  ℹ️  Coluna 'pause_ai' já existe")
-            
-            print("✅ Migração concluída com sucesso!")
-            
+            version = run_migrations(db.engine)
+            print(f"✅ Banco na versão {version}")
         except Exception as e:
             print(f"❌ Erro na migração: {e}")
-            db.session.rollback()
             return False
-            
+
+        if backfill_counters:
+            with db.engine.begin() as conn:
+                updated = backfill_conversation_counters(conn)
+            print(f"✅ Contadores recalculados para {updated} conversas")
+
+        if check_plans:
+            problems = check_query_plans(db.engine)
+            if problems:
+                for name, details in problems.items():
+                    print(f"  ❌ {name}: {'; '.join(details)}")
+                print("❌ Consultas quentes sem índice!")
+                return False
+            print("✅ Todas as consultas quentes usam índice")
+
         return True
 
 if __name__ == '__main__':
-    success = migrate_database()
-    sys.exit(0 if success else 1)
\ No newline at end of file
+    success = migrate_database(check_plans='--check-plans' in sys.argv,
+                               backfill_counters='--backfill-counters' in sys.argv)
+    sys.exit(0 if success else 1)
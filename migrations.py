@@ -0,0 +1,193 @@
+"""
+Migrações versionadas do banco de dados
+
+Cada migração tem um número de versão e roda uma única vez; a versão
+aplicada fica registrada na tabela schema_version. Bancos novos já nascem
+com as colunas e índices pelo db.create_all(), por isso as migrações
+conferem o que existe antes de alterar.
+"""
+import logging
+from sqlalchemy import inspect, select, func, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+def _columns(conn, table: str) -> set:
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+def _add_column(conn, table: str, column: str, ddl: str):
+    if column not in _columns(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        logging.info(f"✅ Added {table}.{column} column")
+
+def migration_001_legacy_columns(conn):
+    """Colunas antes adicionadas por checagens ad-hoc no app.py"""
+    _add_column(conn, 'conversation', 'ai_paused', "BOOLEAN DEFAULT FALSE")
+    _add_column(conn, 'conversation', 'paused_at', "TIMESTAMP")
+    _add_column(conn, 'auto_response', 'response_type', "VARCHAR(20) DEFAULT 'simple'")
+    _add_column(conn, 'auto_response', 'trigger_type', "VARCHAR(20) DEFAULT 'first_message'")
+    _add_column(conn, 'auto_response', 'main_question', "TEXT")
+    for option in ('option_a', 'option_b', 'option_c', 'option_d'):
+        _add_column(conn, 'auto_response', option, "VARCHAR(200)")
+    _add_column(conn, 'auto_response', 'pause_ai', "BOOLEAN DEFAULT FALSE")
+
+def migration_002_conversation_phone_key(conn):
+    """Chave canônica (só dígitos) e única por telefone, mesclando conversas duplicadas"""
+    from models import canonical_phone
+
+    _add_column(conn, 'conversation', 'phone_key', "VARCHAR(20)")
+
+    rows = conn.execute(text("SELECT id, phone_number FROM conversation ORDER BY id")).fetchall()
+    keep_by_key = {}
+    for conversation_id, phone_number in rows:
+        key = canonical_phone(phone_number)
+        if key in keep_by_key:
+            # Conversa duplicada: mover mensagens para a mais antiga e apagar
+            keep_id = keep_by_key[key]
+            conn.execute(text("UPDATE message SET conversation_id = :keep WHERE conversation_id = :dup"),
+                         {'keep': keep_id, 'dup': conversation_id})
+            conn.execute(text("DELETE FROM conversation WHERE id = :dup"), {'dup': conversation_id})
+            logging.info(f"🔀 Conversa {conversation_id} mesclada em {keep_id} ({key})")
+        else:
+            keep_by_key[key] = conversation_id
+            conn.execute(text("UPDATE conversation SET phone_key = :key WHERE id = :id"),
+                         {'key': key, 'id': conversation_id})
+
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_conversation_phone_key ON conversation (phone_key)"))
+
+def migration_003_hot_path_indexes(conn):
+    """Índices das consultas quentes: histórico/contagem por conversa e ordenação do dashboard"""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_message_conversation_timestamp ON message (conversation_id, timestamp)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_conversation_updated_at ON conversation (updated_at)"))
+
+def backfill_conversation_counters(conn, conversation_id: int = None) -> int:
+    """Recalcular message_count/last_message_* a partir da tabela message
+
+    Usa subconsultas correlacionadas servidas pelo índice (conversation_id, timestamp).
+    Retorna o número de conversas atualizadas.
+    """
+    from models import PREVIEW_LENGTH
+
+    where = "WHERE id = :id" if conversation_id is not None else ""
+    result = conn.execute(text(f"""
+        UPDATE conversation SET
+            message_count = (SELECT COUNT(*) FROM message WHERE message.conversation_id = conversation.id),
+            last_message_at = (SELECT MAX(timestamp) FROM message WHERE message.conversation_id = conversation.id),
+            last_message_preview = (
+                SELECT substr(content, 1, :length) FROM message
+                WHERE message.conversation_id = conversation.id
+                ORDER BY timestamp DESC, id DESC LIMIT 1
+            )
+        {where}
+    """), {'length': PREVIEW_LENGTH, 'id': conversation_id})
+    return result.rowcount
+
+def migration_004_conversation_counters(conn):
+    """Contadores desnormalizados na conversa (evita carregar o histórico para listar)"""
+    _add_column(conn, 'conversation', 'message_count', "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, 'conversation', 'last_message_at', "TIMESTAMP")
+    _add_column(conn, 'conversation', 'last_message_preview', "VARCHAR(100)")
+    updated = backfill_conversation_counters(conn)
+    logging.info(f"🔢 Contadores recalculados para {updated} conversas")
+
+def migration_005_conversation_summary(conn):
+    """Resumo incremental da conversa usado no prompt da IA"""
+    _add_column(conn, 'conversation', 'summary', "TEXT")
+    _add_column(conn, 'conversation', 'summary_message_id', "INTEGER")
+    _add_column(conn, 'conversation', 'summary_message_count', "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, 'conversation', 'summary_updated_at', "TIMESTAMP")
+
+def migration_006_message_whatsapp_id(conn):
+    """Id da mensagem no WhatsApp, para não gravar duas vezes o mesmo evento ou histórico"""
+    _add_column(conn, 'message', 'whatsapp_id', "VARCHAR(64)")
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_message_conversation_whatsapp_id ON message (conversation_id, whatsapp_id)"
+    ))
+
+def migration_007_connection_snapshot(conn):
+    """Snapshot completo do status da conexão, compartilhado entre os workers"""
+    _add_column(conn, 'whats_app_connection', 'status_json', "TEXT")
+    _add_column(conn, 'whats_app_connection', 'version', "VARCHAR(32)")
+
+def migration_008_message_conversation_id_index(conn):
+    """Histórico depois do resumo: filtro e ordenação pelo id dentro da conversa"""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_message_conversation_id ON message (conversation_id, id)"))
+
+MIGRATIONS = [
+    (1, 'legacy columns', migration_001_legacy_columns),
+    (2, 'conversation phone key', migration_002_conversation_phone_key),
+    (3, 'hot path indexes', migration_003_hot_path_indexes),
+    (4, 'conversation counters', migration_004_conversation_counters),
+    (5, 'conversation summary', migration_005_conversation_summary),
+    (6, 'message whatsapp id', migration_006_message_whatsapp_id),
+    (7, 'connection snapshot', migration_007_connection_snapshot),
+    (8, 'message conversation id index', migration_008_message_conversation_id_index),
+]
+
+def _current_version(conn) -> int:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description VARCHAR(100), applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    ))
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+def run_migrations(engine) -> int:
+    """Aplicar migrações pendentes, cada uma na sua transação; retorna a versão final"""
+    with engine.begin() as conn:
+        version = _current_version(conn)
+
+    for number, description, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        try:
+            with engine.begin() as conn:
+                # Outro worker pode ter aplicado enquanto esperávamos o lock
+                if _current_version(conn) >= number:
+                    continue
+                migration(conn)
+                conn.execute(text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+                             {'v': number, 'd': description})
+            logging.info(f"✅ Migração {number} aplicada: {description}")
+        except (IntegrityError, OperationalError):
+            # Corrida com outro worker: só é erro se a versão ainda não foi aplicada
+            with engine.begin() as conn:
+                if _current_version(conn) < number:
+                    raise
+            logging.info(f"Migração {number} já aplicada por outro processo")
+        version = number
+
+    return version
+
+def hot_queries():
+    """Consultas do caminho quente que nunca devem virar varredura completa"""
+    from models import Conversation, Message
+
+    return {
+        'conversation by phone': select(Conversation).where(Conversation.phone_key == '5511999999999'),
+        'recent history': select(Message).where(Message.conversation_id == 1, Message.id > 100)
+                                        .order_by(Message.id.desc()).limit(20),
+        'message count': select(func.count()).select_from(Message).where(Message.conversation_id == 1),
+        'dashboard ordering': select(Conversation).order_by(Conversation.updated_at.desc()).limit(20),
+    }
+
+def check_query_plans(engine) -> dict:
+    """Rodar EXPLAIN QUERY PLAN (SQLite) nas consultas quentes
+
+    Retorna {nome: [linhas problemáticas]}; vazio quando todas usam índice.
+    Uma linha 'SCAN tabela' sem índice ou um B-tree temporário para o
+    ORDER BY indica regressão para varredura da tabela inteira.
+    """
+    if engine.dialect.name != 'sqlite':
+        raise RuntimeError("Verificação de planos implementada apenas para SQLite")
+
+    problems = {}
+    with engine.connect() as conn:
+        for name, statement in hot_queries().items():
+            compiled = statement.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True})
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").fetchall()
+            details = [row[-1] for row in plan]
+            bad = [
+                detail for detail in details
+                if (detail.startswith('SCAN ') and ' USING ' not in detail) or 'TEMP B-TREE' in detail
+            ]
+            if bad:
+                problems[name] = bad
+    return problems
@@ -0,0 +1,242 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict
+from ai_engine_service import Dispatch, current_dispatch
+
+class TierStats:
+    """Latências recentes de um nível de modelo (janela das últimas SAMPLES chamadas)"""
+
+    SAMPLES = 500
+
+    def __init__(self):
+        self.first_chunk = deque(maxlen=self.SAMPLES)
+        self.total = deque(maxlen=self.SAMPLES)
+        # cancelled = tentativas que perderam para a reserva (a latência delas fica de fora das amostras)
+        self.counts = {'routed': 0, 'requests': 0, 'errors': 0, 'cancelled': 0, 'hedges_fired': 0, 'hedge_wins': 0}
+
+    @staticmethod
+    def _summary(samples) -> Dict:
+        if not samples:
+            return {'count': 0, 'mean': None, 'p50': None, 'p95': None}
+        ordered = sorted(samples)
+        last = len(ordered) - 1
+        return {
+            'count': len(ordered),
+            'mean': round(sum(ordered) / len(ordered), 3),
+            'p50': round(ordered[int(0.5 * last)], 3),
+            'p95': round(ordered[int(0.95 * last)], 3),
+        }
+
+    def snapshot(self) -> Dict:
+        return dict(self.counts, first_chunk_seconds=self._summary(self.first_chunk),
+                    total_seconds=self._summary(self.total))
+
+class ModelRouter:
+    """Escolha do modelo por pedido e requisições de reserva (hedging)
+
+    Mensagens curtas e simples (saudações, "ok", "obrigado") vão para o
+    nível leve; rajadas da fila, mensagens longas e perguntas ficam com o
+    modelo completo. Se o primeiro trecho não chega em HEDGE_AFTER segundos,
+    contados de quando a requisição saiu da fila do motor (limitador de taxa
+    e semáforo), a mesma geração é disparada no outro nível e vale a que
+    responder primeiro; a outra é cancelada. Espera por cota nunca dispara
+    reserva, senão o limitador contido dobraria o consumo. As latências por nível aparecem em
+    get_stats() para ajustar os limites.
+
+    Todos os métodos async rodam no loop do motor de IA.
+    """
+
+    def __init__(self):
+        self.TIERS = {
+            'lite': os.environ.get('AI_MODEL_LITE', 'gemini-2.5-flash-lite'),
+            'full': os.environ.get('AI_MODEL', 'gemini-2.5-flash'),
+        }
+        self.HEDGE_TO = {'lite': 'full', 'full': 'lite'}
+        self.ROUTING = os.environ.get('AI_MODEL_ROUTING', 'true').lower() in ('1', 'true', 'yes')
+        self.LITE_MAX_CHARS = int(os.environ.get('AI_LITE_MAX_CHARS', '60'))
+        self.LITE_MAX_WORDS = 3  # "ok, obrigado!" sem palavra-chave de intenção
+        self.HEDGE_AFTER = float(os.environ.get('AI_HEDGE_AFTER', '5'))  # Segundos; 0 desliga
+        self._stats = {tier: TierStats() for tier in self.TIERS}
+
+    def model(self, tier: str) -> str:
+        return self.TIERS[tier]
+
+    def route(self, message: str, message_count: int = 1, intent: Dict = None) -> str:
+        """Nível para a mensagem: 'lite' só para mensagens curtas e simples
+
+        intent é o resultado do analyze_message_intent, quando já calculado;
+        sem ele (ou com confiança baixa) valem as regras de palavras-chave.
+        """
+        tier = self._choose(message or '', message_count, intent)
+        self._stats[tier].counts['routed'] += 1
+        return tier
+
+    def _choose(self, message: str, message_count: int, intent: Dict = None) -> str:
+        text = message.strip()
+        if not self.ROUTING or message_count > 1 or len(text) > self.LITE_MAX_CHARS or '\n' in text:
+            return 'full'
+
+        from intent_service import intent_classifier
+        if not intent or intent.get('confianca', 0) < intent_classifier.CONFIDENCE:
+            intent = intent_classifier.rules(text)
+        if intent:
+            return 'lite' if intent['tipo'] == 'saudacao' and not intent['requer_humano'] else 'full'
+        if '?' not in text and len(text.split()) <= self.LITE_MAX_WORDS:
+            return 'lite'
+        return 'full'
+
+    # Execução com hedging ----------------------------------------------------
+
+    async def generate(self, tier: str, call: Callable[[str], Awaitable]):
+        """Executar call(modelo) no nível escolhido, com reserva no outro nível se demorar"""
+        primary = Dispatch()
+        attempts = {tier: asyncio.ensure_future(self._timed(tier, call, primary))}
+        if await self._should_hedge(attempts[tier], primary):
+            attempts[self._fire_hedge(tier)] = asyncio.ensure_future(self._timed(self.HEDGE_TO[tier], call, Dispatch()))
+
+        winner, result = await self._first_success(attempts)
+        if winner != tier:
+            self._stats[winner].counts['hedge_wins'] += 1
+        return result
+
+    async def stream(self, tier: str, open_stream: Callable[[str], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Streaming com hedging pelo tempo até o primeiro trecho
+
+        Só os trechos do stream vencedor são entregues, então as duas
+        gerações nunca se misturam.
+        """
+        streams = {tier: open_stream(self.model(tier))}
+        started = {tier: time.monotonic()}
+        primary = Dispatch()
+        attempts = {tier: asyncio.ensure_future(self._first_chunk(tier, streams[tier], started[tier], primary))}
+        if await self._should_hedge(attempts[tier], primary):
+            hedge = self._fire_hedge(tier)
+            streams[hedge] = open_stream(self.model(hedge))
+            started[hedge] = time.monotonic()
+            attempts[hedge] = asyncio.ensure_future(
+                self._first_chunk(hedge, streams[hedge], started[hedge], Dispatch()))
+
+        try:
+            winner, first = await self._first_success(attempts)
+        except BaseException:
+            for agen in streams.values():
+                await agen.aclose()
+            raise
+        if winner != tier:
+            self._stats[winner].counts['hedge_wins'] += 1
+        for other, agen in streams.items():
+            if other != winner:
+                await agen.aclose()
+
+        stream = streams[winner]
+        try:
+            if first is not None:
+                yield first
+                async for text in stream:
+                    yield text
+            self._stats[winner].total.append(time.monotonic() - started[winner])
+        except Exception:
+            self._stats[winner].counts['errors'] += 1
+            raise
+        finally:
+            await stream.aclose()
+
+    async def _should_hedge(self, attempt: asyncio.Future, dispatch: Dispatch) -> bool:
+        """Esperar HEDGE_AFTER segundos desde que a tentativa foi enviada; True se ela ainda não terminou
+
+        Enquanto a tentativa está na fila do motor (inclusive ao voltar para
+        ela num retry de cota) o relógio fica parado.
+        """
+        if self.HEDGE_AFTER <= 0:
+            return False
+        while not attempt.done():
+            if dispatch.sent_at is None:
+                sent = asyncio.ensure_future(dispatch.sent.wait())
+                try:
+                    await asyncio.wait({attempt, sent}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    sent.cancel()
+                continue
+            remaining = dispatch.sent_at + self.HEDGE_AFTER - time.monotonic()
+            if remaining <= 0:
+                return True
+            await asyncio.wait({attempt}, timeout=remaining)
+        return False
+
+    def _fire_hedge(self, tier: str) -> str:
+        hedge = self.HEDGE_TO[tier]
+        self._stats[tier].counts['hedges_fired'] += 1
+        logging.info(f"⏱️ {self.model(tier)} sem resposta em {self.HEDGE_AFTER}s - reserva em {self.model(hedge)}")
+        return hedge
+
+    async def _timed(self, tier: str, call: Callable[[str], Awaitable], dispatch: Dispatch):
+        current_dispatch.set(dispatch)  # Contexto próprio desta task: o motor marca o envio aqui
+        stats = self._stats[tier]
+        stats.counts['requests'] += 1
+        started = time.monotonic()
+        try:
+            result = await call(self.model(tier))
+        except asyncio.CancelledError:
+            stats.counts['cancelled'] += 1
+            raise
+        except Exception:
+            stats.counts['errors'] += 1
+            raise
+        elapsed = time.monotonic() - started
+        stats.first_chunk.append(elapsed)
+        stats.total.append(elapsed)
+        return result
+
+    async def _first_chunk(self, tier: str, stream: AsyncIterator[str], started: float, dispatch: Dispatch):
+        """Primeiro trecho do stream (None se ele terminar vazio)"""
+        current_dispatch.set(dispatch)
+        stats = self._stats[tier]
+        stats.counts['requests'] += 1
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except asyncio.CancelledError:
+            stats.counts['cancelled'] += 1
+            raise
+        except Exception:
+            stats.counts['errors'] += 1
+            raise
+        stats.first_chunk.append(time.monotonic() - started)
+        return first
+
+    @staticmethod
+    async def _first_success(attempts: Dict[str, asyncio.Future]):
+        """(nível, resultado) da primeira tentativa bem-sucedida; cancela as demais
+
+        Se todas falharem, propaga o erro da primeira a falhar.
+        """
+        pending = set(attempts.values())
+        first_error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        tier = next(name for name, attempt in attempts.items() if attempt is future)
+                        return tier, future.result()
+                    first_error = first_error or future.exception()
+            raise first_error
+        finally:
+            for future in pending:
+                future.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def get_stats(self) -> Dict:
+        return {
+            'routing': self.ROUTING,
+            'hedge_after': self.HEDGE_AFTER,
+            'tiers': {tier: dict(self._stats[tier].snapshot(), model=model) for tier, model in self.TIERS.items()},
+        }
+
+# Instância global
+model_router = ModelRouter()
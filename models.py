@@ -1,10 +1,25 @@
+import re
 from datetime import datetime
+from sqlalchemy.orm import validates
+from sqlalchemy.sql import ClauseElement
 from app import db
 
+def canonical_phone(phone_number: str) -> str:
+    """Canonical phone key: digits only (strips '+', spaces and JID suffixes)"""
+    return re.sub(r'\D', '', (phone_number or '').split('@')[0])
+
+PREVIEW_LENGTH = 100  # Characters kept in Conversation.last_message_preview
+
 class Conversation(db.Model):
     """Model for storing WhatsApp conversations"""
+    __table_args__ = (
+        db.Index('uq_conversation_phone_key', 'phone_key', unique=True),
+        db.Index('ix_conversation_updated_at', 'updated_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     phone_number = db.Column(db.String(20), nullable=False)
+    phone_key = db.Column(db.String(20))  # canonical_phone(phone_number), unique
     contact_name = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -12,18 +27,62 @@ class Conversation(db.Model):
     ai_paused = db.Column(db.Boolean, default=False)  # True when human takes over
     paused_at = db.Column(db.DateTime)  # When AI was paused
     
+    # Denormalized from Message so listing conversations never loads their history
+    message_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    last_message_at = db.Column(db.DateTime)
+    last_message_preview = db.Column(db.String(100))
+    
+    # Rolling AI summary of the messages up to summary_message_id (see summary_service)
+    summary = db.Column(db.Text)
+    summary_message_id = db.Column(db.Integer)
+    summary_message_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    summary_updated_at = db.Column(db.DateTime)
+    
     # Relationship with messages
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan')
+    
+    @validates('phone_number')
+    def _set_phone_key(self, key, phone_number):
+        self.phone_key = canonical_phone(phone_number)
+        return phone_number
+    
+    @classmethod
+    def find_by_phone(cls, phone_number: str):
+        """Look up a conversation through the unique canonical phone key"""
+        return cls.query.filter_by(phone_key=canonical_phone(phone_number)).first()
+    
+    def record_message(self, message, count: int = 1):
+        """Update the denormalized counters for new message(s); commit with the Message rows"""
+        if self.id is None:
+            self.message_count = (self.message_count or 0) + count
+        elif isinstance(self.message_count, ClauseElement):
+            # Already incremented in this unit of work
+            self.message_count = self.message_count + count
+        else:
+            # SQL-side increment so concurrent writers don't lose updates
+            self.message_count = Conversation.message_count + count
+        timestamp = message.timestamp or datetime.utcnow()
+        if self.last_message_at is not None and timestamp < self.last_message_at:
+            return  # Older message (history sync): the preview stays on the newest one
+        self.last_message_at = timestamp
+        self.last_message_preview = (message.content or '')[:PREVIEW_LENGTH]
 
 class Message(db.Model):
     """Model for storing individual messages"""
+    __table_args__ = (
+        db.Index('ix_message_conversation_timestamp', 'conversation_id', 'timestamp'),
+        db.Index('ix_message_conversation_id', 'conversation_id', 'id'),
+        db.Index('uq_message_conversation_whatsapp_id', 'conversation_id', 'whatsapp_id', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     is_from_user = db.Column(db.Boolean, nullable=False)  # True if from user, False if from bot
     message_type = db.Column(db.String(20), default='text')  # text, image, audio, etc.
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    response_type = db.Column(db.String(20))  # 'standard', 'ai', or None for user messages
+    response_type = db.Column(db.String(20))  # 'ai', 'auto', 'fallback', 'manual', 'broadcast', or None for user messages
+    whatsapp_id = db.Column(db.String(64))  # WhatsApp message key id (inbound only), unique per conversation
 
 class AutoResponse(db.Model):
     """Model for storing automatic responses"""
@@ -49,6 +108,57 @@ class SystemSettings(db.Model):
     setting_value = db.Column(db.Text)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class Statistic(db.Model):
+    """Incrementally maintained dashboard counter (see stats_service)"""
+    key = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    reconciled_at = db.Column(db.DateTime)
+
+class BroadcastJob(db.Model):
+    """Bulk send job (see broadcast_service); stored so every worker can report and resume it"""
+    __table_args__ = (
+        db.Index('ix_broadcast_job_status_created', 'status', 'created_at'),
+    )
+    
+    id = db.Column(db.String(12), primary_key=True)
+    rate_per_second = db.Column(db.Float, nullable=False)
+    concurrency = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='running')  # 'running' or 'finished'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    lease_owner = db.Column(db.String(32))  # Dispatcher currently sending this job
+    lease_until = db.Column(db.DateTime)
+    
+    items = db.relationship('BroadcastItem', backref='job', lazy=True, cascade='all, delete-orphan',
+                            order_by='BroadcastItem.position')
+
+class BroadcastItem(db.Model):
+    """One recipient/message of a BroadcastJob with its delivery status"""
+    __table_args__ = (
+        db.Index('ix_broadcast_item_job_status', 'job_id', 'status', 'position'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(12), db.ForeignKey('broadcast_job.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)  # Order in the job, also the id sent to the sidecar
+    phone = db.Column(db.String(20), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+
+class IntentLabel(db.Model):
+    """Intent label for a message text, used to train the local classifier (see intent_service)"""
+    id = db.Column(db.Integer, primary_key=True)
+    text_key = db.Column(db.String(16), nullable=False, unique=True)  # Hash of the normalized text
+    text = db.Column(db.Text, nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)  # pergunta, saudacao, pedido, reclamacao, outro
+    urgencia = db.Column(db.String(10), nullable=False)  # baixo, medio, alto
+    requer_humano = db.Column(db.Boolean, nullable=False, default=False)
+    source = db.Column(db.String(20), default='gemini')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class WhatsAppConnection(db.Model):
     """Model for storing WhatsApp connection status"""
     id = db.Column(db.Integer, primary_key=True)
@@ -56,3 +166,5 @@ class WhatsAppConnection(db.Model):
     qr_code = db.Column(db.Text)  # Base64 encoded QR code
     last_connected = db.Column(db.DateTime)
     session_data = db.Column(db.Text)  # Serialized session data
+    status_json = db.Column(db.Text)  # Full status snapshot shared by every worker (see connection_service)
+    version = db.Column(db.String(32))  # Changes on every status write; workers reload when it differs
@@ -0,0 +1,115 @@
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict
+from baileys_service import baileys_service
+
+class PresenceManager:
+    """Gerenciador do status "digitando" por contato
+
+    Guarda o estado desejado (composing/paused) de cada telefone e uma única
+    thread envia ao Baileys apenas as transições que mudam o último estado
+    enviado. Transições redundantes (ex.: composing repetido durante uma
+    rajada de mensagens) são descartadas sem chamada HTTP.
+    """
+
+    def __init__(self, sender: Callable[[str, bool], Dict], composing_ttl: float = None):
+        self._sender = sender
+        # WhatsApp descarta o "digitando" sozinho depois de ~25s; espelhamos isso
+        self.COMPOSING_TTL = composing_ttl or float(os.environ.get('PRESENCE_COMPOSING_TTL', '25'))
+
+        self._desired = {}   # phone -> True (composing) / False (paused)
+        self._sent = {}      # phone -> último estado confirmado pelo Baileys
+        self._expires = {}   # phone -> prazo (monotonic) do composing
+        self._dirty = set()
+        self._condition = threading.Condition()
+        self._stats = {'issued': 0, 'coalesced': 0, 'failed': 0}
+
+        self._thread = threading.Thread(target=self._run, name='presence-manager', daemon=True)
+        self._thread.start()
+
+    def composing(self, phone_number: str):
+        """Marcar contato como "digitando" (renova o prazo se já estiver)"""
+        with self._condition:
+            self._desired[phone_number] = True
+            self._expires[phone_number] = time.monotonic() + self.COMPOSING_TTL
+            self._dirty.add(phone_number)
+            self._condition.notify()
+
+    def paused(self, phone_number: str):
+        """Parar o "digitando" do contato"""
+        with self._condition:
+            self._desired[phone_number] = False
+            self._expires.pop(phone_number, None)
+            self._dirty.add(phone_number)
+            self._condition.notify()
+
+    def message_sent(self, phone_number: str):
+        """Registrar envio de mensagem: o WhatsApp já limpa o "digitando" sozinho"""
+        with self._condition:
+            self._desired.pop(phone_number, None)
+            self._sent.pop(phone_number, None)
+            self._expires.pop(phone_number, None)
+            self._dirty.discard(phone_number)
+
+    def is_composing(self, phone_number: str) -> bool:
+        with self._condition:
+            return self._desired.get(phone_number, False)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    for phone, deadline in list(self._expires.items()):
+                        if deadline <= now:
+                            del self._expires[phone]
+                            self._desired[phone] = False
+                            self._dirty.add(phone)
+
+                    if self._dirty:
+                        break
+
+                    timeout = min(self._expires.values()) - now if self._expires else None
+                    self._condition.wait(timeout)
+
+                batch = [(phone, self._desired.get(phone, False)) for phone in self._dirty]
+                self._dirty.clear()
+
+            for phone, state in batch:
+                self._flush(phone, state)
+
+    def _flush(self, phone_number: str, state: bool):
+        with self._condition:
+            if self._sent.get(phone_number, False) == state:
+                self._stats['coalesced'] += 1
+                if not state:
+                    self._desired.pop(phone_number, None)
+                return
+
+        try:
+            result = self._sender(phone_number, state)
+            ok = bool(result.get('success'))
+        except Exception as e:
+            logging.debug(f"Erro ao atualizar presença de {phone_number}: {e}")
+            ok = False
+
+        with self._condition:
+            if ok:
+                self._stats['issued'] += 1
+                if state:
+                    self._sent[phone_number] = True
+                else:
+                    self._sent.pop(phone_number, None)
+                    if not self._desired.get(phone_number):
+                        self._desired.pop(phone_number, None)
+            else:
+                self._stats['failed'] += 1
+
+    def get_stats(self) -> Dict:
+        with self._condition:
+            return dict(self._stats, composing=sum(1 for state in self._sent.values() if state))
+
+# Instância global
+presence_manager = PresenceManager(baileys_service.set_typing)
@@ -0,0 +1,424 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional
+from app import app
+
+class SQLiteQueueState:
+    """Filas de debounce e prazos num SQLite compartilhado pelos workers
+
+    Cada telefone tem suas mensagens pendentes e um prazo (reposto a cada
+    mensagem nova). Quando o prazo vence, um único worker reivindica o
+    telefone com um lease; enquanto o lease vale, a resposta daquele
+    telefone é dele e novas mensagens só acumulam para a próxima rajada.
+    Lease vencido (worker morreu) libera o telefone para outro worker.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.environ.get('QUEUE_STATE_DB_PATH', os.path.join(app.instance_path, 'queue_state.db'))
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._init_db()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS queued_message (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                phone TEXT NOT NULL,
+                conversation_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                queued_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_queued_message_phone_id ON queued_message (phone, id)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS queue_state (
+                phone TEXT PRIMARY KEY,
+                deadline REAL,
+                lease_owner TEXT,
+                lease_until REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_queue_state_deadline ON queue_state (deadline)")
+
+    def _transaction(self, work: Callable[[sqlite3.Connection], object]):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def append(self, queues: Dict[str, List[tuple]], deadline: float):
+        """Acrescentar mensagens {telefone: [(conversation_id, texto), ...]} e repor o prazo de cada telefone"""
+        now = time.time()
+
+        def work(conn):
+            conn.executemany(
+                "INSERT INTO queued_message (phone, conversation_id, content, queued_at) VALUES (?, ?, ?, ?)",
+                [(phone, conversation_id, content, now)
+                 for phone, items in queues.items() for conversation_id, content in items]
+            )
+            conn.executemany(
+                "INSERT INTO queue_state (phone, deadline) VALUES (?, ?) "
+                "ON CONFLICT(phone) DO UPDATE SET deadline = excluded.deadline",
+                [(phone, deadline) for phone in queues]
+            )
+        self._transaction(work)
+
+    def claim_due(self, owner: str, lease_seconds: float, limit: int = 100) -> List[str]:
+        """Reivindicar telefones com prazo vencido e sem lease válido"""
+        now = time.time()
+
+        def work(conn):
+            phones = [row['phone'] for row in conn.execute(
+                "SELECT phone FROM queue_state WHERE deadline <= ? AND (lease_owner IS NULL OR lease_until < ?) "
+                "ORDER BY deadline LIMIT ?", (now, now, limit)
+            )]
+            conn.executemany(
+                "UPDATE queue_state SET deadline = NULL, lease_owner = ?, lease_until = ? WHERE phone = ?",
+                [(owner, now + lease_seconds, phone) for phone in phones]
+            )
+            return phones
+        return self._transaction(work)
+
+    def renew(self, phones: List[str], owner: str, lease_seconds: float) -> List[str]:
+        """Estender o lease dos telefones ainda de owner; retorna os renovados"""
+        now = time.time()
+
+        def work(conn):
+            renewed = []
+            for phone in phones:
+                updated = conn.execute(
+                    "UPDATE queue_state SET lease_until = ? WHERE phone = ? AND lease_owner = ? AND lease_until >= ?",
+                    (now + lease_seconds, phone, owner, now)
+                ).rowcount
+                if updated:
+                    renewed.append(phone)
+            return renewed
+        return self._transaction(work)
+
+    def take(self, phone: str) -> List[Dict]:
+        """Retirar as mensagens pendentes do telefone, em ordem"""
+        def work(conn):
+            rows = conn.execute(
+                "SELECT id, conversation_id, content, queued_at FROM queued_message WHERE phone = ? ORDER BY id",
+                (phone,)
+            ).fetchall()
+            if rows:
+                conn.execute("DELETE FROM queued_message WHERE phone = ? AND id <= ?", (phone, rows[-1]['id']))
+            return [{
+                'content': row['content'],
+                'timestamp': row['queued_at'],
+                'conversation_id': row['conversation_id']
+            } for row in rows]
+        return self._transaction(work)
+
+    def release(self, phone: str, owner: str) -> bool:
+        """Encerrar o lease; retorna True se já há nova rajada esperando"""
+        def work(conn):
+            conn.execute(
+                "UPDATE queue_state SET lease_owner = NULL, lease_until = NULL WHERE phone = ? AND lease_owner = ?",
+                (phone, owner)
+            )
+            row = conn.execute("SELECT deadline FROM queue_state WHERE phone = ?", (phone,)).fetchone()
+            if row is not None and row['deadline'] is None:
+                conn.execute("DELETE FROM queue_state WHERE phone = ? AND lease_owner IS NULL", (phone,))
+                return False
+            return row is not None
+        return self._transaction(work)
+
+    def discard(self, phone: str):
+        """Descartar mensagens pendentes e o prazo (ex.: humano assumiu a conversa)"""
+        def work(conn):
+            conn.execute("DELETE FROM queued_message WHERE phone = ?", (phone,))
+            conn.execute("UPDATE queue_state SET deadline = NULL WHERE phone = ?", (phone,))
+            conn.execute("DELETE FROM queue_state WHERE phone = ? AND lease_owner IS NULL", (phone,))
+        self._transaction(work)
+
+    def next_deadline(self) -> Optional[float]:
+        """Prazo mais próximo entre os telefones que podem ser reivindicados"""
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT MIN(deadline) FROM queue_state WHERE deadline IS NOT NULL AND (lease_owner IS NULL OR lease_until < ?)",
+            (now,)
+        ).fetchone()
+        return row[0]
+
+    def get_stats(self) -> Dict:
+        conn = self._connection()
+        now = time.time()
+        return {
+            'backend': 'sqlite',
+            'queued_messages': conn.execute("SELECT COUNT(*) FROM queued_message").fetchone()[0],
+            'waiting_phones': conn.execute("SELECT COUNT(*) FROM queue_state WHERE deadline IS NOT NULL").fetchone()[0],
+            'leased_phones': conn.execute(
+                "SELECT COUNT(*) FROM queue_state WHERE lease_owner IS NOT NULL AND lease_until >= ?", (now,)
+            ).fetchone()[0],
+        }
+
+class RedisQueueState:
+    """Mesmo contrato do SQLiteQueueState sobre Redis (ou compatível: Valkey, KeyDB)
+
+    Mensagens numa lista por telefone, prazos num sorted set e leases em
+    chaves com expiração; reivindicar e liberar são scripts Lua atômicos.
+    """
+
+    CLAIM_SCRIPT = """
+        local claimed = {}
+        local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[4]))
+        for _, phone in ipairs(due) do
+            if redis.call('SET', ARGV[5] .. phone, ARGV[2], 'NX', 'PX', ARGV[3]) then
+                redis.call('ZREM', KEYS[1], phone)
+                table.insert(claimed, phone)
+            end
+        end
+        return claimed
+    """
+    RENEW_SCRIPT = """
+        local renewed = {}
+        for i = 4, #ARGV do
+            local key = ARGV[1] .. ARGV[i]
+            if redis.call('GET', key) == ARGV[2] then
+                redis.call('PEXPIRE', key, ARGV[3])
+                table.insert(renewed, ARGV[i])
+            end
+        end
+        return renewed
+    """
+    RELEASE_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            redis.call('DEL', KEYS[1])
+        end
+        return redis.call('ZSCORE', KEYS[2], ARGV[2]) and 1 or 0
+    """
+
+    def __init__(self, url: str, prefix: str = 'asa:queue'):
+        import redis
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._redis.ping()
+        self._claim = self._redis.register_script(self.CLAIM_SCRIPT)
+        self._release = self._redis.register_script(self.RELEASE_SCRIPT)
+        self._renew = self._redis.register_script(self.RENEW_SCRIPT)
+
+    def _messages_key(self, phone: str) -> str:
+        return f"{self.prefix}:messages:{phone}"
+
+    def _lease_key(self, phone: str) -> str:
+        return f"{self.prefix}:lease:{phone}"
+
+    @property
+    def _deadlines_key(self) -> str:
+        return f"{self.prefix}:deadlines"
+
+    def append(self, queues: Dict[str, List[tuple]], deadline: float):
+        now = time.time()
+        pipeline = self._redis.pipeline()
+        for phone, items in queues.items():
+            pipeline.rpush(self._messages_key(phone), *[
+                json.dumps({'content': content, 'timestamp': now, 'conversation_id': conversation_id})
+                for conversation_id, content in items
+            ])
+            pipeline.zadd(self._deadlines_key, {phone: deadline})
+        pipeline.execute()
+
+    def claim_due(self, owner: str, lease_seconds: float, limit: int = 100) -> List[str]:
+        return self._claim(keys=[self._deadlines_key], args=[
+            time.time(), owner, int(lease_seconds * 1000), limit, f"{self.prefix}:lease:"
+        ])
+
+    def renew(self, phones: List[str], owner: str, lease_seconds: float) -> List[str]:
+        if not phones:
+            return []
+        return self._renew(args=[f"{self.prefix}:lease:", owner, int(lease_seconds * 1000), *phones])
+
+    def take(self, phone: str) -> List[Dict]:
+        pipeline = self._redis.pipeline()  # MULTI/EXEC: ler e apagar juntos
+        pipeline.lrange(self._messages_key(phone), 0, -1)
+        pipeline.delete(self._messages_key(phone))
+        items, _ = pipeline.execute()
+        return [json.loads(item) for item in items]
+
+    def release(self, phone: str, owner: str) -> bool:
+        return bool(self._release(keys=[self._lease_key(phone), self._deadlines_key], args=[owner, phone]))
+
+    def discard(self, phone: str):
+        pipeline = self._redis.pipeline()
+        pipeline.delete(self._messages_key(phone))
+        pipeline.zrem(self._deadlines_key, phone)
+        pipeline.execute()
+
+    def next_deadline(self) -> Optional[float]:
+        # Inclui telefones com lease; o flusher trata prazo vencido e não reivindicável
+        first = self._redis.zrange(self._deadlines_key, 0, 0, withscores=True)
+        return first[0][1] if first else None
+
+    def get_stats(self) -> Dict:
+        """Mesmos campos do SQLite; percorre as chaves com SCAN (só para o dashboard, fora do caminho quente)"""
+        message_keys = list(self._redis.scan_iter(match=self._messages_key('*'), count=500))
+        pipeline = self._redis.pipeline(transaction=False)
+        for key in message_keys:
+            pipeline.llen(key)
+        return {
+            'backend': 'redis',
+            'queued_messages': sum(pipeline.execute()) if message_keys else 0,
+            'waiting_phones': self._redis.zcard(self._deadlines_key),
+            'leased_phones': sum(1 for _ in self._redis.scan_iter(match=self._lease_key('*'), count=500)),
+        }
+
+def create_queue_state():
+    """Backend configurado em QUEUE_STATE_BACKEND ('sqlite', padrão, ou 'redis' com QUEUE_STATE_REDIS_URL)"""
+    backend = os.environ.get('QUEUE_STATE_BACKEND', 'sqlite').lower()
+    if backend == 'redis':
+        url = os.environ.get('QUEUE_STATE_REDIS_URL', 'redis://localhost:6379/0')
+        try:
+            state = RedisQueueState(url)
+            logging.info(f"🗂️ Estado das filas no Redis ({url})")
+            return state
+        except ImportError:
+            logging.warning("Biblioteca redis não disponível - usando SQLite para o estado das filas")
+        except Exception as e:
+            logging.error(f"Redis indisponível ({e}) - usando SQLite para o estado das filas")
+    return SQLiteQueueState()
+
+class QueueFlusher:
+    """Thread que reivindica as rajadas vencidas e as entrega para processamento
+
+    Todo worker roda um flusher, mas cada rajada é reivindicada por um só
+    (lease no backend), então sai exatamente uma resposta por rajada. O
+    flusher dorme até o próximo prazo (ou POLL_INTERVAL, para pegar prazos
+    criados por outros workers) e é acordado por wake() quando este worker
+    enfileira ou libera algo.
+
+    Enquanto a resposta de um telefone está em andamento (espera por cota,
+    retries de 429) o flusher renova o lease a cada terço de LEASE_SECONDS,
+    então ele só vence se este worker morrer. Uma resposta presa há mais de
+    MAX_HOLD_SECONDS deixa de ser renovada e o telefone volta a ser atendido.
+    """
+
+    def __init__(self, state, lease_seconds: float = None):
+        self.state = state
+        self.LEASE_SECONDS = lease_seconds or float(os.environ.get('QUEUE_LEASE_SECONDS', '300'))
+        self.POLL_INTERVAL = float(os.environ.get('QUEUE_POLL_INTERVAL', '1'))
+        self.MAX_HOLD_SECONDS = float(os.environ.get('QUEUE_MAX_HOLD_SECONDS', '900'))
+        self._condition = threading.Condition()
+        self._held = {}  # telefone -> momento da reivindicação (monotonic), até release()
+        self._held_lock = threading.Lock()
+        self._renewed_at = 0.0
+        self._woken = False
+        self._handler = None
+        self._thread = None
+        self._owner = None
+        self._owner_pid = None
+        self._stats = {'claimed': 0, 'errors': 0, 'renewed': 0, 'lost': 0}
+
+    @property
+    def owner(self) -> str:
+        """Identificador deste processo (recalculado após fork do gunicorn)"""
+        if self._owner_pid != os.getpid():
+            self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            self._owner_pid = os.getpid()
+        return self._owner
+
+    def start(self, handler: Callable[[str], None]):
+        """Iniciar o flusher; handler(telefone) recebe cada rajada reivindicada"""
+        self._handler = handler
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='queue-flusher', daemon=True)
+        self._thread.start()
+        logging.info(f"🧹 Flusher das filas iniciado ({type(self.state).__name__})")
+
+    def wake(self):
+        with self._condition:
+            self._woken = True
+            self._condition.notify()
+
+    def release(self, phone: str) -> bool:
+        """Devolver o lease do telefone; retorna True se já há nova rajada esperando (e acorda o flusher)"""
+        with self._held_lock:
+            self._held.pop(phone, None)
+        pending = self.state.release(phone, self.owner)
+        if pending:
+            self.wake()
+        return pending
+
+    def _renew_held(self):
+        """Renovar os leases das respostas em andamento neste worker"""
+        now = time.monotonic()
+        if now - self._renewed_at < self.LEASE_SECONDS / 3:
+            return
+        self._renewed_at = now
+        with self._held_lock:
+            expired = [phone for phone, claimed_at in self._held.items() if now - claimed_at > self.MAX_HOLD_SECONDS]
+            for phone in expired:
+                del self._held[phone]
+            phones = list(self._held)
+        for phone in expired:
+            logging.warning(f"⏳ Resposta para {phone} em andamento há mais de {self.MAX_HOLD_SECONDS:.0f}s - lease não será renovado")
+        if not phones:
+            return
+
+        renewed = set(self.state.renew(phones, self.owner, self.LEASE_SECONDS))
+        self._stats['renewed'] += len(renewed)
+        lost = [phone for phone in phones if phone not in renewed]
+        if lost:
+            with self._held_lock:
+                for phone in lost:
+                    self._held.pop(phone, None)
+            self._stats['lost'] += len(lost)
+            logging.warning(f"⏳ Lease perdido para {', '.join(lost)} antes do fim da resposta")
+
+    def _run(self):
+        while True:
+            wait = min(self.POLL_INTERVAL, self.LEASE_SECONDS / 3)
+            try:
+                self._renew_held()
+                for phone in self.state.claim_due(self.owner, self.LEASE_SECONDS):
+                    self._stats['claimed'] += 1
+                    with self._held_lock:
+                        self._held[phone] = time.monotonic()
+                    self._handler(phone)
+                next_deadline = self.state.next_deadline()
+                if next_deadline is not None and next_deadline > time.time():
+                    wait = min(wait, next_deadline - time.time())
+            except Exception as e:
+                self._stats['errors'] += 1
+                logging.error(f"Erro no flusher das filas: {e}")
+
+            with self._condition:
+                if not self._woken:
+                    self._condition.wait(max(0.01, wait))
+                self._woken = False
+
+    def get_stats(self) -> Dict:
+        stats = dict(self._stats)
+        try:
+            stats.update(self.state.get_stats())
+        except Exception as e:
+            stats['error'] = str(e)
+        return stats
+
+# Instância global
+queue_state = create_queue_state()
@@ -0,0 +1,220 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from typing import Callable, Dict, Optional
+
+QUOTA_MARKERS = ('429', 'resource_exhausted', 'quota', 'rate limit', 'too many requests')
+RETRY_DELAY_PATTERN = re.compile(r"retry[_ ]?(?:delay|after)['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+def is_quota_error(error: Exception) -> bool:
+    """Erro de cota/limite de taxa do Gemini (HTTP 429 / RESOURCE_EXHAUSTED)"""
+    if getattr(error, 'code', None) == 429 or getattr(error, 'status_code', None) == 429:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in QUOTA_MARKERS)
+
+def retry_delay(error: Exception) -> Optional[float]:
+    """Espera sugerida pela API (retryDelay / Retry-After), se vier no erro"""
+    match = RETRY_DELAY_PATTERN.search(str(error))
+    return float(match.group(1)) if match else None
+
+class GeminiRateLimiter:
+    """Token buckets de requisições e tokens por minuto para o Gemini
+
+    Cada geração espera (sem falhar) até haver uma requisição e os tokens
+    estimados no balde; a diferença para o uso real é acertada depois. Erros
+    de cota pausam todas as gerações pelo retryDelay da API (ou por um
+    backoff exponencial) e cortam a taxa pela metade; ela volta a subir aos
+    poucos enquanto não há erros (AIMD), ficando logo abaixo da cota real.
+
+    O estado fica em memória, ou num SQLite compartilhado entre os workers
+    quando AI_RATE_LIMIT_DB_PATH é definido. Nesse caso as transações (que
+    podem esperar o lock de outro worker) rodam numa thread do executor,
+    nunca no loop do motor de IA.
+    """
+
+    def __init__(self, rpm: int = None, tpm: int = None, path: str = None):
+        self.RPM = rpm or int(os.environ.get('AI_RPM', '1000'))
+        self.TPM = tpm or int(os.environ.get('AI_TPM', '1000000'))
+        self.WINDOW = 60.0  # Janela da cota da API (por minuto)
+        self.BURST_SECONDS = float(os.environ.get('AI_RATE_BURST_SECONDS', '1'))  # Tamanho do balde
+        self.MIN_FACTOR = 0.05          # Taxa mínima após cortes sucessivos
+        self.RECOVERY_STEP = 0.1        # Aumento da taxa a cada RECOVERY_INTERVAL sem erro
+        self.RECOVERY_INTERVAL = 10.0   # Segundos
+        self.BACKOFF_BASE = 1.0         # Segundos, dobra a cada erro seguido
+        self.BACKOFF_MAX = 60.0
+        self.path = path if path is not None else os.environ.get('AI_RATE_LIMIT_DB_PATH', '')
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._state = None
+        self._queue = None  # asyncio.Lock (FIFO): só a primeira da fila consulta o balde
+        self._stats = {'granted': 0, 'waited': 0, 'wait_seconds': 0.0, 'quota_errors': 0}
+
+        if self.path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._connection().execute(
+                    "CREATE TABLE IF NOT EXISTS rate_limit (name TEXT PRIMARY KEY, state TEXT NOT NULL)"
+                )
+            except sqlite3.Error as e:
+                logging.error(f"Limitador do Gemini sem estado compartilhado: {e}")
+                self.path = ''
+
+    # Estado -----------------------------------------------------------------
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _initial_state(self, now: float) -> Dict:
+        return {
+            'requests': self._capacity(self.RPM, 1.0),
+            'tokens': self._capacity(self.TPM, 1.0),
+            'updated': now,
+            'factor': 1.0,
+            'factor_changed': now,
+            'paused_until': 0.0,
+            'consecutive_errors': 0,
+        }
+
+    def _transaction(self, update: Callable[[Dict, float], object]):
+        """Aplicar update(state, agora) atomicamente (entre threads e, com SQLite, entre workers)"""
+        now = time.time()
+        if not self.path:
+            with self._lock:
+                if self._state is None:
+                    self._state = self._initial_state(now)
+                return update(self._state, now)
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT state FROM rate_limit WHERE name = 'gemini'").fetchone()
+            state = json.loads(row[0]) if row else self._initial_state(now)
+            result = update(state, now)
+            conn.execute("INSERT OR REPLACE INTO rate_limit (name, state) VALUES ('gemini', ?)", (json.dumps(state),))
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def _transaction_async(self, update: Callable[[Dict, float], object]):
+        """_transaction para o loop do motor: com SQLite roda fora da thread do loop"""
+        if not self.path:
+            return self._transaction(update)
+        return await asyncio.to_thread(self._transaction, update)
+
+    def _capacity(self, per_minute: int, factor: float) -> float:
+        return max(1.0, per_minute * factor * self.BURST_SECONDS / self.WINDOW)
+
+    def _rate(self, per_minute: int, factor: float) -> float:
+        """Reposição por segundo: balde cheio + uma janela de reposição cabem na cota"""
+        return per_minute * factor * (self.WINDOW - self.BURST_SECONDS) / self.WINDOW / self.WINDOW
+
+    def _refill(self, state: Dict, now: float):
+        elapsed = max(0.0, now - state['updated'])
+        if state['consecutive_errors'] == 0 and state['factor'] < 1.0 \
+                and now - state['factor_changed'] >= self.RECOVERY_INTERVAL:
+            state['factor'] = min(1.0, state['factor'] + self.RECOVERY_STEP)
+            state['factor_changed'] = now
+        factor = state['factor']
+        state['requests'] = min(self._capacity(self.RPM, factor), state['requests'] + elapsed * self._rate(self.RPM, factor))
+        state['tokens'] = min(self._capacity(self.TPM, factor), state['tokens'] + elapsed * self._rate(self.TPM, factor))
+        state['updated'] = now
+
+    # API --------------------------------------------------------------------
+
+    async def acquire(self, tokens: int):
+        """Esperar uma requisição e `tokens` tokens de entrada disponíveis"""
+        if self._queue is None:
+            self._queue = asyncio.Lock()
+        waited = 0.0
+        async with self._queue:
+            while True:
+                wait = await self._transaction_async(lambda state, now: self._take(state, now, tokens))
+                if wait <= 0:
+                    break
+                waited += wait
+                await asyncio.sleep(wait)
+
+        with self._lock:
+            self._stats['granted'] += 1
+            if waited:
+                self._stats['waited'] += 1
+                self._stats['wait_seconds'] += waited
+
+    def _take(self, state: Dict, now: float, tokens: int) -> float:
+        """Retirar do balde; retorna 0 se concedido, senão segundos até tentar de novo"""
+        self._refill(state, now)
+        if state['paused_until'] > now:
+            return state['paused_until'] - now
+
+        factor = state['factor']
+        # Pedido maior que o balde entra quando o balde está cheio e deixa saldo negativo
+        needed_tokens = min(tokens, self._capacity(self.TPM, factor))
+        if state['requests'] >= 1 and state['tokens'] >= needed_tokens:
+            state['requests'] -= 1
+            state['tokens'] -= tokens
+            return 0.0
+
+        request_wait = max(0.0, 1 - state['requests']) / self._rate(self.RPM, factor)
+        token_wait = max(0.0, needed_tokens - state['tokens']) / self._rate(self.TPM, factor)
+        return max(request_wait, token_wait, 0.01)
+
+    async def record_success(self, estimated: int, actual: int = None):
+        """Geração concluída: zerar a sequência de erros e acertar o balde com o uso real"""
+        def settle(state, now):
+            state['consecutive_errors'] = 0
+            if actual:
+                state['tokens'] -= actual - estimated
+        await self._transaction_async(settle)
+
+    async def record_quota_error(self, delay: float = None) -> float:
+        """Erro de cota: pausar todas as gerações e cortar a taxa; retorna a pausa aplicada"""
+        def penalize(state, now):
+            state['consecutive_errors'] += 1
+            pause = delay or min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** (state['consecutive_errors'] - 1))
+            state['paused_until'] = max(state['paused_until'], now + pause)
+            if now - state['factor_changed'] >= 1.0:
+                # Vários erros da mesma rajada contam como um corte só
+                state['factor'] = max(self.MIN_FACTOR, state['factor'] / 2)
+                state['factor_changed'] = now
+            state['requests'] = min(state['requests'], 0.0)
+            return pause
+
+        pause = await self._transaction_async(penalize)
+        with self._lock:
+            self._stats['quota_errors'] += 1
+        logging.warning(f"🚦 Cota do Gemini atingida - pausando gerações por {pause:.1f}s")
+        return pause
+
+    def get_stats(self) -> Dict:
+        """Estado atual (chamado das threads do Flask, não do loop do motor)"""
+        def snapshot(state, now):
+            self._refill(state, now)
+            return {
+                'rate_factor': round(state['factor'], 3),
+                'paused_for': round(max(0.0, state['paused_until'] - now), 1),
+                'requests_available': round(state['requests'], 1),
+                'tokens_available': int(state['tokens']),
+            }
+        stats = self._transaction(snapshot)
+        with self._lock:
+            stats.update(self._stats)
+        stats['wait_seconds'] = round(stats['wait_seconds'], 1)
+        stats.update({'rpm': self.RPM, 'tpm': self.TPM, 'shared': bool(self.path)})
+        return stats
+
+# Instância global
+rate_limiter = GeminiRateLimiter()
@@ -2,15 +2,32 @@ import os
 import logging
 import threading
 from datetime import datetime
-from flask import render_template, request, redirect, url_for, session, jsonify, flash
+from functools import lru_cache
+from flask import render_template, request, redirect, url_for, session, jsonify, flash, Response, stream_with_context
 from werkzeug.security import check_password_hash, generate_password_hash
 from app import app, db
-from models import Conversation, Message, AutoResponse, SystemSettings, WhatsAppConnection
+from models import Conversation, Message, AutoResponse, canonical_phone
 from whatsapp_service import whatsapp_service, simulate_incoming_messages
 from baileys_service import baileys_service
+from inbox_service import message_inbox
+from connection_service import connection_state
+from events_service import event_broker, message_event, conversation_event
+from broadcast_service import broadcast_dispatcher
+from stats_service import stats_counters
+from settings_service import settings_cache, DEFAULT_AI_PROMPT
+from autoresponse_service import auto_response_matcher
+from ai_cache_service import ai_response_cache
+from ai_engine_service import ai_engine
+from context_cache_service import context_cache
+from intent_service import intent_classifier
+from rate_limit_service import rate_limiter
+from model_router_service import model_router
 
 # Admin credentials (in production, use proper user management)
-ADMIN_PASSWORD_HASH = generate_password_hash(os.environ.get("ADMIN_PASSWORD", "admin123"))
+@lru_cache(maxsize=1)
+def admin_password_hash() -> str:
+    """Hashed on the first login instead of at import (scrypt costs ~0.25s per worker boot)"""
+    return generate_password_hash(os.environ.get("ADMIN_PASSWORD", "admin123"))
 
 @app.route('/')
 def index():
@@ -20,21 +37,20 @@ def index():
 @app.route('/dashboard')
 def dashboard():
     """Dashboard principal com estatísticas e funcionalidades"""
-    # Get statistics
-    total_conversations = Conversation.query.count()
-    total_messages = Message.query.count()
-    active_responses = AutoResponse.query.filter_by(is_active=True).count()
+    # Get statistics (maintained counters, no COUNT(*) per page load)
+    counters = stats_counters.get_stats()
     
     # Recent conversations
     recent_conversations = Conversation.query.order_by(
         Conversation.updated_at.desc()
     ).limit(5).all()
     
-    stats = {
-        'total_conversations': total_conversations,
-        'total_messages': total_messages,
-        'active_responses': active_responses
-    }
+    stats = dict(counters)
+    stats.update({
+        'total_conversations': counters['conversations_total'],
+        'total_messages': counters['messages_total'],
+        'active_responses': counters['auto_responses_active']
+    })
     
     return render_template('dashboard.html', stats=stats, recent_conversations=recent_conversations)
 
@@ -44,17 +60,14 @@ def generate_qr():
     qr_result = whatsapp_service.generate_qr_code()
     
     if qr_result:
-        # Get the QR image from database
-        with app.app_context():
-            connection = WhatsAppConnection.query.first()
-            if connection and connection.qr_code:
-                qr_image = connection.qr_code
-                logging.info("QR Code gerado - aguardando escaneamento")
-                return jsonify({
-                    'success': True,
-                    'qr_code': qr_result,
-                    'qr_image': qr_image
-                })
+        qr_image = connection_state.get_status().get('qr_code')
+        if qr_image:
+            logging.info("QR Code gerado - aguardando escaneamento")
+            return jsonify({
+                'success': True,
+                'qr_code': qr_result,
+                'qr_image': qr_image
+            })
     
     logging.error("Erro ao gerar QR Code")
     return jsonify({'success': False, 'error': 'Erro desconhecido'}), 500
@@ -62,13 +75,7 @@ def generate_qr():
 @app.route('/simulate_scan')
 def simulate_scan():
     """Simular escaneamento do QR Code para teste"""
-    with app.app_context():
-        connection = WhatsAppConnection.query.first()
-        if connection:
-            connection.is_connected = True
-            connection.last_connected = datetime.utcnow()
-            connection.qr_code = None
-            db.session.commit()
+    connection_state.mark_connected()
             
     # Iniciar simulação de mensagens após "conexão"
     simulate_incoming_messages()
@@ -81,6 +88,17 @@ def connection_status():
     status = whatsapp_service.get_connection_status()
     return jsonify(status)
 
+def event_stream(event_types=None) -> Response:
+    response = Response(stream_with_context(event_broker.subscribe(event_types)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/events/connection')
+def api_connection_events():
+    """Stream SSE público só com as mudanças de conexão (páginas sem login)"""
+    return event_stream(('connection',))
+
 @app.route('/api/baileys-status')
 def api_baileys_status():
     """Get Baileys service status"""
@@ -146,15 +164,7 @@ def qr_updated():
         qr_code = data.get('qr_code')
         
         if qr_code:
-            with app.app_context():
-                connection = WhatsAppConnection.query.first()
-                if not connection:
-                    connection = WhatsAppConnection()
-                    db.session.add(connection)
-                
-                connection.qr_code = qr_code
-                connection.is_connected = False
-                db.session.commit()
+            connection_state.qr_updated(qr_code)
                 
         return jsonify({'status': 'success'})
     except Exception as e:
@@ -164,18 +174,8 @@ def qr_updated():
 def whatsapp_connected():
     """Webhook para WhatsApp conectado"""
     try:
-        data = request.get_json()
-        
-        with app.app_context():
-            connection = WhatsAppConnection.query.first()
-            if not connection:
-                connection = WhatsAppConnection()
-                db.session.add(connection)
-            
-            connection.is_connected = True
-            connection.last_connected = datetime.utcnow()
-            connection.qr_code = None
-            db.session.commit()
+        data = request.get_json() or {}
+        connection_state.mark_connected(data.get('user'))
             
         logging.info("✅ WhatsApp conectado via Baileys!")
         return jsonify({'status': 'success'})
@@ -186,11 +186,7 @@ def whatsapp_connected():
 def whatsapp_disconnected():
     """Webhook para WhatsApp desconectado"""
     try:
-        with app.app_context():
-            connection = WhatsAppConnection.query.first()
-            if connection:
-                connection.is_connected = False
-                db.session.commit()
+        connection_state.mark_disconnected()
                 
         logging.info("❌ WhatsApp desconectado")
         return jsonify({'status': 'success'})
@@ -208,11 +204,55 @@ def message_received():
         
         if phone and message:
             logging.info(f"📨 Mensagem recebida de {phone}: {message}")
-            whatsapp_service.process_incoming_message(phone, message, contact_name)
+            # Persistir na caixa de entrada e responder já; os workers processam depois
+            event_id = message_inbox.enqueue(canonical_phone(phone), {
+                'phone': phone,
+                'message': message,
+                'contact_name': contact_name,
+                'message_id': data.get('message_id'),
+                'timestamp': data.get('timestamp')
+            })
+            return jsonify({'status': 'accepted', 'event_id': event_id}), 202
             
         return jsonify({'status': 'success'})
     except Exception as e:
-        logging.error(f"Erro ao processar mensagem: {e}")
+        logging.error(f"Erro ao registrar mensagem: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/messages-received', methods=['POST'])
+def messages_received():
+    """Webhook para lote de mensagens recebidas (messages.upsert inteiro)"""
+    try:
+        data = request.get_json() or {}
+        messages = [
+            {
+                'phone': item.get('phone'),
+                'message': item.get('message'),
+                'contact_name': item.get('contact_name', ''),
+                'message_id': item.get('message_id'),
+                'timestamp': item.get('timestamp')
+            }
+            for item in data.get('messages', [])
+            if item.get('phone') and item.get('message')
+        ]
+        
+        if not messages:
+            return jsonify({'status': 'success', 'accepted': 0})
+        
+        logging.info(f"📨 Lote de {len(messages)} mensagens recebido ({data.get('type', 'notify')})")
+        
+        # Um evento por contato, na fila do telefone canônico: mantém a ordem com
+        # as mensagens avulsas do mesmo contato e deixa contatos diferentes em paralelo
+        by_phone = {}
+        for item in messages:
+            by_phone.setdefault(canonical_phone(item['phone']), []).append(item)
+        message_inbox.enqueue_many([
+            (phone_key, {'kind': 'batch', 'type': data.get('type', 'notify'), 'messages': items})
+            for phone_key, items in by_phone.items()
+        ])
+        return jsonify({'status': 'accepted', 'accepted': len(messages)}), 202
+    except Exception as e:
+        logging.error(f"Erro ao registrar lote de mensagens: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/api/human-response-detected', methods=['POST'])
@@ -231,7 +271,7 @@ def human_response_detected():
             
             # Salvar mensagem manual no banco
             with app.app_context():
-                conversation = Conversation.query.filter_by(phone_number=phone).first()
+                conversation = Conversation.find_by_phone(phone)
                 if conversation:
                     # Salvar mensagem manual
                     manual_message = Message()
@@ -242,7 +282,9 @@ def human_response_detected():
                     manual_message.response_type = 'manual'
                     
                     db.session.add(manual_message)
+                    conversation.record_message(manual_message)
                     db.session.commit()
+                    event_broker.publish('message', message_event(conversation, manual_message))
                     logging.info(f"💾 Mensagem manual salva no banco para {phone}")
             
         return jsonify({'status': 'success'})
@@ -255,7 +297,7 @@ def admin_login():
     """Admin login page"""
     if request.method == 'POST':
         password = request.form.get('password', '')
-        if password and check_password_hash(ADMIN_PASSWORD_HASH, password):
+        if password and check_password_hash(admin_password_hash(), password):
             session['admin_logged_in'] = True
             return redirect(url_for('admin_dashboard'))
         else:
@@ -278,6 +320,12 @@ def admin_required(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+@app.route('/api/events')
+@admin_required
+def api_events():
+    """Stream SSE com mudanças de conexão, mensagens e conversas (conteúdo completo: só admin)"""
+    return event_stream()
+
 @app.route('/admin/dashboard')
 @admin_required
 def admin_dashboard():
@@ -316,6 +364,8 @@ def toggle_ai_for_conversation(conversation_id):
         db.session.commit()
         flash(f'IA pausada para {conversation.contact_name or conversation.phone_number}', 'info')
     
+    event_broker.publish('conversation', conversation_event(conversation))
+    
     return redirect(url_for('admin_conversations'))
 
 @app.route('/admin/send-manual-message/<int:conversation_id>', methods=['POST'])
@@ -346,6 +396,7 @@ def send_manual_message(conversation_id):
             manual_message.response_type = 'manual'
             
             db.session.add(manual_message)
+            conversation.record_message(manual_message)
             
             # Pause AI for this conversation
             conversation.ai_paused = True
@@ -353,6 +404,7 @@ def send_manual_message(conversation_id):
             conversation.updated_at = datetime.utcnow()
             
             db.session.commit()
+            event_broker.publish('message', message_event(conversation, manual_message))
             
             # Pause AI in the service as well
             whatsapp_service.pause_ai_for_conversation(conversation.phone_number)
@@ -366,6 +418,48 @@ def send_manual_message(conversation_id):
     
     return redirect(url_for('conversation_detail', conversation_id=conversation_id))
 
+@app.route('/api/broadcast', methods=['POST'])
+@admin_required
+def api_broadcast():
+    """Criar envio em massa: {'recipients': [...], 'message': ...} ou {'messages': [{'phone', 'message'}]}"""
+    data = request.get_json() or {}
+    
+    messages = data.get('messages')
+    if messages is None:
+        text = (data.get('message') or '').strip()
+        messages = [{'phone': phone, 'message': text} for phone in data.get('recipients', [])] if text else []
+    messages = [
+        {'phone': str(item.get('phone', '')).strip(), 'message': item.get('message', '')}
+        for item in messages
+        if str(item.get('phone', '')).strip() and item.get('message')
+    ]
+    
+    if not messages:
+        return jsonify({'success': False, 'error': 'Nenhum destinatário/mensagem válido'}), 400
+    
+    try:
+        rate, concurrency = broadcast_dispatcher.limits(data.get('rate_per_second'), data.get('concurrency'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    job = broadcast_dispatcher.submit(messages, rate_per_second=rate, concurrency=concurrency)
+    return jsonify({'success': True, 'job': job}), 202
+
+@app.route('/api/broadcast')
+@admin_required
+def api_broadcast_jobs():
+    """Listar envios em massa"""
+    return jsonify({'jobs': broadcast_dispatcher.list_jobs()})
+
+@app.route('/api/broadcast/<job_id>')
+@admin_required
+def api_broadcast_status(job_id):
+    """Status de um envio em massa, com o status de cada mensagem"""
+    job = broadcast_dispatcher.get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Envio não encontrado'}), 404
+    return jsonify({'success': True, 'job': job})
+
 @app.route('/admin/conversation/<int:conversation_id>')
 @admin_required
 def view_conversation(conversation_id):
@@ -385,6 +479,7 @@ def delete_conversation(conversation_id):
     conversation = Conversation.query.get_or_404(conversation_id)
     db.session.delete(conversation)
     db.session.commit()
+    event_broker.publish('conversation_deleted', {'id': conversation_id})
     flash('Conversa excluída com sucesso', 'success')
     return redirect(url_for('admin_conversations'))
 
@@ -402,36 +497,18 @@ def ai_config():
     if request.method == 'POST':
         ai_prompt = request.form.get('ai_prompt')
         
-        # Save or update AI prompt setting
-        setting = SystemSettings.query.filter_by(setting_key='ai_prompt').first()
-        if not setting:
-            setting = SystemSettings(setting_key='ai_prompt')
-            db.session.add(setting)
-        
-        setting.setting_value = ai_prompt
-        
+        # Save or update AI prompt setting (invalidates the settings cache)
         try:
-            db.session.commit()
+            settings_cache.set('ai_prompt', ai_prompt)
             flash('Prompt da IA atualizado com sucesso!', 'success')
         except Exception as e:
-            db.session.rollback()
             flash(f'Erro ao salvar configuração: {e}', 'error')
         
         return redirect(url_for('ai_config'))
     
     # Get current prompt
-    setting = SystemSettings.query.filter_by(setting_key='ai_prompt').first()
-    current_prompt = setting.setting_value if setting else None
-    
-    default_prompt = """Você é um assistente virtual inteligente para WhatsApp.
-Você deve responder de forma útil, amigável e profissional.
-
-Instruções:
-- Responda em português brasileiro
-- Seja conciso mas informativo
-- Mantenha um tom amigável e profissional
-- Se não souber algo, seja honesto sobre isso
-- Evite respostas muito longas para WhatsApp"""
+    current_prompt = settings_cache.get_raw('ai_prompt')
+    default_prompt = DEFAULT_AI_PROMPT
     
     return render_template('ai_config.html', 
                          current_prompt=current_prompt, 
@@ -489,6 +566,7 @@ def add_response():
         try:
             db.session.add(response)
             db.session.commit()
+            auto_response_matcher.notify_changed()
             flash('Resposta automática adicionada com sucesso', 'success')
             return redirect(url_for('admin_responses'))
         except Exception as e:
@@ -510,6 +588,7 @@ def edit_response(response_id):
         
         try:
             db.session.commit()
+            auto_response_matcher.notify_changed()
             flash('Resposta automática atualizada com sucesso', 'success')
             return redirect(url_for('admin_responses'))
         except Exception as e:
@@ -525,6 +604,7 @@ def delete_response(response_id):
     response = AutoResponse.query.get_or_404(response_id)
     db.session.delete(response)
     db.session.commit()
+    auto_response_matcher.notify_changed()
     flash('Resposta automática excluída com sucesso', 'success')
     return redirect(url_for('admin_responses'))
 
@@ -556,11 +636,29 @@ def api_conversations():
             'contact_name': conv.contact_name,
             'updated_at': conv.updated_at.isoformat(),
             'ai_paused': conv.ai_paused or False,
-            'message_count': len(conv.messages)
+            'message_count': conv.message_count,
+            'last_message_at': conv.last_message_at.isoformat() if conv.last_message_at else None,
+            'last_message_preview': conv.last_message_preview
         })
     
     return jsonify({'conversations': result})
 
+@app.route('/api/stats')
+def api_stats():
+    """API endpoint for dashboard counters"""
+    return jsonify({
+        'stats': stats_counters.get_stats(),
+        'ai_cache': ai_response_cache.get_stats(),
+        'ai_engine': ai_engine.get_stats(),
+        'context_cache': context_cache.get_stats(),
+        'intent': intent_classifier.get_stats(),
+        'rate_limit': rate_limiter.get_stats(),
+        'models': model_router.get_stats(),
+        'lanes': whatsapp_service.get_lane_stats(),
+        'baileys': baileys_service.get_transport_stats(),
+        'events': event_broker.get_stats()
+    })
+
 @app.route('/api/responses')
 def api_responses():
     """API endpoint for responses data"""
@@ -606,6 +704,7 @@ def api_add_response():
         
         db.session.add(response)
         db.session.commit()
+        auto_response_matcher.notify_changed()
         
         logging.info(f"Nova resposta automática adicionada: {response.trigger_keyword} (Tipo: {response.response_type}, Gatilho: {response.trigger_type}, Pausar IA: {response.pause_ai})")
         return jsonify({'success': True})
@@ -621,32 +720,14 @@ def api_ai_config():
         ai_prompt = data.get('ai_prompt')
         
         try:
-            setting = SystemSettings.query.filter_by(setting_key='ai_prompt').first()
-            if not setting:
-                setting = SystemSettings(setting_key='ai_prompt')
-                db.session.add(setting)
-            
-            setting.setting_value = ai_prompt
-            db.session.commit()
-            
+            settings_cache.set('ai_prompt', ai_prompt)
             return jsonify({'success': True})
         except Exception as e:
-            db.session.rollback()
             return jsonify({'success': False, 'error': str(e)})
     
     else:
-        setting = SystemSettings.query.filter_by(setting_key='ai_prompt').first()
-        current_prompt = setting.setting_value if setting else None
-        
-        default_prompt = """Você é um assistente virtual inteligente para WhatsApp.
-Você deve responder de forma útil, amigável e profissional.
-
-Instruções:
-- Responda em português brasileiro
-- Seja conciso mas informativo
-- Mantenha um tom amigável e profissional
-- Se não souber algo, seja honesto sobre isso
-- Evite respostas muito longas para WhatsApp"""
+        current_prompt = settings_cache.get_raw('ai_prompt')
+        default_prompt = DEFAULT_AI_PROMPT
         
         return jsonify({
             'success': True,
@@ -0,0 +1,198 @@
+import os
+import time
+import zlib
+import heapq
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List
+
+class WorkerLane:
+    """Uma thread com fila FIFO própria: tarefas da lane rodam em ordem, uma de cada vez"""
+
+    UTILIZATION_WINDOW = 60.0  # Segundos considerados na utilização
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks = deque()
+        self._condition = threading.Condition()
+        self._running_since = None
+        self._busy = deque()  # (fim, duração) das tarefas recentes
+        self.completed = 0
+        self.max_depth = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable, *args):
+        with self._condition:
+            self._tasks.append((fn, args))
+            self.max_depth = max(self.max_depth, len(self._tasks))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._tasks:
+                    self._condition.wait()
+                fn, args = self._tasks.popleft()
+                self._running_since = time.monotonic()
+
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.error(f"Erro na lane {self.name}: {e}")
+
+            with self._condition:
+                now = time.monotonic()
+                self._busy.append((now, now - self._running_since))
+                self._running_since = None
+                self.completed += 1
+
+    def stats(self) -> Dict:
+        with self._condition:
+            now = time.monotonic()
+            start = now - self.UTILIZATION_WINDOW
+            while self._busy and self._busy[0][0] < start:
+                self._busy.popleft()
+            busy = sum(min(duration, end - start) for end, duration in self._busy)
+            if self._running_since is not None:
+                busy += now - max(self._running_since, start)
+            return {
+                'depth': len(self._tasks),
+                'running': self._running_since is not None,
+                'completed': self.completed,
+                'max_depth': self.max_depth,
+                'utilization': round(min(1.0, busy / self.UTILIZATION_WINDOW), 3),
+            }
+
+class ShardedExecutor:
+    """Pool de lanes com afinidade por chave
+
+    Cada chave (ex.: telefone) cai sempre na mesma lane pelo hash, então as
+    tarefas de uma conversa rodam em ordem e nunca se sobrepõem, enquanto
+    conversas diferentes se espalham pelas lanes.
+    """
+
+    def __init__(self, lanes: int, name: str = 'lane'):
+        self.lanes: List[WorkerLane] = [WorkerLane(f"{name}-{index}") for index in range(max(1, lanes))]
+
+    def lane_for(self, shard: Hashable) -> int:
+        # crc32 é estável entre processos (hash() de str muda a cada execução)
+        return zlib.crc32(str(shard).encode('utf-8')) % len(self.lanes)
+
+    def submit(self, shard: Hashable, fn: Callable, *args):
+        self.lanes[self.lane_for(shard)].submit(fn, *args)
+
+    def get_stats(self) -> Dict:
+        lanes = [lane.stats() for lane in self.lanes]
+        return {
+            'lanes': len(lanes),
+            'queued': sum(lane['depth'] for lane in lanes),
+            'utilization': round(sum(lane['utilization'] for lane in lanes) / len(lanes), 3),
+            'per_lane': lanes,
+        }
+
+class DeadlineScheduler:
+    """Agendador único de prazos por chave
+
+    Uma só thread mantém um heap com todos os prazos; quando um prazo vence,
+    o callback roda num executor limitado. Reagendar a mesma chave substitui
+    o prazo anterior, então o número de threads não depende de quantas
+    chaves estão pendentes.
+
+    Com shard_by, os callbacks vão para um ShardedExecutor em vez do pool
+    comum: shard_by(chave) escolhe a lane, e callbacks do mesmo shard rodam
+    em ordem de prazo, sem sobreposição.
+    """
+
+    def __init__(self, max_workers: int = None, name: str = 'scheduler', shard_by: Callable = None):
+        self.name = name
+        self.max_workers = max_workers or int(os.environ.get('SCHEDULER_WORKERS', '8'))
+        self.shard_by = shard_by
+        self._heap = []            # (deadline, seq, key)
+        self._entries = {}         # key -> (deadline, seq, callback, args)
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        if shard_by:
+            self._lanes = ShardedExecutor(self.max_workers, name=f"{name}-lane")
+            self._executor = None
+        else:
+            self._lanes = None
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-worker")
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable, *args):
+        """Agendar (ou reagendar) o callback da chave para daqui a `delay` segundos"""
+        with self._condition:
+            deadline = time.monotonic() + delay
+            seq = next(self._counter)
+            self._entries[key] = (deadline, seq, callback, args)
+            heapq.heappush(self._heap, (deadline, seq, key))
+            # Acordar a thread apenas se o novo prazo for o mais próximo
+            if self._heap[0][1] == seq:
+                self._condition.notify()
+
+    def cancel(self, key: Hashable) -> bool:
+        """Cancelar o prazo pendente da chave (a entrada do heap é descartada ao vencer)"""
+        with self._condition:
+            return self._entries.pop(key, None) is not None
+
+    def is_pending(self, key: Hashable) -> bool:
+        with self._condition:
+            return key in self._entries
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._entries)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    # Descartar entradas substituídas ou canceladas
+                    while self._heap:
+                        deadline, seq, key = self._heap[0]
+                        entry = self._entries.get(key)
+                        if entry is not None and entry[1] == seq:
+                            break
+                        heapq.heappop(self._heap)
+
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+
+                    timeout = self._heap[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+
+                _, _, key = heapq.heappop(self._heap)
+                _, _, callback, args = self._entries.pop(key)
+
+            try:
+                if self._lanes:
+                    self._lanes.submit(self.shard_by(key), self._invoke, key, callback, args)
+                else:
+                    self._executor.submit(self._invoke, key, callback, args)
+            except RuntimeError as e:
+                logging.error(f"Agendador {self.name} não aceitou tarefa para {key}: {e}")
+
+    def _invoke(self, key: Hashable, callback: Callable, args: tuple):
+        try:
+            callback(*args)
+        except Exception as e:
+            logging.error(f"Erro na tarefa agendada {key} ({self.name}): {e}")
+
+    def get_stats(self) -> Dict:
+        with self._condition:
+            stats = {
+                'pending': len(self._entries),
+                'heap_size': len(self._heap),
+                'max_workers': self.max_workers
+            }
+        if self._lanes:
+            stats.update(self._lanes.get_stats())
+        return stats
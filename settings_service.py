@@ -0,0 +1,189 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from typing import Any, Callable, Dict
+from app import app, db
+from models import SystemSettings
+
+DEFAULT_AI_PROMPT = """Você é um assistente virtual inteligente para WhatsApp.
+Você deve responder de forma útil, amigável e profissional.
+
+Instruções:
+- Responda em português brasileiro
+- Seja conciso mas informativo
+- Mantenha um tom amigável e profissional
+- Se não souber algo, seja honesto sobre isso
+- Evite respostas muito longas para WhatsApp"""
+
+def _parse_bool(value: str) -> bool:
+    return value.strip().lower() in ('1', 'true', 'yes', 'on', 'sim')
+
+def _upsert_setting(key: str, value):
+    setting = SystemSettings.query.filter_by(setting_key=key).first()
+    if not setting:
+        setting = SystemSettings(setting_key=key)
+        db.session.add(setting)
+    setting.setting_value = value
+
+class SettingsCache:
+    """Cache em memória da tabela SystemSettings
+
+    Todas as configurações são carregadas de uma vez; ler é um acesso ao
+    dicionário. Cada escrita grava um novo token na linha 'settings_version',
+    e os outros workers do gunicorn comparam esse token (uma consulta por
+    chave única) no máximo a cada CHECK_INTERVAL segundos para recarregar.
+    Linhas de token (chaves terminadas em '_version', ver VersionToken) não
+    são configurações e ficam fora do cache.
+    """
+
+    VERSION_KEY = 'settings_version'
+
+    # chave -> (conversor do texto salvo, valor padrão)
+    DEFINITIONS: Dict[str, tuple] = {
+        'ai_prompt': (str, DEFAULT_AI_PROMPT),
+    }
+
+    PARSERS: Dict[type, Callable[[str], Any]] = {str: str, int: int, float: float, bool: _parse_bool}
+
+    def __init__(self, check_interval: float = None):
+        self.CHECK_INTERVAL = check_interval if check_interval is not None else float(
+            os.environ.get('SETTINGS_CHECK_INTERVAL', '2'))
+        self._lock = threading.Lock()
+        self._values: Dict[str, Any] = {}
+        self._raw: Dict[str, str] = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._loaded = False
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Valor tipado da configuração (padrão da definição se não estiver salva)"""
+        self._ensure_fresh()
+        if key in self._values:
+            return self._values[key]
+        if key in self.DEFINITIONS:
+            return self.DEFINITIONS[key][1]
+        return default
+
+    def get_raw(self, key: str):
+        """Texto salvo no banco, ou None se a configuração nunca foi salva"""
+        self._ensure_fresh()
+        return self._raw.get(key)
+
+    def set(self, key: str, value: Any):
+        """Salvar configuração e publicar nova versão na mesma transação"""
+        with app.app_context():
+            try:
+                _upsert_setting(key, None if value is None else str(value))
+                _upsert_setting(self.VERSION_KEY, uuid.uuid4().hex)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        self.invalidate()
+
+    def invalidate(self):
+        """Forçar recarga na próxima leitura"""
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._loaded and now - self._checked_at < self.CHECK_INTERVAL:
+            return
+
+        with self._lock:
+            if self._loaded and now - self._checked_at < self.CHECK_INTERVAL:
+                return
+            try:
+                with app.app_context():
+                    version = db.session.query(SystemSettings.setting_value).filter_by(
+                        setting_key=self.VERSION_KEY
+                    ).scalar()
+                    if not self._loaded or version != self._version:
+                        self._load(version)
+                self._checked_at = now
+            except Exception as e:
+                # Mantém os valores anteriores; tenta de novo no próximo intervalo
+                logging.error(f"Erro ao verificar configurações: {e}")
+                self._checked_at = now
+
+    def _load(self, version):
+        # Linhas de token ('settings_version' e as dos VersionToken) não são configurações
+        settings = SystemSettings.query.filter(~SystemSettings.setting_key.like('%\\_version', escape='\\')).all()
+        raw = {setting.setting_key: setting.setting_value for setting in settings}
+        values = {}
+        for key, text in raw.items():
+            if not text:
+                continue
+            parser = self.PARSERS.get(self.DEFINITIONS.get(key, (str, None))[0], str)
+            try:
+                values[key] = parser(text)
+            except ValueError:
+                logging.warning(f"Configuração {key} com valor inválido: {text!r}")
+
+        self._raw = raw
+        self._values = values
+        self._version = version
+        self._loaded = True
+        logging.debug(f"⚙️ Configurações carregadas ({len(raw)} chaves, versão {version})")
+
+class VersionToken:
+    """Token de versão próprio, numa linha de SystemSettings
+
+    Para caches derivados de outras tabelas (respostas automáticas, modelo
+    de intenção): publicar uma versão com bump() não mexe em
+    'settings_version', então não recarrega as configurações nem os outros
+    caches. get() relê só a própria linha (uma consulta por chave única) no
+    máximo a cada CHECK_INTERVAL segundos.
+    """
+
+    def __init__(self, key: str, check_interval: float = None):
+        self.key = key
+        self.CHECK_INTERVAL = check_interval if check_interval is not None else float(
+            os.environ.get('SETTINGS_CHECK_INTERVAL', '2'))
+        self._lock = threading.Lock()
+        self._value = None
+        self._checked_at = 0.0
+        self._loaded = False
+
+    def get(self):
+        """Token atual, ou None se a versão nunca foi publicada"""
+        now = time.monotonic()
+        if self._loaded and now - self._checked_at < self.CHECK_INTERVAL:
+            return self._value
+
+        with self._lock:
+            if self._loaded and now - self._checked_at < self.CHECK_INTERVAL:
+                return self._value
+            try:
+                with app.app_context():
+                    self._value = db.session.query(SystemSettings.setting_value).filter_by(
+                        setting_key=self.key
+                    ).scalar()
+                self._loaded = True
+            except Exception as e:
+                # Mantém o token anterior; tenta de novo no próximo intervalo
+                logging.error(f"Erro ao verificar versão {self.key}: {e}")
+            self._checked_at = now
+            return self._value
+
+    def bump(self) -> str:
+        """Publicar nova versão (vista por este processo na hora e pelos outros em até CHECK_INTERVAL)"""
+        token = uuid.uuid4().hex
+        with app.app_context():
+            try:
+                _upsert_setting(self.key, token)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        with self._lock:
+            self._value = token
+            self._loaded = True
+            self._checked_at = time.monotonic()
+        return token
+
+# Instância global
+settings_cache = SettingsCache()
@@ -32,12 +32,23 @@ class ConnectionMonitor {
     constructor() {
         this.isMonitoring = false;
         this.interval = null;
+        this.source = null;
     }
     
     start() {
         if (this.isMonitoring) return;
         
         this.isMonitoring = true;
+        
+        // Prefer server push; fall back to polling on old browsers
+        if (window.EventSource) {
+            this.source = new EventSource('/api/events/connection');
+            this.source.addEventListener('connection', (event) => {
+                this.handleStatus(JSON.parse(event.data));
+            });
+            return;
+        }
+        
         this.interval = setInterval(() => {
             this.checkStatus();
         }, 10000); // Check every 10 seconds
@@ -48,25 +59,31 @@ class ConnectionMonitor {
             clearInterval(this.interval);
             this.interval = null;
         }
+        if (this.source) {
+            this.source.close();
+            this.source = null;
+        }
         this.isMonitoring = false;
     }
     
     async checkStatus() {
         try {
             const response = await fetch('/connection_status');
-            const data = await response.json();
-            
-            const statusElement = document.getElementById('connection-status');
-            if (statusElement && data.is_connected) {
-                // Reload page if connection status changed to connected
-                if (!statusElement.innerHTML.includes('Conectado ao WhatsApp')) {
-                    location.reload();
-                }
-            }
+            this.handleStatus(await response.json());
         } catch (error) {
             console.error('Error checking connection status:', error);
         }
     }
+    
+    handleStatus(data) {
+        const statusElement = document.getElementById('connection-status');
+        if (statusElement && data.is_connected) {
+            // Reload page if connection status changed to connected
+            if (!statusElement.innerHTML.includes('Conectado ao WhatsApp')) {
+                location.reload();
+            }
+        }
+    }
 }
 
 // Initialize connection monitor on relevant pages
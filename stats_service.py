@@ -0,0 +1,254 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime
+from typing import Dict
+from sqlalchemy import event, func, select, inspect, true
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import Conversation, Message, AutoResponse, Statistic
+
+class _Previous:
+    """Valores de um objeto antes do flush, lidos do histórico de atributos"""
+
+    def __init__(self, obj):
+        self._state = inspect(obj)
+        self._obj = obj
+
+    def __getattr__(self, key):
+        history = self._state.attrs[key].history
+        if history.deleted:
+            return history.deleted[0]
+        return getattr(self._obj, key)
+
+class StatsCounters:
+    """Contadores do dashboard mantidos a cada escrita
+
+    Um listener after_flush calcula os deltas de cada escrita e guarda na
+    sessão; no commit eles vão para um buffer em memória (no rollback são
+    descartados). A thread de estatísticas aplica o buffer na tabela
+    statistic a cada FLUSH_INTERVAL segundos numa única transação, então as
+    escritas de mensagens não disputam as mesmas linhas de contador. Ler as
+    estatísticas é um SELECT de poucas linhas mais os deltas ainda não
+    aplicados deste processo. As linhas são criadas (com COUNT(*)) ao
+    iniciar, e a mesma thread recalcula tudo em baixa frequência para
+    corrigir desvios (deletes em massa, escritas fora do ORM).
+
+    Cada delta leva o reconciled_at da sua linha, lido na mesma transação
+    da escrita; a reconciliação bloqueia as linhas antes de contar, então o
+    COUNT(*) inclui exatamente as escritas com reconciled_at antigo. O flush
+    só soma deltas cujo reconciled_at ainda é o da linha, e os deltas que
+    qualquer worker tinha em buffer durante uma reconciliação são
+    descartados em vez de contados duas vezes.
+    """
+
+    # chave -> (modelo, predicado Python, critério SQL equivalente)
+    COUNTERS = {
+        'conversations_total': (Conversation, lambda c: True, true()),
+        'conversations_active': (Conversation, lambda c: c.is_active is not False,
+                                 Conversation.is_active.isnot(False)),
+        'conversations_ai_paused': (Conversation, lambda c: bool(c.ai_paused), Conversation.ai_paused.is_(True)),
+        'messages_total': (Message, lambda m: True, true()),
+        'messages_in': (Message, lambda m: bool(m.is_from_user), Message.is_from_user.is_(True)),
+        'messages_out': (Message, lambda m: not m.is_from_user, Message.is_from_user.is_(False)),
+        'replies_ai': (Message, lambda m: m.response_type == 'ai', Message.response_type == 'ai'),
+        'replies_auto': (Message, lambda m: m.response_type == 'auto', Message.response_type == 'auto'),
+        'replies_fallback': (Message, lambda m: m.response_type == 'fallback', Message.response_type == 'fallback'),
+        'replies_manual': (Message, lambda m: m.response_type == 'manual', Message.response_type == 'manual'),
+        'replies_broadcast': (Message, lambda m: m.response_type == 'broadcast', Message.response_type == 'broadcast'),
+        'auto_responses_active': (AutoResponse, lambda r: r.is_active is not False,
+                                  AutoResponse.is_active.isnot(False)),
+    }
+
+    def __init__(self, reconcile_interval: float = None, flush_interval: float = None):
+        self.RECONCILE_INTERVAL = reconcile_interval or float(os.environ.get('STATS_RECONCILE_INTERVAL', '3600'))
+        self.FLUSH_INTERVAL = flush_interval or float(os.environ.get('STATS_FLUSH_INTERVAL', '2'))
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._installed = False
+        self._lock = threading.Lock()
+        self._pending = {}  # (chave, reconciled_at) -> delta já commitado e ainda não aplicado
+        self._reconcile_requested = False
+
+    def install(self):
+        """Registrar os listeners de flush/commit/rollback na sessão do Flask-SQLAlchemy"""
+        if not self._installed:
+            event.listen(db.session, 'after_flush', self._after_flush)
+            event.listen(db.session, 'after_commit', self._after_commit)
+            event.listen(db.session, 'after_rollback', self._after_rollback)
+            atexit.register(self.flush)
+            self._installed = True
+
+    def _deltas(self, session) -> Dict[str, int]:
+        deltas = {}
+
+        def apply(obj, sign, predicate_source):
+            for key, (model, predicate, _) in self.COUNTERS.items():
+                if isinstance(obj, model) and predicate(predicate_source):
+                    deltas[key] = deltas.get(key, 0) + sign
+
+        for obj in session.new:
+            apply(obj, 1, obj)
+        for obj in session.deleted:
+            apply(obj, -1, _Previous(obj))
+        for obj in session.dirty:
+            if not isinstance(obj, (Conversation, Message, AutoResponse)) or not session.is_modified(obj):
+                continue
+            # Predicado mudou de valor (ex.: IA pausada/retomada)
+            apply(obj, -1, _Previous(obj))
+            apply(obj, 1, obj)
+
+        return {key: delta for key, delta in deltas.items() if delta}
+
+    def _after_flush(self, session, flush_context):
+        deltas = self._deltas(session)
+        if not deltas:
+            return
+        # A escrita já segura o lock de escrita (SQLite) / FOR SHARE nas linhas: a reconciliação
+        # acontece inteira antes ou depois desta transação
+        reconciled = dict(session.connection().execute(
+            select(Statistic.key, Statistic.reconciled_at)
+            .where(Statistic.key.in_(list(deltas)))
+            .with_for_update(read=True)
+        ).all())
+        pending = session.info.setdefault('stats_deltas', {})
+        for key, delta in deltas.items():
+            if key not in reconciled:
+                continue  # Linha ainda não criada: o seed conta esta escrita
+            tagged = (key, reconciled[key])
+            pending[tagged] = pending.get(tagged, 0) + delta
+
+    def _after_commit(self, session):
+        deltas = session.info.pop('stats_deltas', None)
+        if not deltas:
+            return
+        with self._lock:
+            for tagged, delta in deltas.items():
+                self._pending[tagged] = self._pending.get(tagged, 0) + delta
+
+    def _after_rollback(self, session):
+        session.info.pop('stats_deltas', None)
+
+    def flush(self) -> int:
+        """Aplicar os deltas acumulados na tabela statistic numa transação; retorna quantas chaves mudaram
+
+        Deltas de antes da última reconciliação da linha já estão no COUNT(*)
+        gravado por ela e são descartados.
+        """
+        with self._lock:
+            deltas, self._pending = {tagged: delta for tagged, delta in self._pending.items() if delta}, {}
+        if not deltas:
+            return 0
+
+        applied = 0
+        try:
+            with app.app_context():
+                with db.engine.begin() as conn:
+                    for (key, reconciled_at), delta in deltas.items():
+                        applied += conn.execute(
+                            Statistic.__table__.update()
+                            .where(Statistic.key == key, Statistic.reconciled_at == reconciled_at)
+                            .values(value=Statistic.value + delta)
+                        ).rowcount
+        except Exception:
+            # Devolver ao buffer para a próxima rodada
+            with self._lock:
+                for tagged, delta in deltas.items():
+                    self._pending[tagged] = self._pending.get(tagged, 0) + delta
+            raise
+        return applied
+
+    def get_stats(self) -> Dict[str, int]:
+        """Ler todos os contadores (uma consulta de poucas linhas, O(1)) mais os deltas locais pendentes"""
+        with app.app_context():
+            rows = db.session.execute(select(Statistic.key, Statistic.value, Statistic.reconciled_at)).all()
+        stats = {key: 0 for key in self.COUNTERS}
+        stats.update({key: value for key, value, _ in rows if key in stats})
+        current = {(key, reconciled_at) for key, _, reconciled_at in rows}
+        with self._lock:
+            for (key, reconciled_at), delta in self._pending.items():
+                if key in stats and (key, reconciled_at) in current:
+                    stats[key] += delta
+        return stats
+
+    def seed(self) -> int:
+        """Criar as linhas de contador que faltam, já com o COUNT(*) atual; retorna quantas criou"""
+        created = 0
+        with app.app_context():
+            existing = set(db.session.execute(select(Statistic.key)).scalars())
+            db.session.rollback()
+            for key in self.COUNTERS.keys() - existing:
+                model, _, criterion = self.COUNTERS[key]
+                try:
+                    with db.engine.begin() as conn:
+                        value = conn.execute(select(func.count()).select_from(model).where(criterion)).scalar()
+                        conn.execute(Statistic.__table__.insert().values(
+                            key=key, value=value, reconciled_at=datetime.utcnow()))
+                    created += 1
+                except IntegrityError:
+                    pass  # Outro worker criou a linha ao mesmo tempo
+        return created
+
+    def reconcile(self) -> Dict[str, int]:
+        """Recalcular todos os contadores com COUNT(*) e gravar os valores exatos
+
+        Os deltas em buffer (deste e de outros workers) ficam com o
+        reconciled_at antigo e são descartados no próximo flush.
+        """
+        with app.app_context():
+            with db.engine.begin() as conn:
+                now = datetime.utcnow()
+                # Bloquear as linhas primeiro: escritas em andamento terminam antes da contagem
+                # e as seguintes leem o novo reconciled_at
+                conn.execute(Statistic.__table__.update().values(reconciled_at=now))
+                values = {}
+                for key, (model, _, criterion) in self.COUNTERS.items():
+                    values[key] = conn.execute(select(func.count()).select_from(model).where(criterion)).scalar()
+                    updated = conn.execute(
+                        Statistic.__table__.update()
+                        .where(Statistic.key == key)
+                        .values(value=values[key], reconciled_at=now)
+                    ).rowcount
+                    if not updated:
+                        conn.execute(Statistic.__table__.insert().values(key=key, value=values[key], reconciled_at=now))
+        return values
+
+    def _run(self):
+        reconciled_at = time.monotonic()
+        while True:
+            self._wakeup.wait(self.FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                if self._reconcile_requested or time.monotonic() - reconciled_at >= self.RECONCILE_INTERVAL:
+                    self._reconcile_requested = False
+                    reconciled_at = time.monotonic()
+                    self.reconcile()
+                    logging.debug("📊 Contadores do dashboard reconciliados")
+                else:
+                    self.flush()
+            except Exception as e:
+                logging.error(f"Erro ao atualizar contadores: {e}")
+
+    def start(self):
+        """Criar os contadores que faltam e iniciar a thread de flush/reconciliação"""
+        if self._thread:
+            return
+        try:
+            created = self.seed()
+            if created:
+                logging.info(f"📊 {created} contadores do dashboard criados")
+        except Exception as e:
+            logging.error(f"Erro ao criar contadores: {e}")
+        self._thread = threading.Thread(target=self._run, name='stats-counters', daemon=True)
+        self._thread.start()
+
+    def request_reconcile(self):
+        """Antecipar a próxima reconciliação"""
+        self._reconcile_requested = True
+        self._wakeup.set()
+
+# Instância global
+stats_counters = StatsCounters()
+stats_counters.install()
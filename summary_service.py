@@ -0,0 +1,113 @@
+import os
+import logging
+from datetime import datetime
+from app import app, db
+from models import Conversation, Message
+from scheduler_service import DeadlineScheduler
+
+class ConversationSummarizer:
+    """Resumo incremental (rolling) de cada conversa
+
+    Mensagens mais antigas que a janela recente são condensadas em
+    Conversation.summary em segundo plano, SUMMARY_EVERY de cada vez; o
+    prompt da IA usa resumo + janela recente, então o tamanho do prompt fica
+    estável mesmo em conversas longas.
+    """
+
+    def __init__(self):
+        self.SUMMARY_EVERY = int(os.environ.get('SUMMARY_EVERY', '10'))    # Mensagens novas por atualização
+        self.RECENT_WINDOW = int(os.environ.get('AI_HISTORY_WINDOW', '10'))  # Mensagens que ficam fora do resumo
+        self.MAX_SUMMARY_WORDS = int(os.environ.get('SUMMARY_MAX_WORDS', '150'))
+        self.MAX_BATCH = 50  # Conversas antigas: só as mensagens mais recentes entram no primeiro resumo
+        self.TIER = 'lite'  # Nível do model_router: resumo é tarefa de fundo, como a classificação de intenção
+        self.DELAY = 5  # Segundos de espera para agrupar gatilhos da mesma conversa
+        self.scheduler = DeadlineScheduler(max_workers=2, name='summary-scheduler')
+
+    @property
+    def history_limit(self) -> int:
+        """Mensagens após o resumo que o prompt pode precisar (janela + ainda não resumidas)"""
+        return self.RECENT_WINDOW + self.SUMMARY_EVERY
+
+    def recent_history(self, conversation: Conversation, queued_count: int = 0) -> list:
+        """Mensagens depois do resumo, na ordem em que foram gravadas
+
+        Ordena pelo id, a mesma chave do limite do resumo (summary_message_id),
+        servido pelo índice (conversation_id, id). Conversa nova (só as
+        mensagens da fila atual) não precisa de consulta.
+        """
+        if not conversation.summary_message_id and (conversation.message_count or 0) <= queued_count:
+            return []
+
+        query = Message.query.filter(Message.conversation_id == conversation.id)
+        if conversation.summary_message_id:
+            query = query.filter(Message.id > conversation.summary_message_id)
+        return query.order_by(Message.id.desc()).limit(self.history_limit).all()[::-1]
+
+    def maybe_update(self, conversation: Conversation):
+        """Agendar atualização quando há SUMMARY_EVERY mensagens além da janela sem resumo
+
+        Usa só os contadores já carregados na conversa; nenhuma consulta.
+        """
+        unsummarized = (conversation.message_count or 0) - (conversation.summary_message_count or 0)
+        if unsummarized >= self.RECENT_WINDOW + self.SUMMARY_EVERY:
+            self.scheduler.schedule(conversation.id, self.DELAY, self._update, conversation.id)
+
+    def _update(self, conversation_id: int):
+        from ai_service import client
+        from ai_engine_service import ai_engine
+        from model_router_service import model_router
+
+        if not client:
+            return
+
+        with app.app_context():
+            try:
+                conversation = db.session.get(Conversation, conversation_id)
+                if not conversation:
+                    return
+
+                # Só as últimas MAX_BATCH mensagens antes da janela entram no resumo
+                query = Message.query.filter(Message.conversation_id == conversation_id)
+                if conversation.summary_message_id:
+                    query = query.filter(Message.id > conversation.summary_message_id)
+                pending = query.order_by(Message.id.desc()).limit(self.MAX_BATCH + self.RECENT_WINDOW).all()[::-1]
+                to_summarize = pending[:-self.RECENT_WINDOW] if self.RECENT_WINDOW else pending
+                if len(to_summarize) < self.SUMMARY_EVERY:
+                    return
+
+                transcript = "\n".join(
+                    f"{'Usuário' if msg.is_from_user else 'AsA'}: {msg.content}" for msg in to_summarize
+                )
+                prompt = f"""
+                Atualize o resumo de uma conversa de atendimento por WhatsApp.
+                Mantenha fatos importantes: nome do cliente, pedidos, dúvidas em aberto e combinados.
+                Responda apenas com o novo resumo, em português, com no máximo {self.MAX_SUMMARY_WORDS} palavras.
+
+                Resumo atual:
+                {conversation.summary or '(vazio)'}
+
+                Novas mensagens:
+                {transcript}
+                """
+
+                response = ai_engine.run(ai_engine.generate_content(client, model_router.model(self.TIER), prompt))
+                if not response.text:
+                    return
+
+                # Conta todas as mensagens até o limite, inclusive as antigas que ficaram de fora do lote
+                boundary = to_summarize[-1].id
+                conversation.summary = response.text.strip()
+                conversation.summary_message_id = boundary
+                conversation.summary_message_count = Message.query.filter(
+                    Message.conversation_id == conversation_id, Message.id <= boundary
+                ).count()
+                conversation.summary_updated_at = datetime.utcnow()
+                db.session.commit()
+                logging.info(f"📝 Resumo da conversa {conversation_id} atualizado ({len(to_summarize)} mensagens)")
+
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Erro ao atualizar resumo da conversa {conversation_id}: {e}")
+
+# Instância global
+conversation_summarizer = ConversationSummarizer()
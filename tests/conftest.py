@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Isolated databases for the whole run; must be set before app is imported
+_tmp = tempfile.mkdtemp(prefix='asa-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(_tmp, 'app.db')}",
+    'INBOX_DB_PATH': os.path.join(_tmp, 'inbox.db'),
+    'QUEUE_STATE_DB_PATH': os.path.join(_tmp, 'queue_state.db'),
+    'EVENTS_DB_PATH': os.path.join(_tmp, 'events.db'),
+    'INTENT_MODEL_PATH': os.path.join(_tmp, 'intent_model.json'),
+    'BAILEYS_LOCK_PATH': os.path.join(_tmp, 'baileys_sidecar.lock'),
+    'BAILEYS_URL': 'http://127.0.0.1:9',
+    'AI_CACHE_DB_PATH': '',
+    'AI_BACKEND': 'fake',
+})
+
+# Never launch the Node sidecar from the tests
+import baileys_service  # noqa: E402
+
+baileys_service.SidecarSupervisor.start = lambda self: None
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+import ai_service
+from ai_cache_service import AIResponseCache, ai_response_cache
+from fake_gemini import FakeGeminiClient
+from models import Message
+
+def _message(is_from_user, minutes_ago):
+    return Message(content='...', is_from_user=is_from_user, timestamp=datetime.utcnow() - timedelta(minutes=minutes_ago))
+
+def test_opening_question_is_cacheable_only_without_a_summary():
+    cache = AIResponseCache(path='')
+    question = 'Qual o horário de funcionamento?'
+
+    assert cache.is_cacheable(question)
+    assert cache.is_cacheable(question, [_message(True, 0)])  # Only the question itself
+    assert not cache.is_cacheable(question, [], summary='Cliente pediu 2 bolos para sábado.')
+    assert not cache.is_cacheable(question, [_message(True, 0)], summary='Cliente pediu 2 bolos para sábado.')
+
+def test_recent_exchange_blocks_the_cache_and_an_idle_one_does_not():
+    cache = AIResponseCache(path='')
+    question = 'Qual o horário de funcionamento?'
+    summary = 'Cliente pediu 2 bolos para sábado.'
+    recent = [_message(True, 5), _message(False, 4), _message(True, 0)]
+    idle = [_message(True, cache.IDLE_MINUTES + 10), _message(False, cache.IDLE_MINUTES + 9), _message(True, 0)]
+
+    assert not cache.is_cacheable(question, recent)
+    assert not cache.is_cacheable(question, recent, summary=summary)
+    assert cache.is_cacheable(question, idle)
+    assert cache.is_cacheable(question, idle, summary=summary)
+    assert not cache.is_cacheable('x' * (cache.MAX_QUESTION_LENGTH + 1))
+
+def test_summarized_conversation_is_not_served_from_the_cache(monkeypatch):
+    monkeypatch.setattr(ai_service, 'client', FakeGeminiClient(latency=0))
+    question = 'Vocês entregam no domingo?'
+    ai_response_cache.put(question, ai_service.get_custom_prompt(), 'Entregamos de segunda a sábado.')
+
+    cached, _, _ = ai_service._prepare_request(question)
+    assert cached == 'Entregamos de segunda a sábado.'
+
+    cached, prompt, cache_key = ai_service._prepare_request(question, [], summary='Cliente mora em outra cidade.')
+    assert cached is None and cache_key is None
+    assert 'Cliente mora em outra cidade.' in prompt[1]
@@ -0,0 +1,54 @@
+import pytest
+from autoresponse_service import AutoResponseMatcher, CompiledRule, KeywordAutomaton, normalize_text
+from models import AutoResponse
+
+def _rule(rule_id, keyword, trigger_type='first_message'):
+    return CompiledRule(AutoResponse(id=rule_id, trigger_keyword=keyword, response_text=f'resposta {keyword}',
+                                     trigger_type=trigger_type))
+
+def _found(automaton, message):
+    return sorted(rule.keyword for rule in automaton.search(normalize_text(message)))
+
+@pytest.mark.parametrize('message, expected', [
+    ('oi', ['oi']),
+    ('Oi, tudo bem?', ['oi']),
+    ('ok... oi!', ['oi']),
+    ('o boi fugiu', []),
+    ('são oito horas', []),
+    ('coisa', []),
+    ('oioi', []),
+])
+def test_keywords_match_only_whole_words(message, expected):
+    assert _found(KeywordAutomaton([_rule(1, 'oi')]), message) == expected
+
+def test_multi_word_keywords_ignore_case_and_accents():
+    automaton = KeywordAutomaton([_rule(1, 'Horário de funcionamento')])
+    assert _found(automaton, 'Qual o HORARIO DE FUNCIONAMENTO?') == ['horario de funcionamento']
+    assert _found(automaton, 'horário de funcionamentos') == []
+
+def test_overlapping_keywords_are_all_found_in_one_pass():
+    automaton = KeywordAutomaton([_rule(1, 'entrega'), _rule(2, 'prazo de entrega'), _rule(3, 'prazo'),
+                                  _rule(4, 'de entregar')])
+    assert _found(automaton, 'qual o prazo de entrega?') == ['entrega', 'prazo', 'prazo de entrega']
+    assert _found(automaton, 'vocês podem entregar hoje?') == []
+
+def _matcher(rules):
+    matcher = AutoResponseMatcher()
+    compiled = [_rule(rule_id, keyword) for rule_id, keyword in rules]
+    matcher._partitions = {'first_message': (KeywordAutomaton(compiled), compiled[0])}
+    matcher._version = matcher._version_token.get()
+    matcher._built = True
+    return matcher
+
+def test_longest_keyword_wins_and_ties_go_to_the_oldest_rule():
+    matcher = _matcher([(1, 'bom dia'), (2, 'preço'), (3, 'preço do frete'), (4, 'frete'), (5, 'pix'), (6, 'pão')])
+
+    assert matcher.match('Bom dia! Qual o preço do frete?', True).keyword == 'preco do frete'
+    assert matcher.match('bom dia, qual o preço?', True).keyword == 'bom dia'
+    assert matcher.match('aceita pix? e o pão?', True).id == 5  # Same length: oldest rule
+    assert matcher.match('frete', True).keyword == 'frete'
+
+def test_no_keyword_falls_back_to_the_oldest_rule_of_the_trigger():
+    matcher = _matcher([(7, 'cardápio'), (8, 'endereço')])
+    assert matcher.match('alguém aí?', True).id == 7
+    assert matcher.match('alguém aí?', False) is None  # No follow-up rules
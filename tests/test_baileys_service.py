@@ -0,0 +1,168 @@
+import sys
+import threading
+import time
+import requests
+from baileys_service import BaileysService, CircuitBreaker, SidecarSupervisor
+
+def _opened_breaker(reset_timeout=0.1):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=reset_timeout)
+    assert breaker.record_failure() is False
+    assert breaker.state == 'closed' and breaker.allow_request()
+    assert breaker.record_failure() is True  # Just opened
+    return breaker
+
+def test_breaker_opens_after_consecutive_failures_and_fails_fast():
+    breaker = _opened_breaker(reset_timeout=10)
+    assert breaker.state == 'open'
+    assert not breaker.allow_request()
+    assert breaker.record_failure() is False  # Already open
+
+def test_half_open_lets_a_single_probe_through():
+    breaker = _opened_breaker()
+    time.sleep(0.12)
+    assert breaker.state == 'half_open'
+
+    allowed = []
+    barrier = threading.Barrier(8)
+
+    def caller():
+        barrier.wait()
+        allowed.append(breaker.allow_request())
+
+    threads = [threading.Thread(target=caller) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(allowed) == [False] * 7 + [True]
+
+    # The probe succeeds: closed again, everything goes through
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert all(breaker.allow_request() for _ in range(3))
+
+def test_failed_probe_reopens_for_another_reset_timeout():
+    breaker = _opened_breaker()
+    time.sleep(0.12)
+    assert breaker.allow_request()
+    breaker.record_failure()
+
+    assert breaker.state == 'open'
+    assert not breaker.allow_request()
+    time.sleep(0.12)
+    assert breaker.allow_request()  # A new probe after the window
+    assert not breaker.allow_request()
+
+def test_probe_without_result_frees_the_slot_after_reset_timeout():
+    breaker = _opened_breaker()
+    time.sleep(0.12)
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    time.sleep(0.12)
+    assert breaker.allow_request()
+
+def test_requests_fail_fast_while_the_probe_is_in_flight(monkeypatch):
+    service = BaileysService()
+    service.breaker = _opened_breaker()
+    time.sleep(0.12)
+
+    probe_started, finish_probe = threading.Event(), threading.Event()
+    calls = []
+
+    class SlowResponse:
+        status_code = 200
+
+        def json(self):
+            return {'success': True}
+
+    def post(url, json=None, timeout=None):
+        calls.append(url)
+        probe_started.set()
+        finish_probe.wait(5)
+        return SlowResponse()
+
+    monkeypatch.setattr(service.session, 'post', post)
+    results = []
+    probe = threading.Thread(target=lambda: results.append(service._make_request('POST', '/send-message', {})))
+    probe.start()
+    assert probe_started.wait(5)
+
+    assert service._make_request('POST', '/send-message', {})['error'].endswith('(circuito aberto)')
+    finish_probe.set()
+    probe.join()
+
+    assert results == [{'success': True}]
+    assert service.breaker.state == 'closed'
+    assert len(calls) == 1
+
+def test_connection_errors_open_the_breaker(monkeypatch):
+    service = BaileysService()
+    service.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    monkeypatch.setattr(service.supervisor, 'wake', lambda: None)
+
+    def refuse(*args, **kwargs):
+        raise requests.exceptions.ConnectionError('refused')
+
+    monkeypatch.setattr(service.session, 'get', refuse)
+    assert service._make_request('GET', '/status', retries=3)['success'] is False
+    assert service.breaker.state == 'open'
+
+def _supervisor(tmp_path, code='import sys; sys.exit(3)', probe=lambda: False):
+    supervisor = SidecarSupervisor([sys.executable, '-c', code], probe, lock_path=str(tmp_path / 'sidecar.lock'))
+    supervisor.BACKOFF_MAX = 4
+    return supervisor
+
+def test_only_the_lock_holder_starts_the_sidecar(tmp_path):
+    owner, other = _supervisor(tmp_path), _supervisor(tmp_path)
+    assert owner._acquire_lock()
+
+    assert other._recover() == other.HEALTH_INTERVAL
+    assert other.get_stats()['state'] == 'waiting' and other.process is None
+
+    # The owner dies: the OS releases the lock and the other worker takes over
+    owner._lock_file.close()
+    owner._lock_file = None
+    assert other._recover() == 0.5
+    assert other.get_stats()['owner'] and other.get_stats()['starts'] == 1
+    other._terminate()
+
+def test_crashing_sidecar_is_restarted_with_exponential_backoff(tmp_path):
+    supervisor = _supervisor(tmp_path)
+    delays = []
+    for _ in range(5):
+        assert supervisor._recover() == 0.5  # Spawned
+        supervisor.process.wait(5)
+        delays.append(supervisor._recover())  # Exited: back off
+
+    assert delays == [1, 2, 4, 4, 4]  # Doubles up to BACKOFF_MAX
+    stats = supervisor.get_stats()
+    assert (stats['starts'], stats['failures'], stats['state']) == (5, 5, 'backoff')
+
+def test_sidecar_that_never_gets_ready_is_killed_after_the_startup_timeout(tmp_path):
+    supervisor = _supervisor(tmp_path, code='import time; time.sleep(30)')
+    supervisor.STARTUP_TIMEOUT = 0.2
+
+    assert supervisor._recover() == 0.5
+    process = supervisor.process
+    assert supervisor._recover() <= 0.5  # Still within the startup window
+    assert process.poll() is None
+
+    time.sleep(0.25)
+    assert supervisor._recover() == 1
+    assert process.poll() is not None and supervisor.process is None
+
+def test_ready_probe_resets_the_backoff(tmp_path):
+    supervisor = _supervisor(tmp_path, probe=lambda: True)
+    supervisor._failures = 3
+    supervisor._thread = threading.Thread(target=supervisor._supervise, daemon=True)
+    supervisor._thread.start()
+
+    assert supervisor.ready.wait(2)
+    assert supervisor._failures == 0 and supervisor.get_stats()['state'] == 'ready'
+    supervisor.stop()
+    assert supervisor.get_stats()['state'] == 'stopped' and not supervisor.ready.is_set()
+
+def test_missing_node_waits_the_maximum_backoff(tmp_path):
+    supervisor = SidecarSupervisor(['node-not-installed-here'], lambda: False, lock_path=str(tmp_path / 'sidecar.lock'))
+    assert supervisor._recover() == supervisor.BACKOFF_MAX
+    assert supervisor.get_stats()['state'] == 'unavailable'
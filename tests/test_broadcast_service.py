@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+import pytest
+from app import app, db
+import routes  # noqa: F401  (registers the views)
+from broadcast_service import BroadcastDispatcher, broadcast_dispatcher
+from models import BroadcastJob, BroadcastItem
+
+def test_job_lease_is_taken_over_only_after_it_expires(monkeypatch):
+    # Keep this process' own dispatcher thread out of the way
+    monkeypatch.setattr(broadcast_dispatcher, '_claim_job', lambda: None)
+
+    with app.app_context():
+        job = BroadcastJob(id='lease000001', rate_per_second=5, concurrency=1,
+                           lease_owner='other-worker', lease_until=datetime.utcnow() + timedelta(minutes=1))
+        db.session.add(job)
+        db.session.add_all([
+            BroadcastItem(job_id=job.id, position=0, phone='5511900000001', message='oi', status='sending', attempts=1),
+            BroadcastItem(job_id=job.id, position=1, phone='5511900000002', message='oi'),
+        ])
+        db.session.commit()
+
+        worker = BroadcastDispatcher()
+        assert worker._claim_job() is None  # Lease still held by the other worker
+
+        job.lease_until = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+
+        claimed = worker._claim_job()
+        assert claimed.id == job.id and claimed.lease_owner == worker.owner
+        # The chunk the dead worker was sending is not repeated
+        assert worker.get_job(job.id)['counts'] == {'pending': 1, 'sending': 0, 'sent': 0, 'failed': 1}
+        assert BroadcastDispatcher().get_job(job.id)['messages'][0]['error'] == 'Envio interrompido'
+
+        claimed.status = 'finished'
+        db.session.commit()
+
+def test_rate_and_concurrency_are_validated_and_clamped():
+    worker = BroadcastDispatcher()
+    worker.MAX_RATE, worker.MAX_CONCURRENCY = 5.0, 3
+
+    assert worker.limits() == (5.0, 3)
+    assert worker.limits('2.5', '2') == (2.5, 2)
+    assert worker.limits(0.5, 1) == (0.5, 1)
+    assert worker.limits(1000, 50) == (5.0, 3)
+    for rate in ('abc', 0, -1, 'nan', 'inf', [1]):
+        with pytest.raises(ValueError):
+            worker.limits(rate_per_second=rate)
+    for concurrency in ('dois', 0, -2, 1.5, {}):
+        with pytest.raises(ValueError):
+            worker.limits(concurrency=concurrency)
+
+def test_broadcast_route_rejects_bad_limits():
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['admin_logged_in'] = True
+
+    body = {'recipients': ['5511900000003'], 'message': 'oi'}
+    for limits in ({'rate_per_second': 'rápido'}, {'rate_per_second': -3}, {'concurrency': 0}, {'concurrency': 'x'}):
+        response = client.post('/api/broadcast', json={**body, **limits})
+        assert response.status_code == 400
+        assert response.get_json()['success'] is False
+
+    with app.app_context():
+        assert BroadcastItem.query.filter_by(phone='5511900000003').count() == 0
@@ -0,0 +1,74 @@
+import pytest
+import ai_service
+from ai_engine_service import ai_engine
+from context_cache_service import context_cache
+from fake_gemini import FakeGeminiClient, count_tokens
+
+MODEL = 'gemini-2.5-flash'
+BUSINESS_PROMPT = "Você é o assistente da Loja Exemplo.\n" + "\n".join(
+    f"- Produto {i}: descrição, preço e condições de entrega detalhadas para o cliente." for i in range(120)
+)
+
+@pytest.fixture(autouse=True)
+def enabled_cache(monkeypatch):
+    monkeypatch.setattr(context_cache, 'ENABLED', True)
+    context_cache.invalidate()
+    yield
+    context_cache.invalidate()
+
+def _generate(backend, prompt, question='Qual o prazo de entrega?'):
+    return ai_engine.run(ai_service._generate_content(backend, prompt, f"Mensagem atual do usuário: {question}", MODEL))
+
+def _calls(backend, name):
+    return [call for call in backend.calls if call[0] == name]
+
+def test_cache_is_created_once_and_reused():
+    backend = FakeGeminiClient(latency=0)
+    for i in range(3):
+        _generate(backend, BUSINESS_PROMPT, f"pergunta {i}")
+
+    created = _calls(backend, 'caches.create')
+    assert len(created) == 1
+    cache_name = created[0][1]
+    assert [call[2] for call in _calls(backend, 'generate_content')] == [{'cached_content': cache_name}] * 3
+
+def test_cache_is_recreated_when_the_business_prompt_changes():
+    backend = FakeGeminiClient(latency=0)
+    _generate(backend, BUSINESS_PROMPT)
+    old_name = _calls(backend, 'caches.create')[0][1]
+
+    _generate(backend, BUSINESS_PROMPT + "\n- Novo horário: 8h às 20h.")
+    created = _calls(backend, 'caches.create')
+    assert len(created) == 2
+    assert ('caches.delete', old_name) in backend.calls
+    assert list(backend.caches) == [created[1][1]]
+    assert context_cache.get_stats()['active'] == {MODEL: created[1][1]}
+
+def test_small_prompts_fall_back_to_system_instruction(monkeypatch):
+    backend = FakeGeminiClient(latency=0)
+    small_prompt = "Você é o assistente da Loja Exemplo."
+    _generate(backend, small_prompt)
+    assert not _calls(backend, 'caches.create')  # Abaixo de MIN_TOKENS nem tenta
+
+    # Abaixo do mínimo da API: a criação falha uma vez, a geração segue sem cache e não tenta de novo
+    monkeypatch.setattr(context_cache, 'MIN_TOKENS', 1)
+    medium_prompt = small_prompt + " Responda sempre em português." * 20
+    assert count_tokens(medium_prompt) < backend.min_cache_tokens
+    _generate(backend, medium_prompt)
+    _generate(backend, medium_prompt)
+
+    assert backend.caches == {}
+    assert all(call[2] == {'system_instruction': call_prompt}
+               for call, call_prompt in zip(_calls(backend, 'generate_content'), [small_prompt, medium_prompt, medium_prompt]))
+    assert context_cache.get_stats()['errors'] >= 1
+
+def test_engine_reports_cached_tokens():
+    backend = FakeGeminiClient(latency=0)
+    question = 'Mensagem atual do usuário: pergunta'
+    before = dict(ai_engine.get_stats()['tokens'])
+    for _ in range(4):
+        ai_engine.run(ai_service._generate_content(backend, BUSINESS_PROMPT, question, MODEL))
+    after = ai_engine.get_stats()['tokens']
+
+    assert after['cached'] - before['cached'] == 4 * count_tokens(BUSINESS_PROMPT)
+    assert after['prompt'] - before['prompt'] == 4 * (count_tokens(BUSINESS_PROMPT) + count_tokens(question))
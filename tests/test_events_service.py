@@ -0,0 +1,42 @@
+import time
+from app import app
+import routes  # noqa: F401  (registers the views)
+from events_service import EventBroker
+
+def _next_event(stream, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        chunk = next(stream)
+        if chunk.startswith('event:'):
+            return chunk
+    raise AssertionError('no event received')
+
+def test_events_reach_subscribers_of_other_workers(tmp_path):
+    path = str(tmp_path / 'events.db')
+    worker_a = EventBroker(heartbeat=0.1, path=path)
+    worker_b = EventBroker(heartbeat=0.1, path=path)
+    worker_a.POLL_INTERVAL = worker_b.POLL_INTERVAL = 0.05
+
+    everything = worker_b.subscribe()
+    connection_only = worker_b.subscribe(('connection',))
+    next(everything), next(connection_only)  # retry header
+    time.sleep(0.2)  # relay of worker B starts from the newest event
+
+    worker_a.publish('message', {'content': 'olá'})
+    worker_a.publish('connection', {'is_connected': True})
+
+    assert _next_event(everything).startswith('event: message')
+    assert _next_event(everything).startswith('event: connection')
+    assert _next_event(connection_only).startswith('event: connection')
+    assert worker_b.relayed == 2
+
+def test_full_event_stream_requires_admin_login():
+    client = app.test_client()
+    assert client.get('/api/events').status_code == 302
+
+    with client.session_transaction() as session:
+        session['admin_logged_in'] = True
+    response = client.get('/api/events')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    response.close()
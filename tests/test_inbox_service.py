@@ -0,0 +1,52 @@
+from app import app
+from inbox_service import MessageInbox
+from models import Conversation, Message
+from whatsapp_service import whatsapp_service, handle_inbound_event
+
+def test_retry_after_commit_stores_message_once(tmp_path, monkeypatch):
+    inbox = MessageInbox(path=str(tmp_path / 'inbox.db'), workers=1)
+    inbox.enqueue('5511955550001', {
+        'phone': '5511955550001',
+        'message': 'Qual o horário de funcionamento?',
+        'contact_name': 'Cliente',
+        'message_id': '3EB0RETRY0001',
+        'timestamp': '2026-01-05T12:00:00.000Z',
+    })
+
+    # Fail after the Message row was committed, on the first attempt only
+    queue_messages = whatsapp_service.add_messages_to_queue
+    calls = []
+
+    def flaky_queue(items):
+        calls.append(items)
+        if len(calls) == 1:
+            raise RuntimeError('queue unavailable')
+        queue_messages(items)
+
+    monkeypatch.setattr(whatsapp_service, 'add_messages_to_queue', flaky_queue)
+
+    assert inbox.process_next(handle_inbound_event)
+    assert inbox.get_stats()['pending'] == 1
+    assert inbox.process_next(handle_inbound_event)
+    assert inbox.get_stats() == {'pending': 0, 'processing': 0, 'failed': 0}
+
+    with app.app_context():
+        conversation = Conversation.find_by_phone('5511955550001')
+        messages = Message.query.filter_by(conversation_id=conversation.id).all()
+        assert [message.whatsapp_id for message in messages] == ['3EB0RETRY0001']
+        assert conversation.message_count == 1
+
+def test_resynced_history_is_not_duplicated():
+    batch = [
+        {'phone': '5511955550002', 'message': f'mensagem {i}', 'message_id': f'3EB0HIST{i:04d}',
+         'timestamp': f'2026-01-05T09:0{i}:00.000Z'}
+        for i in range(3)
+    ]
+    whatsapp_service.process_incoming_batch(batch, 'append')
+    whatsapp_service.process_incoming_batch(batch, 'append')
+
+    with app.app_context():
+        conversation = Conversation.find_by_phone('5511955550002')
+        assert Message.query.filter_by(conversation_id=conversation.id).count() == 3
+        assert conversation.message_count == 3
+        assert conversation.last_message_preview == 'mensagem 2'
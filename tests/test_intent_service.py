@@ -0,0 +1,108 @@
+import pytest
+import ai_service
+import intent_service
+from app import app
+from fake_gemini import FakeGeminiClient
+from model_router_service import ModelRouter
+from models import IntentLabel
+from intent_service import IntentClassifier, intent_classifier, prompt_hash, normalize_question
+
+def _trained_classifier(tmp_path, samples):
+    classifier = IntentClassifier(path=str(tmp_path / 'intent_model.json'))
+    classifier._models = classifier._fit([
+        (prompt_hash(text), text, intent, 'gemini') for text, intent in samples
+    ])
+    classifier._loaded = True
+    classifier._version = classifier._version_token.get()
+    return classifier
+
+PAYMENT = {'tipo': 'pedido', 'urgencia': 'baixo', 'requer_humano': False}
+SHIPPING = {'tipo': 'reclamacao', 'urgencia': 'medio', 'requer_humano': True}
+
+@pytest.mark.parametrize('message, expected', [
+    ('Bom dia!', {'tipo': 'saudacao', 'urgencia': 'baixo', 'requer_humano': False}),
+    ('O produto chegou quebrado', {'tipo': 'reclamacao', 'urgencia': 'medio', 'requer_humano': True}),
+    ('Oi, quero encomendar um bolo', {'tipo': 'pedido', 'urgencia': 'baixo', 'requer_humano': False}),
+    ('Preciso falar com um atendente urgente', {'tipo': 'pedido', 'urgencia': 'alto', 'requer_humano': True}),
+    ('Vocês abrem no feriado?', {'tipo': 'pergunta', 'urgencia': 'baixo', 'requer_humano': False}),
+])
+def test_keyword_rules_decide_without_a_model(message, expected):
+    intent, confident = IntentClassifier(path='/nonexistent/intent_model.json').classify(message)
+    assert confident
+    assert intent == dict(expected, origem='regras', confianca=1.0)
+
+def test_rules_leave_long_or_ambiguous_messages_undecided():
+    classifier = IntentClassifier(path='/nonexistent/intent_model.json')
+    assert classifier.rules('oi tudo bem meu pedido 123 ainda está em separação no depósito') is None
+    assert classifier.rules('xpto 123 lorem') is None
+    assert classifier.classify('xpto 123 lorem') == (dict(intent_service.DEFAULT_INTENT, origem='padrao', confianca=0.0), False)
+
+def test_model_answers_only_above_the_confidence_threshold(tmp_path):
+    classifier = _trained_classifier(tmp_path, [('pix cartão boleto', PAYMENT)] * 20 + [('entrega extraviada', SHIPPING)] * 20)
+
+    intent, confident = classifier.classify('pix boleto')
+    assert intent['origem'] == 'modelo' and intent['tipo'] == 'pedido'
+    assert confident and intent['confianca'] >= classifier.CONFIDENCE
+
+    classifier.CONFIDENCE = 1.0
+    intent, confident = classifier.classify('pix boleto')
+    assert intent['tipo'] == 'pedido' and not confident
+
+def test_uncertain_message_goes_to_gemini_and_is_stored_as_label(monkeypatch):
+    backend = FakeGeminiClient(latency=0, reply='{"tipo": "pedido", "urgencia": "medio", "requer_humano": false}')
+    monkeypatch.setattr(ai_service, 'client', backend)
+    before = intent_classifier.get_stats()['gemini']
+
+    intent = ai_service.analyze_message_intent('segunda via da nota 4471')
+
+    assert intent == {'tipo': 'pedido', 'urgencia': 'medio', 'requer_humano': False, 'origem': 'gemini', 'confianca': 1.0}
+    assert intent_classifier.get_stats()['gemini'] == before + 1
+    assert backend.calls[0][1] == 'gemini-2.5-flash-lite'
+    with app.app_context():
+        label = IntentLabel.query.filter_by(text_key=prompt_hash(normalize_question('segunda via da nota 4471'))).one()
+        assert (label.tipo, label.urgencia, label.requer_humano) == ('pedido', 'medio', False)
+
+def test_invalid_gemini_answer_and_reply_path_fall_back_to_the_local_guess(monkeypatch):
+    backend = FakeGeminiClient(latency=0, reply='não sei')
+    monkeypatch.setattr(ai_service, 'client', backend)
+    before = intent_classifier.get_stats()['fallback']
+
+    assert ai_service.analyze_message_intent('xpto 123 lorem')['origem'] == 'padrao'
+    assert len(backend.calls) == 1
+
+    # Reply path: never waits on Gemini
+    assert ai_service.analyze_message_intent('xpto 456 lorem', escalate=False)['origem'] == 'padrao'
+    assert len(backend.calls) == 1
+    assert intent_classifier.get_stats()['fallback'] == before + 2
+
+    # Confident local answers never reach Gemini either
+    assert ai_service.analyze_message_intent('Boa tarde!')['origem'] == 'regras'
+    assert len(backend.calls) == 1
+
+def test_router_uses_a_confident_intent_and_ignores_an_uncertain_one():
+    router = ModelRouter()
+    greeting = {'tipo': 'saudacao', 'urgencia': 'baixo', 'requer_humano': False}
+
+    # The keyword rules read "?" as a question; a confident model knows it is a greeting
+    assert router.route('salve, beleza?', 1) == 'full'
+    assert router.route('salve, beleza?', 1, dict(greeting, origem='modelo', confianca=0.97)) == 'lite'
+    assert router.route('salve, beleza?', 1, dict(greeting, origem='modelo', confianca=0.5)) == 'full'
+    assert router.route('salve, beleza?', 2, dict(greeting, origem='gemini', confianca=1.0)) == 'full'
+
+def test_inbound_reply_is_routed_with_the_local_intent(monkeypatch):
+    import whatsapp_service as whatsapp_module
+    from models import Conversation
+
+    backend = FakeGeminiClient(latency=0)
+    monkeypatch.setattr(ai_service, 'client', backend)
+    started = []
+    monkeypatch.setattr(whatsapp_module, 'stream_ai_response',
+                        lambda message, history, on_chunk, summary, count, intent=None: started.append(intent))
+
+    conversation = Conversation(phone_number='5511988880001', message_count=1)
+    whatsapp_module.whatsapp_service._start_ai_response('Bom dia!', conversation, on_chunk=print, queued_count=1)
+    whatsapp_module.whatsapp_service._start_ai_response('xpto 123 lorem', conversation, on_chunk=print, queued_count=1)
+    whatsapp_module.whatsapp_service._start_ai_response('oi', conversation, on_chunk=print, queued_count=3)
+
+    assert [intent and intent['origem'] for intent in started] == ['regras', 'padrao', None]
+    assert backend.calls == []  # No Gemini round trip before the reply
@@ -0,0 +1,21 @@
+from app import app, db
+from migrations import MIGRATIONS, run_migrations, check_query_plans
+
+def test_migrations_are_current_and_idempotent():
+    with app.app_context():
+        assert run_migrations(db.engine) == MIGRATIONS[-1][0]
+        assert run_migrations(db.engine) == MIGRATIONS[-1][0]
+
+def test_hot_queries_use_indexes():
+    with app.app_context():
+        run_migrations(db.engine)
+        assert check_query_plans(db.engine) == {}
+
+def test_plan_check_detects_a_missing_index(tmp_path):
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'plans.db'}")
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_message_conversation_id"))
+    assert 'recent history' in check_query_plans(engine)
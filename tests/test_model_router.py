@@ -0,0 +1,52 @@
+import asyncio
+import time
+import ai_engine_service
+from ai_engine_service import ai_engine
+from model_router_service import ModelRouter
+from rate_limit_service import GeminiRateLimiter
+
+class FakeResponse:
+    text = 'ok'
+    usage_metadata = None
+
+class FakeClient:
+    """client.aio.models.generate_content that answers after `latency` seconds"""
+
+    def __init__(self, latency: float = 0.0):
+        self.aio = self
+        self.models = self
+        self.latency = latency
+        self.calls = []
+
+    async def generate_content(self, model, contents, config=None):
+        self.calls.append(model)
+        await asyncio.sleep(self.latency)
+        return FakeResponse()
+
+def _router() -> ModelRouter:
+    router = ModelRouter()
+    router.HEDGE_AFTER = 0.2
+    return router
+
+def test_throttled_primary_does_not_hedge(monkeypatch):
+    limiter = GeminiRateLimiter(rpm=60, tpm=10 ** 6)
+    monkeypatch.setattr(ai_engine_service, 'rate_limiter', limiter)
+    ai_engine.run(limiter.acquire(1))  # Drain the bucket: the next call waits ~1s for quota
+
+    router, client = _router(), FakeClient()
+    started = time.monotonic()
+    response = ai_engine.run(router.generate('full', lambda model: ai_engine.generate_content(client, model, 'oi')))
+
+    assert response.text == 'ok'
+    assert time.monotonic() - started > 0.5  # Waited in the limiter well past HEDGE_AFTER
+    assert router.get_stats()['tiers']['full']['hedges_fired'] == 0
+    assert client.calls == ['gemini-2.5-flash']
+
+def test_slow_primary_after_dispatch_hedges(monkeypatch):
+    monkeypatch.setattr(ai_engine_service, 'rate_limiter', GeminiRateLimiter(rpm=6000, tpm=10 ** 6))
+
+    router, client = _router(), FakeClient(latency=0.5)
+    ai_engine.run(router.generate('full', lambda model: ai_engine.generate_content(client, model, 'oi')))
+
+    assert router.get_stats()['tiers']['full']['hedges_fired'] == 1
+    assert client.calls == ['gemini-2.5-flash', 'gemini-2.5-flash-lite']
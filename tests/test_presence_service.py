@@ -0,0 +1,107 @@
+import threading
+import time
+from presence_service import PresenceManager
+
+class RecordingSender:
+    def __init__(self, success=True):
+        self.calls = []
+        self.success = success
+        self._lock = threading.Lock()
+
+    def __call__(self, phone, composing):
+        with self._lock:
+            self.calls.append((phone, composing))
+        return {'success': self.success}
+
+def _settle(manager, timeout=2):
+    """Wait until the presence thread has nothing left to send"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with manager._condition:
+            if not manager._dirty:
+                break
+        time.sleep(0.01)
+    time.sleep(0.05)  # Let the last in-flight _flush finish
+
+def test_repeated_composing_is_sent_once():
+    sender = RecordingSender()
+    manager = PresenceManager(sender, composing_ttl=30)
+
+    for _ in range(20):
+        manager.composing('5511911110001')
+    _settle(manager)
+
+    assert sender.calls == [('5511911110001', True)]
+    stats = manager.get_stats()
+    assert stats['issued'] == 1 and stats['composing'] == 1
+    assert manager.is_composing('5511911110001')
+
+def test_paused_is_sent_once_and_only_after_composing():
+    sender = RecordingSender()
+    manager = PresenceManager(sender, composing_ttl=30)
+
+    manager.paused('5511911110002')  # Never composing: nothing to clear
+    _settle(manager)
+    assert sender.calls == []
+
+    manager.composing('5511911110002')
+    _settle(manager)
+    manager.paused('5511911110002')
+    manager.paused('5511911110002')
+    _settle(manager)
+
+    assert sender.calls == [('5511911110002', True), ('5511911110002', False)]
+    assert manager.get_stats()['coalesced'] >= 1
+    assert not manager.is_composing('5511911110002')
+
+def test_sent_message_clears_composing_without_a_call():
+    sender = RecordingSender()
+    manager = PresenceManager(sender, composing_ttl=30)
+
+    manager.composing('5511911110003')
+    _settle(manager)
+    manager.message_sent('5511911110003')
+    manager.paused('5511911110003')  # WhatsApp already cleared it
+    _settle(manager)
+    assert sender.calls == [('5511911110003', True)]
+
+    manager.composing('5511911110003')  # Next reply: typing again
+    _settle(manager)
+    assert sender.calls == [('5511911110003', True), ('5511911110003', True)]
+
+def test_composing_expires_after_the_ttl():
+    sender = RecordingSender()
+    manager = PresenceManager(sender, composing_ttl=0.1)
+
+    manager.composing('5511911110004')
+    time.sleep(0.3)
+    _settle(manager)
+
+    assert sender.calls == [('5511911110004', True), ('5511911110004', False)]
+    assert manager.get_stats()['composing'] == 0
+
+def test_failed_send_is_retried_on_the_next_transition():
+    sender = RecordingSender(success=False)
+    manager = PresenceManager(sender, composing_ttl=30)
+
+    manager.composing('5511911110005')
+    _settle(manager)
+    assert manager.get_stats()['failed'] == 1
+
+    sender.success = True
+    manager.composing('5511911110005')
+    _settle(manager)
+    assert sender.calls == [('5511911110005', True), ('5511911110005', True)]
+    assert manager.get_stats()['composing'] == 1
+
+def test_each_phone_in_a_burst_gets_its_own_single_call():
+    sender = RecordingSender()
+    manager = PresenceManager(sender, composing_ttl=30)
+    phones = [f'55119222200{index:02d}' for index in range(10)]
+
+    for _ in range(5):
+        for phone in phones:
+            manager.composing(phone)
+    _settle(manager)
+
+    assert sorted(sender.calls) == [(phone, True) for phone in phones]
@@ -0,0 +1,64 @@
+import os
+import time
+import uuid
+import pytest
+from queue_state_service import SQLiteQueueState, RedisQueueState, QueueFlusher
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def state(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteQueueState(path=str(tmp_path / 'queue_state.db'))
+    pytest.importorskip('redis')
+    url = os.environ.get('QUEUE_STATE_TEST_REDIS_URL')
+    if not url:
+        pytest.skip('QUEUE_STATE_TEST_REDIS_URL não definido')
+    return RedisQueueState(url, prefix=f"asa-test:{uuid.uuid4().hex[:8]}")
+
+def test_burst_is_claimed_by_one_owner_and_in_order(state):
+    state.append({'5511900000001': [(1, 'oi'), (1, 'tudo bem?')]}, time.time())
+
+    assert state.claim_due('worker-a', 30) == ['5511900000001']
+    assert state.claim_due('worker-b', 30) == []
+    assert [item['content'] for item in state.take('5511900000001')] == ['oi', 'tudo bem?']
+
+    # Nova rajada durante a resposta fica para depois do release
+    state.append({'5511900000001': [(1, 'e o preço?')]}, time.time())
+    assert state.claim_due('worker-b', 30) == []
+    assert state.release('5511900000001', 'worker-a') is True
+    assert state.claim_due('worker-b', 30) == ['5511900000001']
+
+    stats = state.get_stats()
+    assert {'backend', 'queued_messages', 'waiting_phones', 'leased_phones'} <= stats.keys()
+    assert stats['queued_messages'] == 1 and stats['leased_phones'] == 1
+
+def test_expired_lease_lets_another_owner_claim(state):
+    state.append({'5511900000002': [(2, 'oi')]}, time.time())
+    assert state.claim_due('worker-a', 0.2) == ['5511900000002']
+    state.append({'5511900000002': [(2, 'ainda aí?')]}, time.time())
+
+    time.sleep(0.3)
+    # worker-a morreu: seu lease venceu e não pode mais ser renovado
+    assert state.renew(['5511900000002'], 'worker-a', 30) == []
+    assert state.claim_due('worker-b', 30) == ['5511900000002']
+
+def test_flusher_renews_the_lease_while_the_reply_is_in_flight(tmp_path):
+    state = SQLiteQueueState(path=str(tmp_path / 'queue_state.db'))
+    flusher = QueueFlusher(state, lease_seconds=0.3)
+    flusher.POLL_INTERVAL = 0.05
+    claimed = []
+    flusher.start(claimed.append)  # Handler não libera: resposta ainda em andamento
+
+    state.append({'5511900000003': [(3, 'oi')]}, time.time())
+    deadline = time.monotonic() + 2
+    while not claimed and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert claimed == ['5511900000003']
+
+    state.append({'5511900000003': [(3, 'segunda rajada')]}, time.time())
+    time.sleep(1.0)  # Mais de três vezes o lease
+    assert state.claim_due('worker-b', 30) == []
+    assert flusher.get_stats()['renewed'] > 0
+
+    flusher.MAX_HOLD_SECONDS = 0  # Resposta presa: para de renovar, o lease vence e a rajada é reivindicada de novo
+    time.sleep(0.8)
+    assert claimed == ['5511900000003', '5511900000003']
@@ -0,0 +1,35 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from rate_limit_service import GeminiRateLimiter
+
+def test_shared_state_lock_does_not_block_the_event_loop(tmp_path):
+    path = str(tmp_path / 'rate_limit.db')
+    limiter = GeminiRateLimiter(rpm=6000, tpm=10 ** 7, path=path)
+
+    # Another worker holds the write lock for a second
+    other_worker = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    other_worker.execute("BEGIN IMMEDIATE")
+    threading.Timer(1.0, lambda: other_worker.execute("COMMIT")).start()
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.05)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        started = time.monotonic()
+        await limiter.acquire(10)
+        await limiter.record_success(10, 12)
+        task.cancel()
+        return time.monotonic() - started, ticks
+
+    elapsed, ticks = asyncio.run(run())
+    assert elapsed >= 0.9
+    assert ticks >= 10  # The loop kept running while the transaction waited
+    assert limiter.get_stats()['granted'] == 1
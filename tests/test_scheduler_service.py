@@ -0,0 +1,121 @@
+import threading
+import time
+import zlib
+from scheduler_service import DeadlineScheduler, ShardedExecutor
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+def test_callbacks_run_in_deadline_order_not_schedule_order():
+    scheduler = DeadlineScheduler(max_workers=1, name='test-order')
+    ran = []
+    for key, delay in (('c', 0.15), ('a', 0.05), ('b', 0.10)):
+        scheduler.schedule(key, delay, ran.append, key)
+
+    assert _wait_for(lambda: len(ran) == 3)
+    assert ran == ['a', 'b', 'c']
+    assert scheduler.pending_count() == 0
+
+def test_rescheduling_a_key_replaces_its_deadline():
+    scheduler = DeadlineScheduler(max_workers=1, name='test-replace')
+    ran = []
+    scheduler.schedule('phone', 0.05, ran.append, 'first')
+    scheduler.schedule('other', 0.10, ran.append, 'other')
+    scheduler.schedule('phone', 0.20, ran.append, 'second')  # Debounce: pushes the deadline back
+
+    assert scheduler.pending_count() == 2
+    assert _wait_for(lambda: len(ran) == 2)
+    time.sleep(0.1)
+    assert ran == ['other', 'second']
+
+def test_cancelled_key_never_runs():
+    scheduler = DeadlineScheduler(max_workers=1, name='test-cancel')
+    ran = []
+    scheduler.schedule('keep', 0.1, ran.append, 'keep')
+    scheduler.schedule('drop', 0.05, ran.append, 'drop')
+
+    assert scheduler.is_pending('drop')
+    assert scheduler.cancel('drop') is True
+    assert scheduler.cancel('drop') is False
+    assert not scheduler.is_pending('drop')
+
+    assert _wait_for(lambda: ran == ['keep'])
+    time.sleep(0.1)
+    assert ran == ['keep']
+    assert scheduler.get_stats()['heap_size'] == 0  # The stale heap entry was discarded
+
+def test_earlier_deadline_wakes_the_scheduler_thread():
+    scheduler = DeadlineScheduler(max_workers=1, name='test-wakeup')
+    fired = threading.Event()
+    scheduler.schedule('late', 30, fired.set)
+    started = time.monotonic()
+    scheduler.schedule('soon', 0.05, fired.set)
+
+    assert fired.wait(2)
+    assert time.monotonic() - started < 1
+    assert scheduler.is_pending('late')
+    scheduler.cancel('late')
+
+def test_failing_callback_does_not_stop_the_scheduler():
+    scheduler = DeadlineScheduler(max_workers=1, name='test-errors')
+    ran = []
+    scheduler.schedule('boom', 0, lambda: 1 / 0)
+    scheduler.schedule('after', 0.05, ran.append, 'after')
+    assert _wait_for(lambda: ran == ['after'])
+
+def test_same_phone_always_lands_on_the_same_lane():
+    executor = ShardedExecutor(8, name='test-affinity')
+    phones = [f'55119{index:08d}' for index in range(200)]
+
+    lanes = {phone: executor.lane_for(phone) for phone in phones}
+    assert all(executor.lane_for(phone) == lanes[phone] for phone in phones)
+    # Stable across processes (crc32, not the salted str hash)
+    assert all(lane == zlib.crc32(phone.encode('utf-8')) % 8 for phone, lane in lanes.items())
+    assert len(set(lanes.values())) == 8  # Different conversations spread over every lane
+
+def test_tasks_of_one_phone_run_in_order_without_overlapping():
+    executor = ShardedExecutor(4, name='test-serial')
+    running, overlaps, ran = {}, [], []
+    lock = threading.Lock()
+
+    def task(phone, index):
+        with lock:
+            if running.get(phone):
+                overlaps.append(phone)
+            running[phone] = True
+        time.sleep(0.005)
+        with lock:
+            running[phone] = False
+            ran.append((phone, index))
+
+    phones = ['5511900000001', '5511900000002', '5511900000003', '5511900000004', '5511900000005']
+    for index in range(10):
+        for phone in phones:
+            executor.submit(phone, task, phone, index)
+
+    assert _wait_for(lambda: len(ran) == 50)
+    assert overlaps == []
+    for phone in phones:
+        assert [index for ran_phone, index in ran if ran_phone == phone] == list(range(10))
+
+def test_sharded_scheduler_routes_every_key_kind_of_a_phone_to_its_lane():
+    shard_by = lambda key: key[1] if isinstance(key, tuple) else key
+    scheduler = DeadlineScheduler(max_workers=4, name='test-shard', shard_by=shard_by)
+    calls = []
+
+    def record(key):
+        calls.append((shard_by(key), threading.current_thread().name))
+
+    keys = ['5511900000001', ('send', '5511900000001', 1), ('release', '5511900000001', 2),
+            '5511900000002', ('send', '5511900000002', 3)]
+    for key in keys:
+        scheduler.schedule(key, 0, record, key)
+
+    assert _wait_for(lambda: len(calls) == len(keys))
+    for phone, thread_name in calls:
+        assert thread_name == f"test-shard-lane-{scheduler._lanes.lane_for(phone)}"
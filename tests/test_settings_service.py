@@ -0,0 +1,67 @@
+import time
+from app import app, db
+from autoresponse_service import AutoResponseMatcher
+from intent_service import IntentClassifier
+from models import AutoResponse, SystemSettings
+from settings_service import SettingsCache, VersionToken
+
+CHECK_INTERVAL = 0.3
+
+def _settings_version():
+    with app.app_context():
+        return db.session.query(SystemSettings.setting_value).filter_by(setting_key='settings_version').scalar()
+
+def _seen_within_check_interval(read, expected):
+    """Poll `read` until it returns `expected`; fail after CHECK_INTERVAL plus a margin"""
+    deadline = time.monotonic() + CHECK_INTERVAL + 0.2
+    while time.monotonic() < deadline:
+        if read() == expected:
+            return True
+        time.sleep(0.02)
+    return False
+
+def test_version_token_reaches_other_workers_without_touching_settings():
+    worker_a = VersionToken('test_cache_version', check_interval=CHECK_INTERVAL)
+    worker_b = VersionToken('test_cache_version', check_interval=CHECK_INTERVAL)
+    settings_version = _settings_version()
+    before = worker_b.get()
+
+    token = worker_a.bump()
+    assert worker_a.get() == token
+    assert worker_b.get() == before  # Cached until the next check
+    assert _seen_within_check_interval(worker_b.get, token)
+
+    assert _settings_version() == settings_version
+    cache = SettingsCache(check_interval=0)
+    assert cache.get_raw('test_cache_version') is None  # Token rows are not settings
+
+def test_auto_response_change_in_one_worker_is_seen_by_another():
+    worker_a, worker_b = AutoResponseMatcher(), AutoResponseMatcher()
+    for matcher in (worker_a, worker_b):
+        matcher._version_token.CHECK_INTERVAL = CHECK_INTERVAL
+    settings_version = _settings_version()
+    reply = lambda matcher: getattr(matcher.match('qual o horario do plantao?', False), 'text', None)
+    assert reply(worker_b) != 'Plantão das 8h às 22h.'
+
+    with app.app_context():
+        db.session.add(AutoResponse(trigger_keyword='plantão', response_text='Plantão das 8h às 22h.',
+                                    trigger_type='follow_up'))
+        db.session.commit()
+    worker_a.notify_changed()
+
+    assert reply(worker_a) == 'Plantão das 8h às 22h.'
+    assert _seen_within_check_interval(lambda: reply(worker_b), 'Plantão das 8h às 22h.')
+    assert _settings_version() == settings_version
+
+def test_intent_model_trained_in_one_worker_is_loaded_by_another(tmp_path):
+    path = str(tmp_path / 'intent_model.json')
+    worker_a, worker_b = IntentClassifier(path=path), IntentClassifier(path=path)
+    for classifier in (worker_a, worker_b):
+        classifier._version_token.CHECK_INTERVAL = CHECK_INTERVAL
+    worker_a.record_label('segunda via do boleto', {'tipo': 'pedido', 'urgencia': 'baixo', 'requer_humano': False})
+    assert worker_b._current_models() is None  # Nothing saved yet
+
+    worker_a.train(save=True)
+
+    assert worker_a._current_models() is not None
+    assert _seen_within_check_interval(lambda: worker_b._current_models() is not None, True)
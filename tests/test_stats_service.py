@@ -0,0 +1,71 @@
+from app import app, db
+from models import Conversation, Message, Statistic
+from stats_service import StatsCounters, stats_counters
+from whatsapp_service import whatsapp_service
+
+def _stored(key):
+    with app.app_context():
+        return db.session.get(Statistic, key).value
+
+def test_deltas_are_buffered_until_commit_and_flushed_in_batch():
+    before = stats_counters.get_stats()
+    whatsapp_service.process_incoming_batch([
+        {'phone': '5511955550101', 'message': 'oi', 'message_id': '3EB0STATS0001'},
+        {'phone': '5511955550101', 'message': 'tudo bem?', 'message_id': '3EB0STATS0002'},
+    ], 'append')
+
+    # Visible right away through the local buffer
+    after = stats_counters.get_stats()
+    assert after['messages_in'] == before['messages_in'] + 2
+    assert after['conversations_total'] == before['conversations_total'] + 1
+
+    stats_counters.flush()
+    with app.app_context():
+        assert _stored('messages_in') == Message.query.filter_by(is_from_user=True).count()
+
+    # Rolled back writes never reach the counters
+    with app.app_context():
+        conversation = Conversation.find_by_phone('5511955550101')
+        db.session.add(Message(conversation_id=conversation.id, content='x', is_from_user=True))
+        db.session.flush()
+        db.session.rollback()
+    assert stats_counters.get_stats() == after
+
+def test_missing_counters_are_seeded_with_current_counts():
+    stats_counters.flush()
+    with app.app_context():
+        db.session.delete(db.session.get(Statistic, 'messages_total'))
+        db.session.commit()
+
+    assert stats_counters.seed() == 1
+    with app.app_context():
+        assert _stored('messages_total') == Message.query.count()
+
+def test_reconcile_by_another_worker_drops_deltas_buffered_here(monkeypatch):
+    # Worker A is this process; keep its thread from flushing while worker B reconciles
+    flush_a = lambda: StatsCounters.flush(stats_counters)
+    monkeypatch.setattr(stats_counters, 'flush', lambda: 0)
+    flush_a()
+
+    whatsapp_service.process_incoming_batch([
+        {'phone': '5511955550102', 'message': 'oi', 'message_id': '3EB0STATS0101'},
+        {'phone': '5511955550102', 'message': 'alguém aí?', 'message_id': '3EB0STATS0102'},
+    ], 'append')
+    assert stats_counters._pending  # Still buffered in worker A
+
+    worker_b = StatsCounters()
+    worker_b.reconcile()  # COUNT(*) already includes A's two messages
+    with app.app_context():
+        expected = Message.query.filter_by(is_from_user=True).count()
+    assert stats_counters.get_stats()['messages_in'] == expected
+
+    flush_a()
+    assert _stored('messages_in') == expected  # Not counted twice
+
+    # Writes after the reconcile are applied normally
+    whatsapp_service.process_incoming_batch([
+        {'phone': '5511955550102', 'message': 'olá de novo', 'message_id': '3EB0STATS0103'},
+    ], 'append')
+    flush_a()
+    assert _stored('messages_in') == expected + 1
+    assert worker_b.get_stats()['messages_in'] == expected + 1
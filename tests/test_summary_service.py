@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+import ai_service
+from app import app, db
+from fake_gemini import FakeGeminiClient
+from models import Conversation, Message
+from summary_service import conversation_summarizer
+
+def _conversation_with_messages(phone, count):
+    with app.app_context():
+        conversation = Conversation(phone_number=phone)
+        db.session.add(conversation)
+        db.session.flush()
+        start = datetime(2026, 1, 5, 12, 0)
+        for i in range(count):
+            message = Message(conversation_id=conversation.id, content=f'mensagem {i}', is_from_user=i % 2 == 0,
+                              timestamp=start + timedelta(minutes=i))
+            db.session.add(message)
+            conversation.record_message(message)
+        db.session.commit()
+        return conversation.id
+
+def test_update_summarizes_the_last_batch_on_the_lite_tier(monkeypatch):
+    backend = FakeGeminiClient(latency=0, reply='Cliente perguntou sobre prazos.')
+    monkeypatch.setattr(ai_service, 'client', backend)
+    conversation_id = _conversation_with_messages('5511977770001', 80)
+
+    conversation_summarizer._update(conversation_id)
+
+    assert [call[1] for call in backend.calls if call[0] == 'generate_content'] == ['gemini-2.5-flash-lite']
+    with app.app_context():
+        conversation = db.session.get(Conversation, conversation_id)
+        ids = [message.id for message in Message.query.filter_by(conversation_id=conversation_id).order_by(Message.id)]
+        assert conversation.summary == 'Cliente perguntou sobre prazos.'
+        # Everything up to the boundary counts as covered, so maybe_update stops firing
+        assert conversation.summary_message_id == ids[80 - conversation_summarizer.RECENT_WINDOW - 1]
+        assert conversation.summary_message_count == 80 - conversation_summarizer.RECENT_WINDOW
+
+def test_recent_history_follows_the_summary_boundary_order():
+    conversation_id = _conversation_with_messages('5511977770002', 6)
+    with app.app_context():
+        conversation = db.session.get(Conversation, conversation_id)
+        # Resynced history: stored later, with an older WhatsApp timestamp
+        late = Message(conversation_id=conversation_id, content='antiga', is_from_user=True,
+                       timestamp=datetime(2025, 12, 1))
+        db.session.add(late)
+        conversation.record_message(late)
+        conversation.summary_message_id = Message.query.filter_by(conversation_id=conversation_id) \
+            .order_by(Message.id).offset(2).first().id
+        db.session.commit()
+
+        history = conversation_summarizer.recent_history(conversation)
+        assert [message.content for message in history] == [
+            'mensagem 3', 'mensagem 4', 'mensagem 5', 'antiga'
+        ]
@@ -0,0 +1,82 @@
+import time
+import pytest
+import ai_service
+import whatsapp_service as whatsapp_module
+from app import app, db
+from ai_service import _resolved, ReplyChunker, stream_ai_response
+from models import Conversation, Message
+from whatsapp_service import ReplyStream, whatsapp_service
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(0.02)
+    raise AssertionError('condition not met in time')
+
+@pytest.fixture
+def sent(monkeypatch):
+    sent = []
+    monkeypatch.setattr(whatsapp_module.baileys_service, 'send_message',
+                        lambda phone, text: sent.append((phone, text)) or {'success': True})
+    monkeypatch.setattr(whatsapp_service, 'TYPING_DELAY', 0)
+    return sent
+
+def _conversation(phone):
+    with app.app_context():
+        conversation = Conversation(phone_number=phone)
+        db.session.add(conversation)
+        db.session.commit()
+        return conversation.id
+
+def _replies(conversation_id):
+    with app.app_context():
+        return [(message.content, message.response_type)
+                for message in Message.query.filter_by(conversation_id=conversation_id, is_from_user=False)]
+
+def test_streamed_pieces_are_sent_one_by_one_and_saved_as_one_message(sent):
+    phone = '5511966660001'
+    conversation_id = _conversation(phone)
+    stream = ReplyStream(whatsapp_service, conversation_id, phone)
+
+    for piece in ('Olá! Temos sim.', 'O prazo é de 3 dias úteis.', 'Posso ajudar em algo mais?'):
+        stream.push(piece)
+    _wait_for(lambda: len(sent) == 3)
+    assert _replies(conversation_id) == []  # Nada é salvo antes do fim da geração
+
+    stream.finish()
+    replies = _wait_for(lambda: _replies(conversation_id))
+    assert replies == [('Olá! Temos sim.\n\nO prazo é de 3 dias úteis.\n\nPosso ajudar em algo mais?', 'ai')]
+    assert [text for _, text in sent] == ['Olá! Temos sim.', 'O prazo é de 3 dias úteis.', 'Posso ajudar em algo mais?']
+    with app.app_context():
+        assert db.session.get(Conversation, conversation_id).message_count == 1
+
+def test_unavailable_streamed_reply_falls_back_like_the_queue(sent, monkeypatch):
+    phone = '5511966660002'
+    conversation_id = _conversation(phone)
+    monkeypatch.setattr(whatsapp_service, '_try_automatic_response', lambda message, conversation: None)
+    monkeypatch.setattr(whatsapp_service, '_release_conversation', lambda phone_number, delay: None)
+    unavailable = 'Desculpe, o serviço de IA não está disponível no momento.'
+
+    stream = ReplyStream(whatsapp_service, conversation_id, phone)
+    stream.push(unavailable)
+    assert stream.rejected and stream.received == 0
+    whatsapp_service._finish_queue_response(conversation_id, phone, 'oi', _resolved(unavailable), stream)
+
+    content, response_type = _wait_for(lambda: _replies(conversation_id))[0]
+    assert response_type == 'fallback'
+    assert [text for _, text in sent] == [content]
+
+def test_cached_reply_is_streamed_in_whatsapp_sized_pieces(monkeypatch):
+    cached = ' '.join(f'Frase número {i} da resposta guardada no cache.' for i in range(60))
+    monkeypatch.setattr(ai_service, '_prepare_request', lambda *args: (cached, None, None))
+    pieces = []
+
+    assert stream_ai_response('pergunta', on_chunk=pieces.append).result() == cached
+
+    chunker = ReplyChunker()
+    assert len(pieces) > 1
+    assert pieces == chunker.feed(cached) + chunker.flush()
+    assert all(len(piece) <= chunker.MAX_CHARS for piece in pieces)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Treinar o classificador local de intenção e mostrar o relatório
+
+Uso:
+    python train_intent.py           # treina com o histórico de mensagens e os
+                                     # rótulos do Gemini, salva o modelo e publica
+                                     # a nova versão para os workers
+    python train_intent.py --report  # só avalia, sem salvar o modelo
+    python train_intent.py --label 200
+                                     # antes de treinar, pede ao Gemini o rótulo
+                                     # de até 200 mensagens recentes que o
+                                     # classificador local não decide
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from intent_service import intent_classifier
+
+def print_report(report: dict):
+    """Mostrar acurácia, cobertura local e latência"""
+    reference = 'rótulos do Gemini' if report['reference'] == 'gemini' else 'rótulos das regras (sem rótulos do Gemini ainda)'
+    print(f"📊 {report['train_examples']} exemplos de treino, {report['test_examples']} de avaliação ({reference})")
+    if not report['test_examples']:
+        print("⚠️ Sem exemplos para avaliar")
+        return
+
+    accuracy = report['accuracy']
+    print(f"  acurácia: tipo={accuracy['tipo']:.1%}  urgência={accuracy['urgencia']:.1%}  "
+          f"requer humano={accuracy['requer_humano']:.1%}  tudo certo={accuracy['all']:.1%}")
+    local_accuracy = report['local_accuracy']
+    print(f"  resolvidas localmente: {report['local_coverage']:.1%} "
+          f"(regras={report['resolved_by']['regras']}, modelo={report['resolved_by']['modelo']}), "
+          f"acurácia local={'-' if local_accuracy is None else f'{local_accuracy:.1%}'}")
+    print(f"  latência local: média={report['latency_ms']['mean']}ms  p95={report['latency_ms']['p95']}ms")
+
+def label_uncertain(limit: int) -> int:
+    """Rotular com o Gemini as mensagens incertas mais recentes; retorna quantas foram rotuladas"""
+    from ai_service import analyze_message_intent
+
+    labeled = 0
+    for message in intent_classifier.uncertain_messages(limit):
+        if analyze_message_intent(message).get('origem') == 'gemini':
+            labeled += 1
+    return labeled
+
+if __name__ == '__main__':
+    report_only = '--report' in sys.argv
+    if '--label' in sys.argv:
+        position = sys.argv.index('--label') + 1
+        limit = int(sys.argv[position]) if position < len(sys.argv) else 100
+        print(f"🏷️ {label_uncertain(limit)} mensagens rotuladas pelo Gemini")
+    report = intent_classifier.train(save=not report_only)
+    print_report(report)
+    if report.get('saved'):
+        print(f"✅ Modelo salvo em {report['saved']}")
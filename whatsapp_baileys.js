@@ -81,11 +81,13 @@ async function connectToWhatsApp() {
         // Salvar credenciais quando atualizadas
         socket.ev.on('creds.update', saveCreds);
 
-        // Receber mensagens
+        // Receber mensagens (todas as mensagens do lote, não só a primeira)
         socket.ev.on('messages.upsert', async (m) => {
-            const message = m.messages[0];
+            const incoming = [];
             
-            if (!message.key.fromMe && message.message) {
+            for (const message of m.messages || []) {
+                if (message.key.fromMe || !message.message) continue;
+                
                 const phoneNumber = message.key.remoteJid;
                 const messageText = message.message.conversation || 
                                  message.message.extendedTextMessage?.text || '';
@@ -93,16 +95,23 @@ async function connectToWhatsApp() {
                 if (messageText) {
                     console.log(`📨 Mensagem recebida de ${phoneNumber}: ${messageText}`);
                     
-                    // Enviar para Flask processar
-                    await notifyFlask('/webhook/message-received', {
+                    incoming.push({
                         phone: phoneNumber.replace('@s.whatsapp.net', ''),
                         message: messageText,
                         contact_name: message.pushName || '',
                         message_id: message.key.id,
-                        timestamp: new Date().toISOString()
+                        // Hora do envio no WhatsApp (não a do recebimento), como no whatsapp_baileys_simple.js
+                        timestamp: message.messageTimestamp
+                            ? new Date(Number(message.messageTimestamp) * 1000).toISOString()
+                            : new Date().toISOString()
                     });
                 }
             }
+            
+            // Enviar o lote inteiro para Flask processar
+            if (incoming.length > 0) {
+                await notifyFlask('/api/messages-received', { type: m.type, messages: incoming });
+            }
         });
 
     } catch (error) {
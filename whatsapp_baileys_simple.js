@@ -93,11 +93,14 @@ async function connectToWhatsApp() {
         // Salvar credenciais
         socket.ev.on('creds.update', saveCreds);
 
-        // Receber mensagens
+        // Receber mensagens (todas as mensagens do lote, não só a primeira)
         socket.ev.on('messages.upsert', async (m) => {
-            const message = m.messages[0];
+            const incoming = [];
+            const manualReplies = [];
             
-            if (message.message) {
+            for (const message of m.messages || []) {
+                if (!message.message) continue;
+                
                 const phoneNumber = message.key.remoteJid;
                 
                 // Extrair texto da mensagem
@@ -108,46 +111,59 @@ async function connectToWhatsApp() {
                     messageText = message.message.extendedTextMessage.text;
                 }
                 
-                if (messageText && phoneNumber) {
-                    const cleanPhone = phoneNumber.replace('@s.whatsapp.net', '');
+                if (!messageText || !phoneNumber) continue;
+                
+                const cleanPhone = phoneNumber.replace('@s.whatsapp.net', '');
+                
+                if (!message.key.fromMe) {
+                    // Mensagem de cliente para nós
+                    console.log(`📨 Mensagem de ${cleanPhone}: ${messageText}`);
                     
-                    if (!message.key.fromMe) {
-                        // Mensagem de cliente para nós
-                        console.log(`📨 Mensagem de ${cleanPhone}: ${messageText}`);
+                    incoming.push({
+                        phone: cleanPhone,
+                        message: messageText,
+                        contact_name: message.pushName || '',
+                        message_id: message.key.id,
+                        timestamp: message.messageTimestamp
+                            ? new Date(Number(message.messageTimestamp) * 1000).toISOString()
+                            : new Date().toISOString(),
+                        is_from_user: true
+                    });
+                } else {
+                    // Mensagem nossa para cliente - verificar se é manual ou automática
+                    const messageHash = `${cleanPhone}:${messageText}`;
+                    
+                    if (sentBySystem.has(messageHash)) {
+                        // Mensagem enviada automaticamente pelo sistema - remover do rastreamento
+                        sentBySystem.delete(messageHash);
+                        console.log(`🤖 Mensagem automática confirmada para ${cleanPhone}: ${messageText}`);
+                    } else if (m.type === 'notify') {
+                        // Mensagem manual do humano - pausar IA (histórico sincronizado não conta)
+                        console.log(`👤 Resposta manual detectada para ${cleanPhone}: ${messageText}`);
                         
-                        // Enviar para Flask processar
-                        await notifyFlask('/api/message-received', {
+                        manualReplies.push({
                             phone: cleanPhone,
                             message: messageText,
-                            contact_name: message.pushName || '',
-                            message_id: message.key.id,
                             timestamp: new Date().toISOString(),
-                            is_from_user: true
+                            is_from_user: false,
+                            is_manual: true
                         });
-                    } else {
-                        // Mensagem nossa para cliente - verificar se é manual ou automática
-                        const messageHash = `${cleanPhone}:${messageText}`;
-                        
-                        if (sentBySystem.has(messageHash)) {
-                            // Mensagem enviada automaticamente pelo sistema - remover do rastreamento
-                            sentBySystem.delete(messageHash);
-                            console.log(`🤖 Mensagem automática confirmada para ${cleanPhone}: ${messageText}`);
-                        } else {
-                            // Mensagem manual do humano - pausar IA
-                            console.log(`👤 Resposta manual detectada para ${cleanPhone}: ${messageText}`);
-                            
-                            // Notificar Flask que humano respondeu (pausar IA)
-                            await notifyFlask('/api/human-response-detected', {
-                                phone: cleanPhone,
-                                message: messageText,
-                                timestamp: new Date().toISOString(),
-                                is_from_user: false,
-                                is_manual: true
-                            });
-                        }
                     }
                 }
             }
+            
+            // Lote inteiro numa única requisição para o Flask
+            if (incoming.length > 0) {
+                await notifyFlask('/api/messages-received', {
+                    type: m.type,
+                    messages: incoming
+                });
+            }
+            
+            for (const reply of manualReplies) {
+                // Notificar Flask que humano respondeu (pausar IA)
+                await notifyFlask('/api/human-response-detected', reply);
+            }
         });
 
     } catch (error) {
@@ -184,6 +200,30 @@ app.get('/qr', async (req, res) => {
     }
 });
 
+// Converter telefone em JID do WhatsApp
+function toJid(phone) {
+    if (phone.includes('@')) return phone;
+    // Limpar número e adicionar @s.whatsapp.net
+    const cleanPhone = phone.replace(/\D/g, '');
+    return `${cleanPhone}@s.whatsapp.net`;
+}
+
+// Enviar texto marcando como mensagem do sistema
+async function sendSystemText(phone, message) {
+    // Marcar como mensagem enviada pelo sistema
+    const messageHash = `${phone}:${message}`;
+    sentBySystem.add(messageHash);
+    
+    // Remover da lista após 30 segundos (timeout de segurança)
+    setTimeout(() => {
+        sentBySystem.delete(messageHash);
+    }, 30000);
+    
+    await socket.sendMessage(toJid(phone), { text: message });
+}
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
 app.post('/send-message', async (req, res) => {
     const { phone, message } = req.body;
     
@@ -192,23 +232,7 @@ app.post('/send-message', async (req, res) => {
     }
     
     try {
-        let jid = phone;
-        if (!phone.includes('@')) {
-            // Limpar número e adicionar @s.whatsapp.net
-            const cleanPhone = phone.replace(/\D/g, '');
-            jid = `${cleanPhone}@s.whatsapp.net`;
-        }
-        
-        // Marcar como mensagem enviada pelo sistema
-        const messageHash = `${phone}:${message}`;
-        sentBySystem.add(messageHash);
-        
-        // Remover da lista após 30 segundos (timeout de segurança)
-        setTimeout(() => {
-            sentBySystem.delete(messageHash);
-        }, 30000);
-        
-        await socket.sendMessage(jid, { text: message });
+        await sendSystemText(phone, message);
         
         console.log(`🤖 Mensagem automática enviada para ${phone}: ${message}`);
         res.json({ success: true, message: 'Mensagem enviada' });
@@ -218,6 +242,49 @@ app.post('/send-message', async (req, res) => {
     }
 });
 
+// Envio em lote: respeita concorrência e ritmo (mensagens por segundo)
+app.post('/send-bulk', async (req, res) => {
+    const { messages = [], concurrency = 3, rate_per_second = 0 } = req.body;
+    
+    if (!isConnected || !socket) {
+        return res.status(400).json({ error: 'WhatsApp não conectado' });
+    }
+    
+    const results = new Array(messages.length);
+    const minInterval = rate_per_second > 0 ? 1000 / rate_per_second : 0;
+    let nextIndex = 0;
+    let nextSlot = Date.now();
+    
+    async function worker() {
+        while (nextIndex < messages.length) {
+            const index = nextIndex++;
+            const { id, phone, message } = messages[index];
+            
+            // Reservar o próximo horário livre antes de esperar
+            if (minInterval) {
+                const slot = Math.max(nextSlot, Date.now());
+                nextSlot = slot + minInterval;
+                const wait = slot - Date.now();
+                if (wait > 0) await sleep(wait);
+            }
+            
+            try {
+                await sendSystemText(phone, message);
+                results[index] = { id, phone, success: true };
+            } catch (error) {
+                results[index] = { id, phone, success: false, error: error.message };
+            }
+        }
+    }
+    
+    const workers = Math.max(1, Math.min(concurrency, messages.length));
+    await Promise.all(Array.from({ length: workers }, worker));
+    
+    const sent = results.filter(result => result && result.success).length;
+    console.log(`📢 Lote enviado: ${sent}/${messages.length} mensagens`);
+    res.json({ success: true, results });
+});
+
 app.post('/set-typing', async (req, res) => {
     const { phone, typing = true } = req.body;
     
@@ -226,13 +293,7 @@ app.post('/set-typing', async (req, res) => {
     }
     
     try {
-        let jid = phone;
-        if (!phone.includes('@')) {
-            const cleanPhone = phone.replace(/\D/g, '');
-            jid = `${cleanPhone}@s.whatsapp.net`;
-        }
-        
-        await socket.sendPresenceUpdate(typing ? 'composing' : 'paused', jid);
+        await socket.sendPresenceUpdate(typing ? 'composing' : 'paused', toJid(phone));
         res.json({ success: true });
     } catch (error) {
         res.status(500).json({ error: error.message });
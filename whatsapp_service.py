@@ -4,22 +4,141 @@ import logging
 import threading
 import base64
 import asyncio
-from datetime import datetime
+import itertools
+from collections import deque
+from datetime import datetime, timezone
 from app import app, db
-from models import WhatsAppConnection, Conversation, Message, AutoResponse
-from ai_service import generate_ai_response, analyze_message_intent
+from models import Conversation, Message, canonical_phone
+from ai_service import generate_ai_response, generate_ai_response_future, stream_ai_response, analyze_message_intent, ai_configured
 from baileys_service import baileys_service
+from inbox_service import message_inbox
+from scheduler_service import DeadlineScheduler
+from queue_state_service import queue_state, QueueFlusher
+from presence_service import presence_manager
+from connection_service import connection_state
+from broadcast_service import broadcast_dispatcher
+from events_service import event_broker, message_event, conversation_event
+from stats_service import stats_counters
+from autoresponse_service import auto_response_matcher
+from summary_service import conversation_summarizer
+
+class ReplyStream:
+    """Delivers the pieces of a streamed AI reply in order
+
+    Pieces arrive on the AI engine loop; a single drain task on the send
+    dispatcher sends them one after another (the first one immediately, no
+    typing delay) and shows "typing" again while generation continues.
+    Once generation finished and the last piece went out, the pieces that
+    were sent are saved as one 'ai' Message.
+    """
+
+    def __init__(self, service, conversation_id: int, phone_number: str):
+        self.service = service
+        self.conversation_id = conversation_id
+        self.phone_number = phone_number
+        self.received = 0
+        self.rejected = False
+        self._chunks = deque()
+        self._sent = []
+        self._lock = threading.Lock()
+        self._draining = False
+        self._finished = False
+        self._cancelled = False
+        self._saved = False
+
+    def push(self, text: str):
+        """New piece ready (called on the engine loop; never blocks)"""
+        with self._lock:
+            if self.rejected:
+                return
+            if not self.service.is_usable_ai_reply(text):
+                # Same check as generate_response_for_queue: the caller falls back if nothing went out
+                self.rejected = True
+                logging.info(f"⚠️ Resposta da IA indisponível para {self.phone_number} - restante descartado")
+                return
+            self.received += 1
+            self._chunks.append(text)
+        self._schedule_drain()
+
+    def finish(self):
+        """Generation ended; no more pieces will arrive"""
+        with self._lock:
+            self._finished = True
+        self._schedule_drain()
+
+    def _schedule_drain(self):
+        with self._lock:
+            if self._draining:
+                return
+            self._draining = True
+        self.service.send_dispatcher.schedule(
+            ('stream', self.phone_number, next(self.service._send_ids)), 0, self._drain
+        )
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._chunks or self._cancelled:
+                    self._chunks.clear()
+                    save = self._finished and not self._saved
+                    self._saved = self._saved or save
+                    self._draining = False
+                    break
+                text = self._chunks.popleft()
+            
+            if self._ai_paused():
+                with self._lock:
+                    self._cancelled = True
+                logging.info(f"🚫 IA pausada para {self.phone_number} - restante da resposta descartado")
+                continue
+            
+            if self.service._send_text(self.phone_number, text):
+                self._sent.append(text)
+            
+            with self._lock:
+                more_coming = bool(self._chunks) or not self._finished
+            if more_coming:
+                self.service.start_typing_simulation(self.phone_number)
+        
+        if save and self._sent:
+            self.service._save_response(self.conversation_id, "\n\n".join(self._sent), 'ai')
+    
+    def _ai_paused(self) -> bool:
+        with app.app_context():
+            conversation = db.session.get(Conversation, self.conversation_id)
+            return conversation is None or bool(conversation.ai_paused)
 
 class WhatsAppService:
     """Service for managing WhatsApp integration"""
     
     def __init__(self):
         self.is_connected = False
-        self.typing_threads = {}  # Track typing threads by conversation
-        self.message_queues = {}  # Queue of messages per user
-        self.queue_timers = {}    # Timers for processing queues
         self.QUEUE_WAIT_TIME = 8   # Seconds to wait for additional messages
+        # Pending messages and deadlines live in queue_state (shared by every worker);
+        # the flusher claims due bursts under a lease, so each burst gets exactly one reply
+        self.queue_flusher = QueueFlusher(queue_state)
+        # Claimed bursts run on worker lanes sharded by phone, so one conversation is never processed twice at once
+        self.queue_scheduler = DeadlineScheduler(
+            max_workers=int(os.environ.get('QUEUE_WORKERS', '8')),
+            name='queue-scheduler',
+            shard_by=self._phone_of
+        )
+        self.TYPING_DELAY = float(os.environ.get('TYPING_DELAY', '2'))  # Seconds of "typing" before a reply goes out
+        # Replies are scheduled here instead of sleeping on the worker thread (same phone, same lane: in order)
+        self.send_dispatcher = DeadlineScheduler(
+            max_workers=int(os.environ.get('SEND_WORKERS', '4')),
+            name='send-dispatcher',
+            shard_by=self._phone_of
+        )
+        self._send_ids = itertools.count()
+        # Streaming: first sentences go out while Gemini is still generating the rest
+        self.AI_STREAMING = os.environ.get('AI_STREAMING', 'true').lower() in ('1', 'true', 'yes')
         
+    @staticmethod
+    def _phone_of(key) -> str:
+        """Shard of a scheduler key: the phone itself or the phone inside ('kind', phone, id)"""
+        return key[1] if isinstance(key, tuple) else key
+    
     def generate_qr_code(self):
         """Generate QR code usando Baileys local"""
         try:
@@ -31,16 +150,7 @@ class WhatsAppService:
                 
                 if qr_result.get('success') and qr_result.get('qr_image'):
                     qr_base64 = qr_result.get('qr_image', '')
-                    
-                    with app.app_context():
-                        connection = WhatsAppConnection.query.first()
-                        if not connection:
-                            connection = WhatsAppConnection()
-                            db.session.add(connection)
-                        
-                        connection.qr_code = qr_base64
-                        connection.is_connected = False
-                        db.session.commit()
+                    connection_state.qr_updated(qr_base64)
                     
                     logging.info("✅ QR Code gerado com sucesso!")
                     return qr_base64
@@ -66,73 +176,52 @@ class WhatsAppService:
         logging.info("QR Code gerado - aguardando escaneamento real")
     
     def start_typing_simulation(self, phone_number: str):
-        """Start typing simulation for a conversation"""
-        def typing_worker():
-            # Simulate typing for 2-5 seconds
-            typing_duration = 3
-            logging.info(f"Typing simulation started for {phone_number}")
-            time.sleep(typing_duration)
-            logging.info(f"Typing simulation ended for {phone_number}")
-        
-        # Cancel existing typing thread if any
-        if phone_number in self.typing_threads:
-            self.typing_threads[phone_number] = None
-        
-        # Start new typing thread
-        thread = threading.Thread(target=typing_worker)
-        self.typing_threads[phone_number] = thread
-        thread.start()
+        """Show "typing" for a conversation (coalesced by the presence manager)"""
+        presence_manager.composing(phone_number)
     
     def stop_typing_simulation(self, phone_number: str):
-        """Stop typing simulation when new message received"""
-        if phone_number in self.typing_threads:
-            self.typing_threads[phone_number] = None
-            logging.info(f"Typing simulation interrupted for {phone_number}")
-    
-    def add_message_to_queue(self, phone_number: str, message_content: str, conversation: Conversation):
-        """Add message to queue and manage timer"""
-        # Initialize queue if not exists
-        if phone_number not in self.message_queues:
-            self.message_queues[phone_number] = []
-        
-        # Add message to queue (save only conversation ID to avoid session issues)
-        self.message_queues[phone_number].append({
-            'content': message_content,
-            'timestamp': datetime.utcnow(),
-            'conversation_id': conversation.id
-        })
-        
-        logging.info(f"📥 Mensagem adicionada à fila para {phone_number}. Total na fila: {len(self.message_queues[phone_number])}")
-        
-        # Cancel existing timer if any
-        if phone_number in self.queue_timers:
-            self.queue_timers[phone_number].cancel()
-        
-        # Start typing simulation
-        self.start_typing_simulation(phone_number)
+        """Stop "typing" for a conversation"""
+        presence_manager.paused(phone_number)
+    
+    def add_messages_to_queue(self, items: list):
+        """Add many (phone_number, conversation_id, ai_paused, content) tuples to the queues in one pass"""
+        queues = {}
+        ai_paused = {}
+        for phone_number, conversation_id, paused, message_content in items:
+            queues.setdefault(phone_number, []).append((conversation_id, message_content))
+            ai_paused[phone_number] = paused
         
-        # Create new timer
-        timer = threading.Timer(self.QUEUE_WAIT_TIME, self.process_message_queue, [phone_number])
-        self.queue_timers[phone_number] = timer
-        timer.start()
+        # One write, one deadline and one typing update per phone, however many messages arrived
+        queue_state.append(queues, time.time() + self.QUEUE_WAIT_TIME)
+        self.queue_flusher.wake()
+        for phone_number, paused in ai_paused.items():
+            if not paused:
+                self.start_typing_simulation(phone_number)
         
-        logging.info(f"⏱️ Timer iniciado para {phone_number} ({self.QUEUE_WAIT_TIME}s)")
+        logging.info(f"📥 {len(items)} mensagens adicionadas às filas de {len(queues)} contatos")
     
     def process_message_queue(self, phone_number: str):
-        """Process all queued messages for a user"""
-        if phone_number not in self.message_queues or not self.message_queues[phone_number]:
+        """Process all queued messages for a user
+        
+        Runs only while this worker holds the phone's lease (claimed by the
+        flusher), so one reply per conversation is in progress at a time: a
+        burst that arrives while the previous reply is still generating stays
+        queued and is processed, in order, once that reply was delivered.
+        """
+        handed_off = False
+        try:
+            messages = queue_state.take(phone_number)
+        except Exception as e:
+            logging.error(f"Erro ao ler fila de {phone_number}: {e}")
+            messages = None
+        if not messages:
+            self._reply_done(phone_number)
             return
         
         with app.app_context():
             try:
-                messages = self.message_queues[phone_number].copy()
                 conversation_id = messages[0]['conversation_id']
                 
-                # Clear the queue
-                self.message_queues[phone_number] = []
-                if phone_number in self.queue_timers:
-                    del self.queue_timers[phone_number]
-                
                 # Get fresh conversation object from database in this session
                 conversation = Conversation.query.get(conversation_id)
                 if not conversation:
@@ -142,209 +231,332 @@ class WhatsAppService:
                 # Check if AI is paused for this conversation
                 if conversation.ai_paused:
                     logging.info(f"🚫 IA pausada para {phone_number} - não enviando resposta automática")
+                    self._release_conversation(phone_number, 0)
+                    handed_off = True
                     return
                 
                 logging.info(f"🔄 Processando fila de {len(messages)} mensagens para {phone_number}")
                 
                 # Combine all messages into context
-                combined_messages = []
-                for msg in messages:
-                    combined_messages.append(msg['content'])
+                combined_message = self._combine_messages([msg['content'] for msg in messages])
                 
-                # Generate single response for all messages
-                response_text = self.generate_response_for_queue(combined_messages, conversation)
+                # A geração roda no motor assíncrono; a resposta é finalizada quando ela terminar
+                stream = ReplyStream(self, conversation_id, phone_number) if self.AI_STREAMING else None
+                ai_future = self._start_ai_response(combined_message, conversation, stream.push if stream else None,
+                                                    queued_count=len(messages))
                 
-                # Send response
-                self.send_response(conversation, response_text)
+                # Condensar mensagens antigas em segundo plano quando a conversa cresce
+                conversation_summarizer.maybe_update(conversation)
+                handed_off = True  # _finish_queue_response libera a conversa
+                if ai_future is None:
+                    self._finish_queue_response(conversation.id, phone_number, combined_message, None)
+                else:
+                    ai_future.add_done_callback(
+                        lambda future: self.queue_scheduler.schedule(
+                            ('reply', phone_number, next(self._send_ids)), 0, self._finish_queue_response,
+                            conversation_id, phone_number, combined_message, future, stream
+                        )
+                    )
                 
             except Exception as e:
                 logging.error(f"Erro ao processar fila de mensagens: {e}")
-                # Try to get conversation for fallback
+                self._send_error_fallback(phone_number)
+            finally:
+                if not handed_off:
+                    self._release_conversation(phone_number, self.TYPING_DELAY)
+    
+    def _finish_queue_response(self, conversation_id: int, phone_number: str, combined_message: str, ai_future,
+                               stream=None):
+        """Choose AI/automatic/generic reply once the AI generation resolved, then send it"""
+        release_delay = self.TYPING_DELAY
+        try:
+            if stream is not None:
+                stream.finish()
+                if stream.received:
+                    release_delay = 0
+                    return  # Resposta entregue em pedaços pelo ReplyStream, que a salva inteira
+                # Nada saiu (IA indisponível ou resposta recusada): segue para o fallback abaixo
+            
+            with app.app_context():
                 try:
-                    conversation = Conversation.query.filter_by(phone_number=phone_number).first()
-                    if conversation and not conversation.ai_paused:
-                        self.send_response(conversation, "Desculpe, estou com alguns problemas técnicos. Tente novamente!")
-                except:
-                    logging.error(f"Não foi possível enviar mensagem de fallback para {phone_number}")
+                    conversation = db.session.get(Conversation, conversation_id)
+                    if not conversation:
+                        return
+                    
+                    # Humano pode ter assumido enquanto a IA gerava
+                    if conversation.ai_paused:
+                        logging.info(f"🚫 IA pausada para {phone_number} durante a geração - resposta descartada")
+                        self.stop_typing_simulation(phone_number)
+                        return
+                    
+                    ai_response = ai_future.result() if ai_future else None
+                    response_text, response_type = self.generate_response_for_queue(combined_message, conversation, ai_response)
+                    self.send_response(conversation, response_text, response_type)
+                    
+                except Exception as e:
+                    logging.error(f"Erro ao finalizar resposta da fila: {e}")
+                    self._send_error_fallback(phone_number)
+        finally:
+            self._release_conversation(phone_number, release_delay)
+    
+    def _release_conversation(self, phone_number: str, delay: float):
+        """Mark the reply as done once the sends already scheduled for this phone went out
+        
+        The release runs on the phone's send lane after `delay`, so it comes
+        after every send (and stream chunk) scheduled before it.
+        """
+        self.send_dispatcher.schedule(('release', phone_number, next(self._send_ids)), delay,
+                                      self._reply_done, phone_number)
+    
+    def _reply_done(self, phone_number: str):
+        """Give the phone's lease back; a burst that arrived meanwhile is claimed by the next flush"""
+        try:
+            self.queue_flusher.release(phone_number)
+        except Exception as e:
+            # O lease expira sozinho (QUEUE_LEASE_SECONDS) e a conversa volta a ser atendida
+            logging.error(f"Erro ao liberar a fila de {phone_number}: {e}")
+    
+    def _dispatch_claimed(self, phone_number: str):
+        """Run a burst claimed by the flusher on the phone's queue lane"""
+        self.queue_scheduler.schedule(phone_number, 0, self.process_message_queue, phone_number)
+    
+    def get_lane_stats(self) -> dict:
+        """Lane count, queue depth and utilization of the queue and send lanes, plus the shared queue state"""
+        return {
+            'queue': self.queue_scheduler.get_stats(),
+            'send': self.send_dispatcher.get_stats(),
+            'state': self.queue_flusher.get_stats()
+        }
+    
+    def _send_error_fallback(self, phone_number: str):
+        """Try to send the technical-problems fallback message"""
+        try:
+            conversation = Conversation.find_by_phone(phone_number)
+            if conversation and not conversation.ai_paused:
+                self.send_response(conversation, "Desculpe, estou com alguns problemas técnicos. Tente novamente!", 'fallback')
+        except:
+            logging.error(f"Não foi possível enviar mensagem de fallback para {phone_number}")
     
     def pause_ai_for_conversation(self, phone_number: str):
         """Pause AI responses when human takes over"""
         with app.app_context():
             try:
-                conversation = Conversation.query.filter_by(phone_number=phone_number).first()
+                conversation = Conversation.find_by_phone(phone_number)
                 if conversation:
                     conversation.ai_paused = True
                     conversation.paused_at = datetime.utcnow()
                     db.session.commit()
+                    event_broker.publish('conversation', conversation_event(conversation))
                     logging.info(f"🚫 IA pausada para {phone_number} - humano assumiu o controle")
                     
                     # Clear any pending queue for this user
-                    if phone_number in self.message_queues:
-                        self.message_queues[phone_number] = []
-                    if phone_number in self.queue_timers:
-                        self.queue_timers[phone_number].cancel()
-                        del self.queue_timers[phone_number]
+                    queue_state.discard(phone_number)
+                    self.stop_typing_simulation(phone_number)
                         
             except Exception as e:
                 logging.error(f"Erro ao pausar IA: {e}")
     
-    def process_incoming_message(self, phone_number: str, message_content: str, contact_name: str = ""):
+    def process_incoming_message(self, phone_number: str, message_content: str, contact_name: str = "",
+                                 message_id: str = None, timestamp: str = None):
         """Process incoming WhatsApp message with queue system"""
+        self.process_incoming_batch([{
+            'phone': phone_number,
+            'message': message_content,
+            'contact_name': contact_name,
+            'message_id': message_id,
+            'timestamp': timestamp
+        }])
+    
+    @staticmethod
+    def _parse_timestamp(value):
+        """WhatsApp send time (ISO 8601 from the sidecar) as naive UTC, or None"""
+        if not value:
+            return None
+        try:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    
+    def process_incoming_batch(self, messages: list, upsert_type: str = 'notify'):
+        """Process a whole messages.upsert batch with a single bulk insert
+        
+        Each message keeps its WhatsApp send time, and messages whose WhatsApp
+        id is already stored (inbox retry, history re-synced on reconnect) are
+        skipped instead of being saved and counted again.
+        """
         with app.app_context():
-            # Stop any ongoing typing simulation
-            self.stop_typing_simulation(phone_number)
+            phone_keys = {canonical_phone(item['phone']) for item in messages}
+            conversations = {
+                conversation.phone_key: conversation
+                for conversation in Conversation.query.filter(Conversation.phone_key.in_(phone_keys)).all()
+            }
+            
+            # Create missing conversations
+            for item in messages:
+                if canonical_phone(item['phone']) not in conversations:
+                    conversation = Conversation()
+                    conversation.phone_number = item['phone']
+                    conversation.contact_name = item.get('contact_name') or item['phone']
+                    db.session.add(conversation)
+                    conversations[conversation.phone_key] = conversation
+            db.session.flush()
+            
+            # Messages already stored, by (conversation, WhatsApp id)
+            whatsapp_ids = {item['message_id'] for item in messages if item.get('message_id')}
+            stored = set()
+            if whatsapp_ids:
+                stored = set(db.session.query(Message.conversation_id, Message.whatsapp_id).filter(
+                    Message.conversation_id.in_([conversation.id for conversation in conversations.values()]),
+                    Message.whatsapp_id.in_(whatsapp_ids)
+                ).all())
             
-            # Find or create conversation
-            conversation = Conversation.query.filter_by(phone_number=phone_number).first()
-            if not conversation:
-                conversation = Conversation()
-                conversation.phone_number = phone_number
-                conversation.contact_name = contact_name or phone_number
-                db.session.add(conversation)
+            # Save all new incoming messages at once
+            rows = []
+            for item in messages:
+                conversation = conversations[canonical_phone(item['phone'])]
+                whatsapp_id = item.get('message_id') or None
+                if whatsapp_id:
+                    if (conversation.id, whatsapp_id) in stored:
+                        continue
+                    stored.add((conversation.id, whatsapp_id))
+                incoming_message = Message()
+                incoming_message.conversation_id = conversation.id
+                incoming_message.content = item['message']
+                incoming_message.is_from_user = True
+                incoming_message.message_type = 'text'
+                incoming_message.whatsapp_id = whatsapp_id
+                incoming_message.timestamp = self._parse_timestamp(item.get('timestamp')) or datetime.utcnow()
+                conversation.record_message(incoming_message)
+                rows.append((conversation, incoming_message))
+            
+            if len(rows) < len(messages):
+                logging.info(f"♻️ {len(messages) - len(rows)} mensagens já registradas foram ignoradas")
+            if not rows:
                 db.session.commit()
+                return
             
-            # Save incoming message
-            incoming_message = Message()
-            incoming_message.conversation_id = conversation.id
-            incoming_message.content = message_content
-            incoming_message.is_from_user = True
-            incoming_message.message_type = 'text'
-            db.session.add(incoming_message)
+            db.session.add_all([message for _, message in rows])
+            db.session.flush()
+            # Payloads built before the commit, which would expire (and reload) every row
+            events = [message_event(conversation, message) for conversation, message in rows]
+            queued = [(conversation.phone_number, conversation.id, bool(conversation.ai_paused), message.content)
+                      for conversation, message in rows]
             db.session.commit()
             
-            # Add message to queue
-            self.add_message_to_queue(phone_number, message_content, conversation)
+            for event in events:
+                event_broker.publish('message', event)
+            
+            # History sync ('append') is stored but never answered
+            if upsert_type == 'notify':
+                self.add_messages_to_queue(queued)
     
     def generate_response(self, message_content: str, conversation: Conversation) -> str:
         """Generate AI response using custom prompt for single message"""
         try:
-            # Get recent conversation history for context
-            recent_messages = Message.query.filter_by(
-                conversation_id=conversation.id
-            ).order_by(Message.timestamp.desc()).limit(10).all()
+            # Get recent conversation history (after the rolling summary) for context
+            recent_messages = conversation_summarizer.recent_history(conversation)
             
             # Generate AI response using custom prompt
-            return generate_ai_response(message_content, recent_messages[::-1])
+            return generate_ai_response(message_content, recent_messages, conversation.summary)
             
         except Exception as e:
             logging.error(f"Erro ao gerar resposta: {e}")
             return "Olá! Estou passando por alguns ajustes técnicos. Que tal tentar novamente em alguns minutos?"
     
-    def generate_response_for_queue(self, messages_list: list, conversation: Conversation) -> str:
-        """Generate hybrid AI/fallback response for multiple queued messages"""
+    @staticmethod
+    def _combine_messages(messages_list: list) -> str:
+        """Combine all queued messages into a single context"""
+        if len(messages_list) == 1:
+            return messages_list[0]
+        
+        combined_message = f"O usuário enviou {len(messages_list)} mensagens seguidas:\n\n"
+        for i, msg in enumerate(messages_list, 1):
+            combined_message += f"Mensagem {i}: {msg}\n"
+        combined_message += f"\nPor favor, responda considerando todas essas {len(messages_list)} mensagens de forma integrada."
+        return combined_message
+    
+    @staticmethod
+    def is_usable_ai_reply(ai_response: str) -> bool:
+        """False for empty replies and the "service unavailable" text, which get a fallback instead"""
+        return bool(ai_response) and "não está disponível" not in ai_response.lower()
+    
+    def generate_response_for_queue(self, combined_message: str, conversation: Conversation, ai_response: str = None) -> tuple:
+        """Pick hybrid AI/fallback response for the queued messages
+        
+        Returns (response_text, response_type) where response_type is 'ai', 'auto' or 'fallback'.
+        """
         try:
-            # Combine all queued messages into a single context
-            if len(messages_list) == 1:
-                combined_message = messages_list[0]
-            else:
-                combined_message = f"O usuário enviou {len(messages_list)} mensagens seguidas:\n\n"
-                for i, msg in enumerate(messages_list, 1):
-                    combined_message += f"Mensagem {i}: {msg}\n"
-                combined_message += f"\nPor favor, responda considerando todas essas {len(messages_list)} mensagens de forma integrada."
-            
             # First try: Use AI if available
-            response_text = self._try_ai_response(combined_message, conversation)
-            if response_text:
+            if self.is_usable_ai_reply(ai_response):
                 logging.info(f"🤖 Resposta gerada por IA para {conversation.phone_number}")
-                return response_text
+                return ai_response, 'ai'
             
             # Second try: Use automatic responses as fallback
             response_text = self._try_automatic_response(combined_message, conversation)
             if response_text:
                 logging.info(f"🔄 Resposta automática usada para {conversation.phone_number}")
-                return response_text
+                return response_text, 'auto'
             
             # Final fallback: Generic response
             logging.info(f"⚠️ Usando resposta genérica para {conversation.phone_number}")
-            return "Olá! Obrigado por entrar em contato. No momento estou com limitações, mas em breve retornarei com uma resposta."
+            return "Olá! Obrigado por entrar em contato. No momento estou com limitações, mas em breve retornarei com uma resposta.", 'fallback'
             
         except Exception as e:
             logging.error(f"Erro ao gerar resposta para fila: {e}")
-            return "Olá! Vi que você enviou algumas mensagens. Estou com problemas técnicos no momento, mas vou retornar assim que possível!"
+            return "Olá! Vi que você enviou algumas mensagens. Estou com problemas técnicos no momento, mas vou retornar assim que possível!", 'fallback'
     
-    def _try_ai_response(self, message: str, conversation: Conversation) -> str:
-        """Try to generate AI response if available"""
+    def _start_ai_response(self, message: str, conversation: Conversation, on_chunk=None, queued_count: int = 0):
+        """Start AI generation on the async engine; None if AI is not available
+        
+        With on_chunk the reply is streamed: on_chunk receives WhatsApp-sized pieces
+        as they are generated and the future resolves to the full text (or None).
+        """
         try:
             # Check if AI is available
-            import os
-            if not os.environ.get('GEMINI_API_KEY'):
+            if not ai_configured():
                 logging.debug("IA não disponível: chave API não configurada")
                 return None
             
-            # Get recent conversation history for context
-            recent_messages = Message.query.filter_by(
-                conversation_id=conversation.id
-            ).order_by(Message.timestamp.desc()).limit(10).all()
+            # Get recent conversation history (after the rolling summary) for context
+            recent_messages = conversation_summarizer.recent_history(conversation, queued_count)
             
-            # Generate AI response using custom prompt
-            response = generate_ai_response(message, recent_messages[::-1])
+            # Mensagem única: intenção local (regras + modelo, sem ida ao Gemini) escolhe o nível do modelo
+            message_count = max(queued_count, 1)
+            intent = analyze_message_intent(message, escalate=False) if message_count == 1 else None
             
-            if response and "não está disponível" not in response.lower():
-                return response
-            else:
-                logging.debug("IA retornou resposta de erro ou vazia")
-                return None
+            # Generate AI response using custom prompt
+            if on_chunk:
+                return stream_ai_response(message, recent_messages, on_chunk, conversation.summary, message_count,
+                                          intent=intent)
+            return generate_ai_response_future(message, recent_messages, conversation.summary, message_count,
+                                               intent=intent)
                 
         except Exception as e:
             logging.debug(f"Erro ao tentar IA: {e}")
             return None
     
     def _try_automatic_response(self, message: str, conversation: Conversation) -> str:
-        """Try to find automatic response - simple fallback system"""
+        """Try to find automatic response (compiled matcher, no DB lookups)"""
         try:
-            # Verificar se é a primeira mensagem da conversa
-            message_count = Message.query.filter_by(conversation_id=conversation.id).count()
-            is_first_message = message_count <= 1  # <= 1 porque a mensagem atual ainda não foi salva
-            
-            # Buscar respostas ativas baseadas no tipo de trigger
-            if is_first_message:
-                # Primeira mensagem: buscar triggers de "first_message"
-                responses = AutoResponse.query.filter_by(
-                    is_active=True, 
-                    trigger_type='first_message'
-                ).all()
-                logging.info(f"🎯 Verificando respostas para primeira mensagem de {conversation.phone_number}")
-            else:
-                # Mensagens subsequentes: buscar triggers de "follow_up"
-                responses = AutoResponse.query.filter_by(
-                    is_active=True, 
-                    trigger_type='follow_up'
-                ).all()
-                logging.info(f"🔄 Verificando respostas de continuidade para {conversation.phone_number}")
+            # Verificar se é a primeira mensagem da conversa (contador já carregado)
+            is_first_message = (conversation.message_count or 0) <= 1
             
-            # Sistema simplificado: usar a primeira resposta ativa disponível
-            # Não depende de palavras-chave, qualquer mensagem ativa o fallback
-            if responses:
-                response = responses[0]  # Pega a primeira resposta ativa
-                logging.info(f"✅ Usando resposta automática para {conversation.phone_number}")
+            response = auto_response_matcher.match(message, is_first_message)
+            if response:
+                logging.info(f"✅ Usando resposta automática '{response.keyword}' para {conversation.phone_number}")
                 
                 # Check if this response should pause AI
                 if response.pause_ai:
                     conversation.ai_paused = True
                     conversation.paused_at = datetime.utcnow()
                     db.session.commit()
+                    event_broker.publish('conversation', conversation_event(conversation))
                     logging.info(f"🚫 IA pausada para {conversation.phone_number} após resposta automática")
                 
-                # Montar resposta baseada no tipo
-                if response.response_type == 'multiple' and response.main_question:
-                    # Resposta com múltipla escolha
-                    response_text = response.main_question + "\n\n"
-                    if response.option_a:
-                        response_text += f"a) {response.option_a}\n"
-                    if response.option_b:
-                        response_text += f"b) {response.option_b}\n"
-                    if response.option_c:
-                        response_text += f"c) {response.option_c}\n"
-                    if response.option_d:
-                        response_text += f"d) {response.option_d}\n"
-                    
-                    if response.pause_ai:
-                        response_text += "\n_Aguardando sua escolha..._"
-                    
-                    return response_text
-                else:
-                    # Resposta simples
-                    return response.response_text
+                return response.text
             
             logging.debug(f"Nenhuma resposta automática encontrada ({'primeira mensagem' if is_first_message else 'continuidade'})")
             return None
@@ -353,98 +565,98 @@ class WhatsAppService:
             logging.debug(f"Erro ao buscar resposta automática: {e}")
             return None
     
-    def send_response(self, conversation: Conversation, response_text: str):
-        """Send response message usando Baileys"""
+    def send_response(self, conversation: Conversation, response_text: str, response_type: str = 'ai'):
+        """Schedule response message to go out after the typing delay"""
         try:
-            # Simular digitação antes de enviar
-            baileys_service.set_typing(conversation.phone_number, True)
-            
-            # Aguardar um pouco para simular digitação
-            time.sleep(2)
+            # Simular digitação antes de enviar (já composing desde a fila, sem nova chamada)
+            self.start_typing_simulation(conversation.phone_number)
             
-            # Enviar mensagem via Baileys
-            send_result = baileys_service.send_message(conversation.phone_number, response_text)
-            
-            # Parar digitação
-            baileys_service.set_typing(conversation.phone_number, False)
+            # O envio acontece no dispatcher quando o prazo vencer; o worker fica livre
+            send_key = ('send', conversation.phone_number, next(self._send_ids))
+            self.send_dispatcher.schedule(
+                send_key, self.TYPING_DELAY, self._deliver_response,
+                conversation.id, conversation.phone_number, response_text, response_type
+            )
+                
+        except Exception as e:
+            logging.error(f"Erro ao agendar resposta: {e}")
+    
+    def _deliver_response(self, conversation_id: int, phone_number: str, response_text: str, response_type: str = 'ai'):
+        """Send response message usando Baileys (runs on the send dispatcher)"""
+        try:
+            # Salvar no banco apenas se envio foi bem-sucedido
+            if self._send_text(phone_number, response_text):
+                self._save_response(conversation_id, response_text, response_type)
+        except Exception as e:
+            logging.error(f"Erro ao enviar resposta: {e}")
+    
+    def _send_text(self, phone_number: str, text: str) -> bool:
+        """Send one WhatsApp message via Baileys; True if it went out"""
+        try:
+            send_result = baileys_service.send_message(phone_number, text)
             
             if send_result.get('success'):
-                # Salvar no banco apenas se envio foi bem-sucedido
+                # O envio já encerra o "digitando" no WhatsApp
+                presence_manager.message_sent(phone_number)
+                logging.info(f"📤 Mensagem enviada via Baileys para {phone_number}")
+                return True
+            
+            self.stop_typing_simulation(phone_number)
+            logging.error(f"❌ Erro ao enviar via Baileys: {send_result.get('error')}")
+            return False
+        except Exception as e:
+            logging.error(f"Erro ao enviar resposta: {e}")
+            return False
+    
+    def _save_response(self, conversation_id: int, response_text: str, response_type: str = 'ai'):
+        """Store a reply that went out and notify the dashboard"""
+        try:
+            with app.app_context():
                 response_message = Message()
-                response_message.conversation_id = conversation.id
+                response_message.conversation_id = conversation_id
                 response_message.content = response_text
                 response_message.is_from_user = False
                 response_message.message_type = 'text'
-                response_message.response_type = 'ai'
+                response_message.response_type = response_type
                 
                 db.session.add(response_message)
-                conversation.updated_at = datetime.utcnow()
+                conversation = db.session.get(Conversation, conversation_id)
+                if conversation:
+                    conversation.record_message(response_message)
+                    conversation.updated_at = datetime.utcnow()
                 db.session.commit()
                 
-                logging.info(f"📤 Mensagem enviada via Baileys para {conversation.phone_number}")
-            else:
-                logging.error(f"❌ Erro ao enviar via Baileys: {send_result.get('error')}")
-                
+                if conversation:
+                    event_broker.publish('message', message_event(conversation, response_message))
         except Exception as e:
-            logging.error(f"Erro ao enviar resposta: {e}")
+            logging.error(f"Erro ao salvar resposta: {e}")
     
     def get_connection_status(self):
-        """Get current connection status do Baileys"""
-        with app.app_context():
-            connection = WhatsAppConnection.query.first()
-            if not connection:
-                connection = WhatsAppConnection()
-                db.session.add(connection)
-                db.session.commit()
-            
-            # Verificar status no serviço Baileys
-            try:
-                baileys_status = baileys_service.get_connection_status()
-                
-                if baileys_status.get('success') != False:
-                    # Atualizar status no banco baseado no Baileys
-                    is_connected = baileys_status.get('connected', False)
-                    
-                    connection.is_connected = is_connected
-                    if is_connected:
-                        connection.last_connected = datetime.utcnow()
-                        connection.qr_code = None
-                    
-                    db.session.commit()
-                    
-                    return {
-                        'is_connected': connection.is_connected,
-                        'qr_code': connection.qr_code,
-                        'last_connected': connection.last_connected,
-                        'baileys_status': baileys_status.get('status', 'unknown'),
-                        'qr_available': baileys_status.get('qr_available', False),
-                        'user_info': baileys_status.get('user'),
-                        'service_running': True
-                    }
-                else:
-                    return {
-                        'is_connected': False,
-                        'qr_code': connection.qr_code,
-                        'last_connected': connection.last_connected,
-                        'baileys_status': 'service_error',
-                        'service_running': False,
-                        'error': baileys_status.get('error', 'Serviço não está rodando')
-                    }
-                    
-            except Exception as e:
-                # Fallback para status local
-                return {
-                    'is_connected': connection.is_connected,
-                    'qr_code': connection.qr_code,
-                    'last_connected': connection.last_connected,
-                    'baileys_status': 'error',
-                    'service_running': False,
-                    'error': str(e)
-                }
+        """Get current connection status (in-memory snapshot kept fresh by webhooks)"""
+        return connection_state.get_status()
 
 # Global service instance
 whatsapp_service = WhatsAppService()
 
+def handle_inbound_event(payload: dict):
+    """Drenar evento da caixa de entrada para Conversation/Message e fila de debounce"""
+    if payload.get('kind') == 'batch':
+        whatsapp_service.process_incoming_batch(payload['messages'], payload.get('type', 'notify'))
+        return
+    
+    whatsapp_service.process_incoming_message(
+        payload['phone'], payload['message'], payload.get('contact_name', ''),
+        payload.get('message_id'), payload.get('timestamp')
+    )
+
+message_inbox.start(handle_inbound_event)
+whatsapp_service.queue_flusher.start(whatsapp_service._dispatch_claimed)
+connection_state.add_listener(lambda snapshot: event_broker.publish('connection', snapshot))
+connection_state.start()
+stats_counters.start()
+baileys_service.start()
+broadcast_dispatcher.start()
+
 def simulate_incoming_messages():
     """Simulate incoming messages for testing"""
     import random